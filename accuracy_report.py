@@ -0,0 +1,93 @@
+import numpy as np
+
+import argparse
+from importlib import import_module
+
+from utils.parameters import *
+from utils.numpy_functions import (
+    np_allocate,
+    np_equilibrium,
+    np_inivel,
+    np_obstacle_fun,
+    np_step,
+    np_streaming_slices,
+)
+
+from functools import partial
+
+BACKENDS = {
+    "cpu": "utils.numba_cpu_kernels",
+    "numba": "utils.numba_kernels",
+    "cupy": "utils.cupy_kernels",
+}
+
+parser = argparse.ArgumentParser(
+    description="Compare each precision against the float64 numpy reference"
+)
+parser.add_argument("--backend", choices=BACKENDS, default="cpu", help="Kernels to check")
+parser.add_argument("-i", type=int, default=1000, dest="iterations", help="Number of iterations")
+parser.add_argument("-s", type=int, default=100, dest="stride", help="Report every s iterations")
+
+
+def errors(a, b):
+    """Relative L2 error and maximum absolute error of `a` against `b`."""
+    diff = a.astype(np.float64) - b
+    return np.linalg.norm(diff) / np.linalg.norm(b), np.abs(diff).max()
+
+
+def main(args):
+    backend = import_module(BACKENDS[args.backend])
+    TPB1D, BPG1D = backend.dispatch1D(ny)
+    TPB2D, BPG2D = backend.dispatch2D(nx, ny)
+
+    obstacle = np.fromfunction(partial(np_obstacle_fun, cx=cx, cy=cy, r=r), (nx, ny))
+    vel = np.fromfunction(partial(np_inivel, ly=ly, uLB=uLB), (2, nx, ny))
+
+    # float64 numpy reference
+    fin = np_equilibrium(1, vel, v, t)
+    fout, feq, rho, u, tmp = np_allocate(nx, ny)
+    slices = np_streaming_slices(v)
+
+    # Kernels and arrays of each precision
+    states = {}
+    for name, (store, _) in PRECISIONS.items():
+        k = backend.specialize(name)
+        d_rho = backend.to_device(np.full((nx, ny), 1.0, dtype=store))
+        d_omega, d_obstacle, d_vel = map(
+            backend.to_device,
+            (np.full((nx, ny), omega, dtype=store), obstacle, vel.astype(store)),
+        )
+        d_fin, d_feq, d_fout = (backend.device_array((9, nx, ny), store) for _ in range(3))
+        d_u = backend.device_array((2, nx, ny), store)
+        k.equilibrium[BPG2D, TPB2D](d_rho, d_vel, d_fin, nx, ny)
+        states[name] = (k, d_rho, d_omega, d_obstacle, d_vel, d_fin, d_feq, d_fout, d_u)
+
+    print(
+        "{:>9}  {:>8}  {:>12}  {:>12}  {:>12}".format(
+            "iteration", "mode", "rel. L2 u", "max |du|", "rel. L2 rho"
+        )
+    )
+    for time in range(1, args.iterations + 1):
+        np_step(fin, fout, feq, rho, u, tmp, vel, obstacle, omega, v, t, slices)
+
+        for name, state in states.items():
+            k, d_rho, d_omega, d_obstacle, d_vel, d_fin, d_feq, d_fout, d_u = state
+            k.outflow[BPG1D, TPB1D](d_fin, nx, ny)
+            k.macroscopic[BPG2D, TPB2D](d_fin, d_rho, d_u, nx, ny)
+            k.inflow[BPG1D, TPB1D](d_u, d_vel, d_rho, d_fin, ny)
+            k.equilibrium[BPG2D, TPB2D](d_rho, d_u, d_feq, nx, ny)
+            k.update_fin[BPG1D, TPB1D](d_fin, d_feq, ny)
+            k.collision[BPG2D, TPB2D](d_omega, d_fin, d_feq, d_fout, nx, ny)
+            k.bounce_back[BPG2D, TPB2D](d_fout, d_fin, d_obstacle, nx, ny)
+            k.streaming_step[BPG2D, TPB2D](d_fin, d_fout, nx, ny)
+
+            if time % args.stride == 0:
+                eu, mu = errors(backend.to_host(d_u), u)
+                erho, _ = errors(backend.to_host(d_rho), rho)
+                print(
+                    "{:>9}  {:>8}  {:>12.3e}  {:>12.3e}  {:>12.3e}".format(time, name, eu, mu, erho)
+                )
+
+
+if __name__ == "__main__":
+    main(parser.parse_args())
@@ -2,20 +2,31 @@ from importlib import import_module
 import argparse
 
 parser = argparse.ArgumentParser()
-parser.add_argument("-p", action="store_true", dest="pickle", help="Generate pickle test files")
+parser.add_argument(
+    "-p", action="store_true", dest="fixtures", help="Generate the reference fixtures of the tests"
+)
 parser.add_argument("-c", action="store_true", dest="cupy", help="Run cupy test files")
-args = parser.parse_args()
+parser.add_argument(
+    "-n", action="store_true", dest="numpy", help="Run CPU (numpy and numba CPU) test files"
+)
+if __name__ == "__main__":
+    # Test files may start processes which import this module again
+    args = parser.parse_args()
 
-if args.pickle:
-    print("Generate pickle test files ...")
-    import_module("tests.pickle-test")
-    print("Finished.")
-else:
-    if args.cupy:
-        print("Running cupy tests ...")
-        import_module("tests.cupy-test")
+    if args.fixtures:
+        print("Generate test fixtures ...")
+        import_module("tests.fixtures-test")
         print("Finished.")
     else:
-        print("Running numba tests ...")
-        import_module("tests.numba-test")
-        print("Finished.")
+        if args.numpy:
+            print("Running CPU tests ...")
+            import_module("tests.numpy-test")
+            print("Finished.")
+        elif args.cupy:
+            print("Running cupy tests ...")
+            import_module("tests.cupy-test")
+            print("Finished.")
+        else:
+            print("Running numba tests ...")
+            import_module("tests.numba-test")
+            print("Finished.")
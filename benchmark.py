@@ -0,0 +1,284 @@
+import numpy as np
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+from importlib import import_module
+
+from utils.parameters import precision, dtype, layout, v, t
+from utils.numpy_functions import np_allocate, np_equilibrium, np_step, np_streaming_slices
+from utils.simulation import LatticeConfig, Simulation
+
+from functools import partial
+from time import perf_counter as pf
+
+# Kernel modules (one kernel per stage, fused or in-place scheme) and whole-array
+# steppers (the numpy and cupy scripts, which have no kernels to time)
+BACKENDS = {
+    "cpu": "utils.numba_cpu_kernels",
+    "numba": "utils.numba_kernels",
+    "cupy": "utils.cupy_kernels",
+}
+ARRAYS = {
+    "numpy": "utils.numpy_functions",
+    "cupy-array": "utils.cupy_functions",
+}
+SCHEMES = ("stages", "fused", "inplace")
+
+
+def size(text):
+    nx, ny = text.lower().split("x")
+    return int(nx), int(ny)
+
+
+parser = argparse.ArgumentParser(
+    description="MLUPS of a whole step and time of each kernel, per backend and lattice size"
+)
+parser.add_argument(
+    "--backend",
+    nargs="+",
+    choices=list(BACKENDS) + list(ARRAYS),
+    default=["numpy", "cpu"],
+    help="Backends to measure (default: %(default)s)",
+)
+parser.add_argument(
+    "--scheme",
+    nargs="+",
+    choices=SCHEMES,
+    default=list(SCHEMES),
+    help="Schemes of the kernel backends (default: all)",
+)
+parser.add_argument(
+    "--sizes",
+    nargs="+",
+    type=size,
+    default=[(256, 176), (512, 352), (1024, 704)],
+    metavar="NXxNY",
+    help="Lattice sizes (default: 256x176 512x352 1024x704)",
+)
+parser.add_argument("--steps", type=int, default=20, help="Steps (or launches) per sample")
+parser.add_argument("--warmup", type=int, default=5, help="Steps before the first sample")
+parser.add_argument("--repeats", type=int, default=7, help="Number of samples")
+parser.add_argument(
+    "--no-tune", action="store_true", help="Default launch configurations instead of the autotuner"
+)
+parser.add_argument("-o", "--output", default=None, help="Write the results in this JSON file")
+
+
+def stats(samples):
+    """Median and interquartile range of `samples`."""
+    q1, median, q3 = np.percentile(samples, [25, 50, 75])
+    return {"median": float(median), "iqr": float(q3 - q1)}
+
+
+def measure(launch, synchronize, steps, repeats):
+    """Seconds per call of `launch`, one sample every `steps` calls."""
+    samples = []
+    for _ in range(repeats):
+        synchronize()
+        start = pf()
+        for _ in range(steps):
+            launch()
+        synchronize()
+        samples.append((pf() - start) / steps)
+    return samples
+
+
+def kernel_backend(backend, scheme, nx, ny, tune):
+    """Whole step, launch of each kernel of `scheme`, synchronisation and steps in
+    a single call (`Simulation.advance`)."""
+    s = Simulation(LatticeConfig(nx, ny), backend, scheme, tune)
+    k = s.k
+    launches = {
+        "stages": {
+            "outflow": lambda: k.outflow(s.d_fin, nx, ny),
+            "macroscopic": lambda: k.macroscopic(s.d_fin, s.d_rho, s.d_u, nx, ny),
+            "inflow": lambda: k.inflow(s.d_u, s.d_vel, s.d_rho, s.d_fin, ny),
+            "equilibrium": lambda: k.equilibrium(s.d_rho, s.d_u, s.d_feq, nx, ny),
+            "update_fin": lambda: k.update_fin(s.d_fin, s.d_feq, ny),
+            "collision": lambda: k.collision(s.d_omega, s.d_fin, s.d_feq, s.d_fout, nx, ny),
+            "bounce_back_cells": lambda: k.bounce_back_cells(
+                s.d_fout, s.d_fin, s.d_cells, s.d_cells.shape[1]
+            ),
+            "streaming_step": lambda: k.streaming_step(s.d_fin, s.d_fout, nx, ny),
+            "streaming_tiled": lambda: k.streaming_tiled(
+                s.d_fin, s.d_fout, s.d_rows, s.d_cols, nx, ny
+            ),
+        },
+        "fused": {
+            "collide_and_stream": lambda: k.collide_and_stream(
+                s.d_fin,
+                s.d_fout,
+                s.d_vel,
+                s.d_obstacle,
+                s.d_omega,
+                s.d_rho,
+                s.d_u,
+                nx,
+                ny,
+            ),
+        },
+        "inplace": {
+            "aa_outflow": lambda: k.aa_outflow(s.d_fin, s.time % 2, nx, ny),
+            "aa_step": lambda: k.aa_step(
+                s.d_fin,
+                s.time % 2,
+                s.d_vel,
+                s.d_obstacle,
+                s.d_omega,
+                s.d_rho,
+                s.d_u,
+                nx,
+                ny,
+            ),
+        },
+    }[scheme]
+    return s.step, launches, backend.synchronize, s.advance
+
+
+def array_backend(name, nx, ny):
+    """Whole step of the numpy or cupy script (no kernel to time)."""
+    config = LatticeConfig(nx, ny)
+    obstacle, vel, omega = config.obstacle(), config.velocity(), config.omega
+    if name == "numpy":
+        # float64, as `lbmFlowAroundCylinder.py`
+        fin = np_equilibrium(1, vel, v, t)
+        fout, feq, rho, u, tmp = np_allocate(nx, ny)
+        slices = np_streaming_slices(v)
+        step = partial(np_step, fin, fout, feq, rho, u, tmp, vel, obstacle, omega, v, t, slices)
+        return step, {}, lambda: None, None
+
+    cupy = import_module("cupy")
+    cupy_functions = import_module(ARRAYS[name])
+    obstacle, vel = cupy.asarray(obstacle), cupy.asarray(vel.astype(dtype))
+    fin = cupy_functions.cp_equilibrium(1, vel)
+    step = partial(cupy_functions.cp_step, fin, vel, obstacle, omega)
+    return step, {}, cupy.cuda.runtime.deviceSynchronize, None
+
+
+def metadata(names):
+    """Commit, configuration and devices of the run, to compare results files."""
+
+    def git(*command):
+        try:
+            return subprocess.run(
+                ("git",) + command, capture_output=True, text=True, check=True
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    versions = {"python": platform.python_version(), "numpy": np.__version__}
+    devices = {}
+    for name in names:
+        if name in BACKENDS:
+            devices[name] = import_module(BACKENDS[name]).device_name()
+        library = "numba" if name in ("cpu", "numba") else None if name == "numpy" else "cupy"
+        if library is not None:
+            versions[library] = import_module(library).__version__
+    return {
+        "commit": git("rev-parse", "HEAD"),
+        "dirty": bool(git("status", "--porcelain", "--untracked-files=no")),
+        "precision": precision,
+        "layout": layout,
+        "simulator": os.environ.get("NUMBA_ENABLE_CUDASIM") == "1",
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "cpus": os.cpu_count(),
+        "devices": devices,
+        "versions": versions,
+    }
+
+
+def main(args):
+    results = []
+    print(
+        "{:>10}  {:>8}  {:>10}  {:>20}  {:>12}  {:>10}".format(
+            "backend", "scheme", "size", "kernel", "median (us)", "MLUPS"
+        )
+    )
+    for name in args.backend:
+        for scheme in args.scheme if name in BACKENDS else ("array",):
+            for nx, ny in args.sizes:
+                if name in BACKENDS:
+                    backend = import_module(BACKENDS[name])
+                    step, launches, synchronize, advance = kernel_backend(
+                        backend, scheme, nx, ny, not args.no_tune
+                    )
+                else:
+                    step, launches, synchronize, advance = array_backend(name, nx, ny)
+
+                # Warm-up: compilation, autotuning and caches
+                for _ in range(args.warmup):
+                    step()
+                seconds = measure(step, synchronize, args.steps, args.repeats)
+                mlups = [nx * ny / s / 1e6 for s in seconds]
+                result = {
+                    "backend": name,
+                    "scheme": scheme,
+                    "nx": nx,
+                    "ny": ny,
+                    "step_seconds": stats(seconds),
+                    "mlups": stats(mlups),
+                    "kernels": {},
+                }
+                label = "{}x{}".format(nx, ny)
+                print(
+                    "{:>10}  {:>8}  {:>10}  {:>20}  {:>12.1f}  {:>10.2f}".format(
+                        name,
+                        scheme,
+                        label,
+                        "step",
+                        result["step_seconds"]["median"] * 1e6,
+                        result["mlups"]["median"],
+                    )
+                )
+                if advance is not None:
+                    # The same steps in one call per sample, after the compilation of
+                    # the loops or the capture of the graph
+                    advance(args.steps)
+                    calls = measure(partial(advance, args.steps), synchronize, 1, args.repeats)
+                    seconds = [s / args.steps for s in calls]
+                    result["advance_seconds"] = stats(seconds)
+                    result["advance_mlups"] = stats([nx * ny / s / 1e6 for s in seconds])
+                    print(
+                        "{:>10}  {:>8}  {:>10}  {:>20}  {:>12.1f}  {:>10.2f}".format(
+                            name,
+                            scheme,
+                            label,
+                            "advance",
+                            result["advance_seconds"]["median"] * 1e6,
+                            result["advance_mlups"]["median"],
+                        )
+                    )
+                # Kernels launched alone (their results are not meaningful anymore)
+                for kernel, launch in launches.items():
+                    result["kernels"][kernel] = stats(
+                        measure(launch, synchronize, args.steps, args.repeats)
+                    )
+                    print(
+                        "{:>10}  {:>8}  {:>10}  {:>20}  {:>12.1f}".format(
+                            name, scheme, label, kernel, result["kernels"][kernel]["median"] * 1e6
+                        )
+                    )
+                results.append(result)
+
+    if args.output:
+        report = {
+            "metadata": metadata(args.backend),
+            "settings": {
+                "steps": args.steps,
+                "warmup": args.warmup,
+                "repeats": args.repeats,
+                "tuned": not args.no_tune,
+            },
+            "results": results,
+        }
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=1)
+    return results
+
+
+if __name__ == "__main__":
+    main(parser.parse_args())
@@ -0,0 +1,88 @@
+import argparse
+
+from utils import numba_cpu_kernels as backend
+from utils.parameters import depth, tile
+from utils.simulation import LatticeConfig, Simulation
+
+from time import perf_counter as pf
+
+
+def size(text):
+    rows, cols = text.lower().split("x")
+    return int(rows), int(cols)
+
+
+parser = argparse.ArgumentParser(
+    description="Speedup of the temporal blocking of the numba CPU kernels over the stage loop"
+)
+parser.add_argument(
+    "--sizes",
+    nargs="+",
+    type=size,
+    default=[(256, 176), (1024, 704)],
+    metavar="NXxNY",
+    help="Lattice sizes (default: 256x176 1024x704)",
+)
+parser.add_argument(
+    "--tiles",
+    nargs="+",
+    type=size,
+    default=[tile, (32, 704), (64, 64), (128, 128)],
+    metavar="ROWSxCOLS",
+    help="Tile sizes (default: the one of utils/parameters.py, 32x704 64x64 128x128)",
+)
+parser.add_argument(
+    "--depths",
+    nargs="+",
+    type=int,
+    default=[1, 2, depth, 8],
+    help="Steps per tile (default: 1 2 8 and the one of utils/parameters.py)",
+)
+parser.add_argument("-i", type=int, default=24, dest="iterations", help="Steps per measure")
+parser.add_argument("-r", type=int, default=5, dest="repeats", help="Measures per simulation")
+
+ROW = "{:>10}  {:>9}  {:>5}  {:>10.2f}  {:>8.2f}  {:>7.2f}"
+
+
+def measure(sim, iterations, repeats):
+    """Seconds per step of `sim.advance`, best of `repeats` calls of `iterations`
+    steps after a first call to compile."""
+    sim.advance(iterations)
+    best = float("inf")
+    for _ in range(repeats):
+        start = pf()
+        sim.advance(iterations)
+        best = min(best, (pf() - start) / iterations)
+    return best
+
+
+def main(args):
+    print(
+        "{:>10}  {:>9}  {:>5}  {:>10}  {:>8}  {:>7}".format(
+            "size", "tile", "depth", "time (ms)", "MLUPS", "speedup"
+        )
+    )
+    for nx, ny in args.sizes:
+        config = LatticeConfig(nx, ny)
+        name = "{}x{}".format(nx, ny)
+        # Baseline: the stage loop (`stages_steps`), then the fused loop (`fused_steps`),
+        # both one pass over the lattice per step
+        baseline = None
+        for scheme in ("stages", "fused"):
+            sim = Simulation(config, backend, scheme, tune=False)
+            seconds = measure(sim, args.iterations, args.repeats)
+            baseline = baseline or seconds
+            mlups = nx * ny / seconds / 1e6
+            print(ROW.format(name, scheme, 1, seconds * 1e3, mlups, baseline / seconds))
+        for rows, cols in args.tiles:
+            for steps in sorted(set(args.depths)):
+                blocking = (rows, cols, steps)
+                sim = Simulation(config, backend, "fused", tune=False, blocking=blocking)
+                seconds = measure(sim, args.iterations, args.repeats)
+                tile = "{}x{}".format(rows, cols)
+                mlups = nx * ny / seconds / 1e6
+                print(ROW.format(name, tile, steps, seconds * 1e3, mlups, baseline / seconds))
+
+
+if __name__ == "__main__":
+    main(parser.parse_args())
@@ -1,71 +1,182 @@
-import numpy
-import cupy
-
 import cv2
 import cmapy
 
+import argparse
+
 from utils.cupy_kernels import *
+from utils import cupy_kernels as backend
+from utils.simulation import LatticeConfig, Simulation, next_output
+from utils.video import FrameExporter
 from utils.parameters import *
-from utils.numpy_functions import np_obstacle_fun, np_inivel
-
-from functools import partial
+from utils.checkpoint import (
+    add_arguments,
+    check_checkpoint,
+    load_checkpoint,
+    save_checkpoint,
+)
+from utils.profiler import Profiler, add_trace_arguments
+from utils.store import FieldWriter, open_store, snapshot
+from utils.store import add_arguments as add_store_arguments
+from utils.forces import ForceLog
+from utils.forces import add_arguments as add_force_arguments
+from utils.probes import ProbeLog, Probes
+from utils.probes import add_arguments as add_probe_arguments
+
+parser = argparse.ArgumentParser()
+mode = parser.add_mutually_exclusive_group()
+mode.add_argument(
+    "--fused",
+    action="store_true",
+    help="Use the fused collide-and-stream kernel instead of one kernel per stage",
+)
+mode.add_argument(
+    "--inplace",
+    action="store_true",
+    help="Stream in place in a single population array (AA pattern)",
+)
+mode.add_argument(
+    "--tiled",
+    action="store_true",
+    help="Stream through tiles in shared memory in the kernel per stage",
+)
+add_arguments(parser)
+add_trace_arguments(parser)
+add_store_arguments(parser)
+add_force_arguments(parser)
+add_probe_arguments(parser)
 
 INTNX = nx
 INTNY = ny
 
-TPB1D, BPG1D = dispatch1D(ny)
-TPB2D, BPG2D = dispatch(nx, ny)
-
 frameSize = (INTNX, INTNY)
 path_video = "output_video.avi"
 bin_loader = cv2.VideoWriter_fourcc(*"DIVX")
 out = cv2.VideoWriter(path_video, bin_loader, 120, frameSize)
-
-
-def main():
-    # Numpy part
-    obstacle = numpy.fromfunction(partial(np_obstacle_fun, cx=cx, cy=cy, r=r), (nx, ny))
-    vel = numpy.fromfunction(partial(np_inivel, ly=ly, uLB=uLB), (2, nx, ny))
-
-    # GPU part
-    d_rho = cupy.full((nx, ny), 1.0)
-    d_omega = cupy.full((nx, ny), omega)
-
-    d_obstacle, d_vel, d_v, d_t = map(cupy.array, (obstacle, vel, v, t))
-    d_fin = cupy.zeros((9, nx, ny))
-    d_u = cupy.zeros((2, nx, ny))
-    d_feq = cupy.zeros((9, nx, ny))
-    d_fout = cupy.zeros((9, nx, ny))
-
-    equilibrium[BPG2D, TPB2D](d_rho, d_vel, d_v, d_t, d_fin, INTNX, INTNY)
-
-    for time in range(maxIter + 1):
-        outflow[BPG1D, TPB1D](d_fin, INTNX, INTNY)
-
-        macroscopic[BPG2D, TPB2D](d_fin, d_v, d_rho, d_u, INTNX, INTNY)
-
-        inflow[BPG1D, TPB1D](d_u, d_vel, d_rho, d_fin, INTNY)
-
-        equilibrium[BPG2D, TPB2D](d_rho, d_u, d_v, d_t, d_feq, INTNX, INTNY)
-
-        update_fin[BPG1D, TPB1D](d_fin, d_feq, INTNY)
-
-        collision[BPG2D, TPB2D](d_omega, d_fin, d_feq, d_fout, INTNX, INTNY)
-
-        bounce_back[BPG2D, TPB2D](d_fout, d_feq, d_obstacle, INTNX, INTNY)
-
-        streaming_step[BPG2D, TPB2D](d_fin, d_fout, d_v, INTNX, INTNY)
-
-        if time % 10 == 0 and time != 0:
-            print(round(100 * time / maxIter, 3), "%")
-            u = d_u.get()
-            arr = np.sqrt(u[0] ** 2 + u[1] ** 2).transpose()
-            new_arr = ((arr / arr.max()) * 255).astype("uint8")
-            img_colorized = cv2.applyColorMap(new_arr, cmapy.cmap("plasma"))
-            out.write(img_colorized)
-
+colormap = cmapy.cmap("plasma")
+
+
+def write_frame(frame):
+    out.write(cv2.applyColorMap(frame, colormap))
+
+
+def main(args):
+    fused, inplace, tiled = args.fused, args.inplace, args.tiled
+    resume, every, trace = args.resume, args.checkpoint_every, args.trace
+    store, forces, probes = args.store, args.forces, bool(args.probe or args.probe_line)
+    scheme = "fused" if fused else "inplace" if inplace else "stages"
+    config = LatticeConfig()
+    # Kernels and copies are only probed with --trace
+    profiler = Profiler(backend, nx, ny, dtype) if trace else None
+
+    if resume:
+        # State saved before iteration `first` (`fin`, `vel` and `obstacle`, and the
+        # sum of the forces since the last line of --forces)
+        checkpoint = load_checkpoint(args.checkpoint)
+        check_checkpoint(checkpoint, scheme, config.parameters())
+        first, state = checkpoint.time, checkpoint.arrays
+    else:
+        first, state = 0, {}
+
+    # Ring of `probes_every` samples on the device, copied to the host before it wraps
+    sensors = (
+        Probes(args.probe, args.probe_line, not args.nearest, args.probes_every) if probes else None
+    )
+
+    # Arrays stored in `layout` on the device. Launch configurations are timed on
+    # the first launch of each kernel (or read from the cache).
+    sim = Simulation(
+        config,
+        backend,
+        scheme,
+        time=first,
+        profiler=profiler,
+        tiled=tiled,
+        forces=bool(forces),
+        probes=sensors,
+        **state,
+    )
+    if forces:
+        # Forces summed on the device, two scalars copied every `forces_every` iterations
+        log = ForceLog(forces, config, resume, first)
+    if probes:
+        # Samples of every step copied to the host every `probes_every` iterations
+        probe_log = ProbeLog(args.probes_file, sensors, resume, first)
+    # Frames are reduced on the device, colormapped and encoded in a background thread
+    exporter = FrameExporter(
+        backend,
+        sim.kernels if profiler is None else profiler.wrap(sim.kernels),
+        write_frame,
+        nx,
+        ny,
+        dtype,
+        layout,
+        profiler=profiler,
+    )
+    if store:
+        # Snapshots are copied on a separate stream and written in a background thread
+        writer = FieldWriter(
+            open_store(args, nx, ny, config.parameters(), resume, first),
+            backend,
+            nx,
+            ny,
+            dtype,
+            layout,
+            profiler=profiler,
+        )
+
+    time = first
+    while time <= maxIter:
+        # Iterations up to the next output replayed from a CUDA graph
+        last = next_output(
+            time,
+            maxIter,
+            10,
+            every,
+            ((args.store_every, args.store_fin_every) if store else ())
+            + ((args.forces_every,) if forces else ())
+            + ((args.probes_every,) if probes else ()),
+        )
+        sim.advance(last + 1 - time)
+
+        if last % 10 == 0 and last != 0:
+            print(round(100 * last / maxIter, 3), "%")
+            exporter.push(sim.d_u)
+
+        arrays = snapshot(args, sim, last) if store else {}
+        if arrays:
+            writer.push(last, **arrays)
+
+        if forces and last % args.forces_every == 0:
+            log.write(last, sim.forces())
+
+        if probes and last % args.probes_every == 0:
+            probe_log.write(*sim.samples())
+
+        if every and (last + 1) % every == 0:
+            save_checkpoint(
+                args.checkpoint,
+                last + 1,
+                scheme,
+                config.parameters(),
+                fin=sim.populations(),
+                vel=sim.vel.astype(dtype),
+                obstacle=sim.obstacle,
+                **sim.forces_state(),
+            )
+        time = last + 1
+
+    exporter.close()
     out.release()
+    if store:
+        writer.close()
+    if forces:
+        log.close()
+    if probes:
+        probe_log.write(*sim.samples())
+        probe_log.close()
+    if profiler is not None:
+        profiler.report(profiler.export(trace))
 
 
 if __name__ == "__main__":
-    main()
+    main(parser.parse_args())
@@ -0,0 +1,76 @@
+import numpy as np
+
+import argparse
+from importlib import import_module
+
+from utils.parameters import *
+from utils.numpy_functions import np_equilibrium, np_inivel, np_obstacle_fun
+from utils.profiler import traffic
+
+from functools import partial
+from time import perf_counter as pf
+
+BACKENDS = {
+    "cpu": "utils.numba_cpu_kernels",
+    "numba": "utils.numba_kernels",
+    "cupy": "utils.cupy_kernels",
+}
+
+parser = argparse.ArgumentParser(
+    description="Effective bandwidth of the kernels for each memory layout"
+)
+parser.add_argument("--backend", choices=BACKENDS, default="cpu", help="Kernels to measure")
+parser.add_argument("-i", type=int, default=100, dest="iterations", help="Launches per kernel")
+
+
+def measure(backend, launch, iterations):
+    """Seconds per launch of `launch`, after a first launch to compile."""
+    launch()
+    backend.synchronize()
+    start = pf()
+    for _ in range(iterations):
+        launch()
+    backend.synchronize()
+    return (pf() - start) / iterations
+
+
+def main(args):
+    backend = import_module(BACKENDS[args.backend])
+    obstacle = np.fromfunction(partial(np_obstacle_fun, cx=cx, cy=cy, r=r), (nx, ny))
+    vel = np.fromfunction(partial(np_inivel, ly=ly, uLB=uLB), (2, nx, ny)).astype(dtype)
+    fin = np_equilibrium(1, vel, v, t).astype(dtype)
+    rho = np.full((nx, ny), 1.0, dtype=dtype)
+    omega_ = np.full((nx, ny), omega, dtype=dtype)
+
+    print("{:>6}  {:>18}  {:>10}  {:>8}".format("layout", "kernel", "time (us)", "GB/s"))
+    for name in LAYOUTS:
+        k = backend.specialize(precision, name)
+        TPB2D, BPG2D = backend.dispatch2D(nx, ny, name)
+        d_fin, d_vel, d_obstacle, d_omega, d_rho = (
+            backend.layout_array(array, name) for array in (fin, vel, obstacle, omega_, rho)
+        )
+        d_feq, d_fout = (backend.layout_empty((9, nx, ny), dtype, name) for _ in range(2))
+        d_u = backend.layout_empty((2, nx, ny), dtype, name)
+        k.macroscopic[BPG2D, TPB2D](d_fin, d_rho, d_u, nx, ny)
+
+        launches = {
+            "macroscopic": lambda: k.macroscopic[BPG2D, TPB2D](d_fin, d_rho, d_u, nx, ny),
+            "equilibrium": lambda: k.equilibrium[BPG2D, TPB2D](d_rho, d_u, d_feq, nx, ny),
+            "collision": lambda: k.collision[BPG2D, TPB2D](d_omega, d_fin, d_feq, d_fout, nx, ny),
+            "bounce_back": lambda: k.bounce_back[BPG2D, TPB2D](d_fout, d_fin, d_obstacle, nx, ny),
+            "streaming_step": lambda: k.streaming_step[BPG2D, TPB2D](d_feq, d_fout, nx, ny),
+            "collide_and_stream": lambda: k.collide_and_stream[BPG2D, TPB2D](
+                d_fin, d_fout, d_vel, d_obstacle, d_omega, d_rho, d_u, nx, ny
+            ),
+        }
+        nbytes = traffic(dtype.itemsize)
+        for kernel, launch in launches.items():
+            seconds = measure(backend, launch, args.iterations)
+            bandwidth = nx * ny * nbytes[kernel] / seconds / 1e9
+            print(
+                "{:>6}  {:>18}  {:>10.1f}  {:>8.2f}".format(name, kernel, seconds * 1e6, bandwidth)
+            )
+
+
+if __name__ == "__main__":
+    main(parser.parse_args())
@@ -25,21 +25,38 @@ import numpy as np
 import matplotlib.pyplot as plt
 from matplotlib import cm
 
+import argparse
+
+from utils.numpy_functions import np_allocate, np_equilibrium, np_step, np_streaming_slices
+from utils.checkpoint import (
+    add_arguments,
+    check_checkpoint,
+    load_checkpoint,
+    save_checkpoint,
+)
+from utils.simulation import LatticeConfig
+
+parser = argparse.ArgumentParser()
+add_arguments(parser)
+
 # from numba import *
 
 # from time import perf_counter as pf
 
 ###### Flow definition #################################################
-maxIter = 15 * 5 * 10  # 200000  # Total number of time iterations.
-Re = 150.0  # Reynolds number.
-nx, ny = 1024 // 4, 22 * 32 // 4  # Numer of lattice nodes.
-ly = ny - 1  # Height of the domain in lattice units.
-cx, cy, r = nx // 4, ny // 2, ny // 9  # Coordinates of the cylinder.
-uLB = 0.04  # Velocity in lattice units.
-nulb = uLB * r / Re
-# Viscoscity in lattice units.
-omega = 1 / (3 * nulb + 0.5)
-# Relaxation parameter.
+# Number of lattice nodes, Reynolds number, velocity in lattice units and total
+# number of time iterations. The cylinder and the relaxation parameter follow.
+# `np_step` is the BGK collision in float64.
+config = LatticeConfig(
+    1024 // 4,
+    22 * 32 // 4,
+    Re=150.0,
+    uLB=0.04,
+    maxIter=15 * 5 * 10,
+    precision="float64",
+    operator="bgk",
+)
+nx, ny, maxIter = config.nx, config.ny, config.maxIter
 
 ###### Lattice Constants ###############################################
 v = np.array([[1, 1], [1, 0], [1, -1], [0, 1], [0, 0], [0, -1], [-1, 1], [-1, 0], [-1, -1]])
@@ -59,99 +76,45 @@ col3 = np.array([6, 7, 8])
 #  /  |  \
 # 8   5   2
 
-###### Function Definitions ############################################
-def macroscopic(fin):
-    """Compute macroscopic variables (density, velocity)
-    fluid density is 0th moment of distribution functions
-    fluid velocity components are 1st order moments of dist. functions
-    """
-    rho = np.sum(fin, axis=0)
-    u = np.zeros((2, nx, ny))
-    for i in range(9):
-        u[0, :, :] += v[i, 0] * fin[i, :, :]
-        u[1, :, :] += v[i, 1] * fin[i, :, :]
-    u /= rho
-    return rho, u
-
-
-def equilibrium(rho, u):
-    """Equilibrium distribution function."""
-    usqr = 3 / 2 * (u[0] ** 2 + u[1] ** 2)
-    feq = np.zeros((9, nx, ny))
-    for i in range(9):
-        cu = 3 * (v[i, 0] * u[0, :, :] + v[i, 1] * u[1, :, :])
-        feq[i, :, :] = rho * t[i] * (1 + cu + 0.5 * cu ** 2 - usqr)
-    return feq
-
-
-#
-# Setup: cylindrical obstacle and velocity inlet with perturbation
-#
-# Creation of a mask with boolean values, defining the shape of the obstacle.
-#
-def obstacle_fun(x, y):
-    return (x - cx) ** 2 + (y - cy) ** 2 < r ** 2
-
-
-# Initial velocity profile:
-# almost zero, with a slight perturbation to trigger the instability.
-def inivel(d, x, y):
-    return (1.0 - d) * uLB * (1.0 + 1e-4 * np.sin(y / ly * 2.0 * np.pi))
-
 
 #############################################################
-def main():
-
-    # create obstacle mask array from element-wise function
-    obstacle = np.fromfunction(obstacle_fun, (nx, ny))
-
-    # initial velocity field vx,vy from element-wise function
-    # vel is also used for inflow border condition
-    vel = np.fromfunction(inivel, (2, nx, ny))
-
-    # Initialization of the populations at equilibrium
-    # with the given velocity.
-    fin = equilibrium(1, vel)
+def main(args):
+    resume, every = args.resume, args.checkpoint_every
+
+    if resume:
+        # State saved before iteration `first` (`fin` is copied from the memory map)
+        checkpoint = load_checkpoint(args.checkpoint)
+        check_checkpoint(checkpoint, "numpy", config.parameters())
+        first = checkpoint.time
+        obstacle, vel = checkpoint.arrays["obstacle"], checkpoint.arrays["vel"]
+        fin = np.array(checkpoint.arrays["fin"])
+    else:
+        first = 0
+
+        # create obstacle mask array from element-wise function
+        obstacle = config.obstacle()
+
+        # initial velocity field vx,vy from element-wise function
+        # vel is also used for inflow border condition
+        vel = config.velocity()
+
+        # Initialization of the populations at equilibrium
+        # with the given velocity.
+        fin = np_equilibrium(1, vel, v, t)
+
+    # Buffers reused by every iteration (see `np_step` for the details of a step).
+    fout, feq, rho, u, tmp = np_allocate(nx, ny)
+    slices = np_streaming_slices(v)
 
     ###### Main time loop ########
-    for time in range(maxIter + 1):
+    for time in range(first, maxIter + 1):
 
         # if time == 1:
         #     start = pf()
 
-        # Right wall: outflow condition.
-        # we only need here to specify distrib. function for velocities
-        # that enter the domain (other that go out, are set by the streaming step)
-        fin[col3, nx - 1, :] = fin[col3, nx - 2, :]
-
-        # Compute macroscopic variables, density and velocity.
-        rho, u = macroscopic(fin)
-
-        # Left wall: inflow condition.
-        u[:, 0, :] = vel[:, 0, :]
-        rho[0, :] = (
-            1
-            / (1 - u[0, 0, :])
-            * (np.sum(fin[col2, 0, :], axis=0) + 2 * np.sum(fin[col3, 0, :], axis=0))
-        )
-
-        # Compute equilibrium.
-        feq = equilibrium(rho, u)
-        fin[[0, 1, 2], 0, :] = (
-            feq[[0, 1, 2], 0, :] + fin[[8, 7, 6], 0, :] - feq[[8, 7, 6], 0, :]
-        )
-
-        # Collision step.
-        fout = fin - omega * (fin - feq)
-
-        # Bounce-back condition for obstacle.
-        # in python language, we "slice" fout by obstacle
-        for i in range(9):
-            fout[i, obstacle] = fin[8 - i, obstacle]
-
-        # Streaming step.
-        for i in range(9):
-            fin[i, :, :] = np.roll(np.roll(fout[i, :, :], v[i, 0], axis=0), v[i, 1], axis=1)
+        # Outflow, macroscopic variables, inflow, equilibrium, collision,
+        # bounce-back and streaming without temporary arrays.
+        np_step(fin, fout, feq, rho, u, tmp, vel, obstacle, config.omega, v, t, slices)
 
         # Visualization of the velocity.
         if time % 10 == 0 and time != 0:
@@ -159,9 +122,20 @@ def main():
             plt.clf()
             plt.imshow(np.sqrt(u[0] ** 2 + u[1] ** 2).transpose(), cmap=cm.Reds)
             plt.savefig("./ref/vel.{0:04d}.png".format(time // 10))
+
+        if every and (time + 1) % every == 0:
+            save_checkpoint(
+                args.checkpoint,
+                time + 1,
+                "numpy",
+                config.parameters(),
+                fin=fin,
+                vel=vel,
+                obstacle=obstacle,
+            )
     # print(pf() - start)
 
 
 if __name__ == "__main__":
     # execute only if run as a script
-    main()
+    main(parser.parse_args())
@@ -1,72 +1,254 @@
-import numpy as np
 from numba import int64
 
 import cv2
 import cmapy
 
-from utils.numba_kernels import *
+import argparse
+
+from utils.checkpoint import (
+    add_arguments,
+    check_checkpoint,
+    load_checkpoint,
+    save_checkpoint,
+)
+from utils.profiler import Profiler, add_trace_arguments
+from utils.store import FieldWriter, open_store, snapshot
+from utils.store import add_arguments as add_store_arguments
+from utils.forces import ForceLog
+from utils.forces import add_arguments as add_force_arguments
+from utils.probes import ProbeLog, Probes
+from utils.probes import add_arguments as add_probe_arguments
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--cpu", action="store_true", help="Run the kernels on all the CPU cores")
+parser.add_argument(
+    "--scaling",
+    action="store_true",
+    help="Report MLUPS against the number of CPU threads (with --cpu, no video)",
+)
+mode = parser.add_mutually_exclusive_group()
+mode.add_argument(
+    "--fused",
+    action="store_true",
+    help="Use the fused collide-and-stream kernel instead of one kernel per stage",
+)
+mode.add_argument(
+    "--inplace",
+    action="store_true",
+    help="Stream in place in a single population array (AA pattern)",
+)
+mode.add_argument(
+    "--tiled",
+    action="store_true",
+    help="Stream through tiles in shared memory in the kernel per stage",
+)
+mode.add_argument(
+    "--blocked",
+    action="store_true",
+    help="Fused scheme advanced several steps per tile while in cache (with --cpu)",
+)
+parser.add_argument("-i", type=int, default=None, dest="iterations", help="Number of iterations")
+add_arguments(parser)
+add_trace_arguments(parser)
+add_store_arguments(parser)
+add_force_arguments(parser)
+add_probe_arguments(parser)
+
+from utils.simulation import LatticeConfig, Simulation, next_output
+from utils.video import FrameExporter
 from utils.parameters import *
-from utils.numpy_functions import np_obstacle_fun, np_inivel
 
 from functools import partial
+from importlib import import_module
+from time import perf_counter as pf
 
 INTNX = int64(nx)
 INTNY = int64(ny)
 
-TPB1D, BPG1D = dispatch1D(ny)
-TPB2D, BPG2D = dispatch(nx, ny)
-
 frameSize = (INTNX, INTNY)
 path_video = "output_video.avi"
-bin_loader = cv2.VideoWriter_fourcc(*"DIVX")
-out = cv2.VideoWriter(path_video, bin_loader, 120, frameSize)
-
-
-def main():
-    # Numpy part
-    obstacle = np.fromfunction(partial(np_obstacle_fun, cx=cx, cy=cy, r=r), (nx, ny))
-    vel = np.fromfunction(partial(np_inivel, ly=ly, uLB=uLB), (2, nx, ny))
-    rho = np.full((nx, ny), 1.0)
-    omega_ = np.full((nx, ny), omega)
-
-    # GPU part
-    d_omega, d_obstacle = map(cuda.to_device, (omega_, obstacle))
-
-    d_rho, d_vel, d_v, d_t = map(cuda.to_device, (rho, vel, v, t))
-    d_fin = cuda.device_array((9, nx, ny))
-    d_u = cuda.device_array((2, nx, ny))
-    d_feq = cuda.device_array((9, nx, ny))
-    d_fout = cuda.device_array((9, nx, ny))
-
-    equilibrium[BPG2D, TPB2D](d_rho, d_vel, d_v, d_t, d_fin, INTNX, INTNY)
-
-    for time in range(maxIter + 1):
-        outflow[BPG1D, TPB1D](d_fin, INTNX, INTNY)
-
-        macroscopic[BPG2D, TPB2D](d_fin, d_v, d_rho, d_u, INTNX, INTNY)
-
-        inflow[BPG1D, TPB1D](d_u, d_vel, d_rho, d_fin, INTNY)
-
-        equilibrium[BPG2D, TPB2D](d_rho, d_u, d_v, d_t, d_feq, INTNX, INTNY)
-
-        update_fin[BPG1D, TPB1D](d_fin, d_feq, INTNY)
-
-        collision[BPG2D, TPB2D](d_omega, d_fin, d_feq, d_fout, INTNX, INTNY)
-
-        bounce_back[BPG2D, TPB2D](d_fout, d_feq, d_obstacle, INTNX, INTNY)
-
-        streaming_step[BPG2D, TPB2D](d_fin, d_fout, d_v, INTNX, INTNY)
-
-        if time % 10 == 0 and time != 0:
+colormap = cmapy.cmap("plasma")
+
+
+def write_frame(out, frame):
+    out.write(cv2.applyColorMap(frame, colormap))
+
+
+def parse_args():
+    args = parser.parse_args()
+    if args.scaling and not args.cpu:
+        parser.error("--scaling requires --cpu")
+    if args.blocked and not args.cpu:
+        parser.error("--blocked requires --cpu")
+    if args.blocked and (args.forces or args.probe or args.probe_line):
+        parser.error("--forces and probes cannot be used with --blocked")
+    return args
+
+
+def main(args, maxIter=maxIter, video=True):
+    # Kernels of the CPU (--cpu) or of the GPU
+    backend = import_module("utils.numba_cpu_kernels" if args.cpu else "utils.numba_kernels")
+    fused, inplace, tiled, blocked = args.fused, args.inplace, args.tiled, args.blocked
+    resume, every, trace = args.resume, args.checkpoint_every, args.trace
+    store, forces, probes = args.store, args.forces, bool(args.probe or args.probe_line)
+    scheme = "fused" if fused or blocked else "inplace" if inplace else "stages"
+    # Tiles and steps per tile of the temporal blocking (`utils/parameters.py`)
+    blocking = (*tile, depth) if blocked else None
+    # Checkpoints of the blocked fused scheme are only continued by the same scheme
+    mode = "blocked" if blocked else scheme
+    config = LatticeConfig(maxIter=maxIter)
+    # Kernels and copies are only probed with --trace
+    profiler = Profiler(backend, nx, ny, dtype) if trace else None
+
+    if resume:
+        # State saved before iteration `first` (`fin`, `vel` and `obstacle`, and the
+        # sum of the forces since the last line of --forces)
+        checkpoint = load_checkpoint(args.checkpoint)
+        check_checkpoint(checkpoint, mode, config.parameters())
+        first, state = checkpoint.time, checkpoint.arrays
+    else:
+        first, state = 0, {}
+
+    # Ring of `probes_every` samples on the device, copied to the host before it wraps
+    sensors = (
+        Probes(args.probe, args.probe_line, not args.nearest, args.probes_every) if probes else None
+    )
+
+    # Arrays stored in `layout` on the device. Launch configurations are timed on
+    # the first launch of each kernel (or read from the cache).
+    sim = Simulation(
+        config,
+        backend,
+        scheme,
+        time=first,
+        profiler=profiler,
+        tiled=tiled,
+        blocking=blocking,
+        forces=bool(forces),
+        probes=sensors,
+        **state,
+    )
+    if forces:
+        # Forces summed on the device, two scalars copied every `forces_every` iterations
+        log = ForceLog(forces, config, resume, first)
+    if probes:
+        # Samples of every step copied to the host every `probes_every` iterations
+        probe_log = ProbeLog(args.probes_file, sensors, resume, first)
+
+    if video:
+        bin_loader = cv2.VideoWriter_fourcc(*"DIVX")
+        out = cv2.VideoWriter(path_video, bin_loader, 120, frameSize)
+        # Frames are reduced on the device, colormapped and encoded in a background thread
+        exporter = FrameExporter(
+            backend,
+            sim.kernels if profiler is None else profiler.wrap(sim.kernels),
+            partial(write_frame, out),
+            nx,
+            ny,
+            dtype,
+            layout,
+            profiler=profiler,
+        )
+
+    if store:
+        # Snapshots are copied on the device and written in a background thread
+        writer = FieldWriter(
+            open_store(args, nx, ny, config.parameters(), resume, first),
+            backend,
+            nx,
+            ny,
+            dtype,
+            layout,
+            profiler=profiler,
+        )
+
+    def output(time):
+        # Frame, snapshot and checkpoint after the iteration `time`
+        if video and time % 10 == 0 and time != 0:
             print(round(100 * time / maxIter, 3), "%")
-            u = d_u.copy_to_host()
-            arr = np.sqrt(u[0] ** 2 + u[1] ** 2).transpose()
-            new_arr = ((arr / arr.max()) * 255).astype("uint8")
-            img_colorized = cv2.applyColorMap(new_arr, cmapy.cmap("plasma"))
-            out.write(img_colorized)
-
-    out.release()
+            exporter.push(sim.d_u)
+
+        arrays = snapshot(args, sim, time) if store else {}
+        if arrays:
+            writer.push(time, **arrays)
+
+        if forces and time % args.forces_every == 0:
+            log.write(time, sim.forces())
+
+        if probes and time % args.probes_every == 0:
+            probe_log.write(*sim.samples())
+
+        if every and (time + 1) % every == 0:
+            save_checkpoint(
+                args.checkpoint,
+                time + 1,
+                mode,
+                config.parameters(),
+                fin=sim.populations(),
+                vel=sim.vel.astype(dtype),
+                obstacle=sim.obstacle,
+                **sim.forces_state(),
+            )
+
+    sim.advance(1)
+    output(first)
+    backend.synchronize()
+    start = pf()
+    time = first + 1
+    while time <= maxIter:
+        # Python is only touched between two outputs
+        last = next_output(
+            time,
+            maxIter,
+            10 if video else 0,
+            every,
+            ((args.store_every, args.store_fin_every) if store else ())
+            + ((args.forces_every,) if forces else ())
+            + ((args.probes_every,) if probes else ()),
+        )
+        sim.advance(last + 1 - time)
+        output(last)
+        time = last + 1
+
+    backend.synchronize()
+    # Million lattice updates per second (the first iteration includes compilation)
+    mlups = nx * ny * (maxIter - first) / (pf() - start) / 1e6
+
+    if video:
+        exporter.close()
+        out.release()
+    if store:
+        writer.close()
+    if forces:
+        log.close()
+    if probes:
+        probe_log.write(*sim.samples())
+        probe_log.close()
+    if profiler is not None:
+        profiler.report(profiler.export(trace))
+    return mlups
 
 
 if __name__ == "__main__":
-    main()
+    args = parse_args()
+    if args.scaling:
+        from utils.numba_cpu_kernels import set_num_threads, thread_counts
+
+        n = args.iterations or 20
+        # Time loop only: no output
+        outputs = dict(
+            resume=False,
+            checkpoint_every=0,
+            trace=None,
+            store=None,
+            forces=None,
+            probe=None,
+            probe_line=None,
+        )
+        quiet = argparse.Namespace(**{**vars(args), **outputs})
+        print("threads  MLUPS")
+        for threads in thread_counts():
+            set_num_threads(threads)
+            print("{:>7}  {:.2f}".format(threads, main(quiet, n, video=False)))
+    else:
+        print("MLUPS:", round(main(args, args.iterations or maxIter), 2))
@@ -1,15 +1,26 @@
 import cupy
-import numpy
 
 from utils.cupy_kernels import *
+from utils import cupy_kernels as backend
+from utils.autotune import Autotuner
+from utils.video import FrameExporter
+from utils.ensemble import Ensemble
+from utils.simulation import SCHEMES, LatticeConfig, Simulation
+from utils.sparse import SparseSimulation
+from utils.decomposition import Decomposition
+from utils.probes import Probes
+from utils.store import FieldStore, FieldWriter
 from utils.parameters import *
 from utils.numpy_functions import *
+from tests.fixtures import fixtures
 
-import pickle
-from functools import partial
+import tempfile
 from pathlib import Path
 
-PATH = Path().absolute() / "tests" / "picklefiles"
+# Lattice of the fixtures (see `tests.fixtures`), smaller than `utils.parameters`
+nx, ny, omega = fixtures.lattice.nx, fixtures.lattice.ny, fixtures.lattice.omega
+obstacle, vel = fixtures.lattice.obstacle(), fixtures.lattice.velocity()
+
 
 # Colors
 class bcolors:
@@ -46,125 +57,568 @@ def testing(name=""):
 
 @testing(name="Equilibrium")
 def test_equilibrium(i):
-    rho, u, v, t = pickle.load(open(PATH / "equilibrium-test-{}.pkl".format(i), "rb"))
+    s, ref = fixtures.state(i), fixtures.load("step-{}".format(i))
     feq = cupy.zeros((9, nx, ny))
 
-    d_rho, d_u, d_v, d_t = map(cupy.array, (rho, u, v, t))
+    d_rho, d_u = map(cupy.array, (s.inflow_rho, s.inflow_u))
 
-    threadsperblock, blockspergrid = dispatch(nx, ny)
-    equilibrium[blockspergrid, threadsperblock](d_rho, d_u, d_v, d_t, feq, nx, ny)
+    threadsperblock, blockspergrid = dispatch2D(nx, ny, layout)
+    equilibrium[blockspergrid, threadsperblock](d_rho, d_u, feq, nx, ny)
     a = feq.get()
-    b = np_equilibrium(rho, u, v, t)
-    return [np.linalg.norm(a - b)]
+    return [np.linalg.norm(a - ref["feq"])]
 
 
 @testing(name="Outflow")
 def test_outflow(i):
-    fin, col3 = pickle.load(open(PATH / "outflow-test-{}.pkl".format(i), "rb"))
+    s, ref = fixtures.state(i), fixtures.load("step-{}".format(i))
 
-    d_fin = cupy.array(fin)
+    d_fin = cupy.array(s.fin)
 
     threadsperblock, blockspergrid = dispatch1D(ny)
     outflow[blockspergrid, threadsperblock](d_fin, nx, ny)
     a = d_fin.get()
-    np_outflow(fin, col3, nx)
-    b = fin
-    return [np.linalg.norm(a - b)]
+    # Only the last row is written
+    return [np.linalg.norm(a[:, -1] - ref["outflow"]), np.linalg.norm(a[:, :-1] - s.fin[:, :-1])]
 
 
 @testing(name="Macroscopic")
 def test_macroscopic(i):
-    fin, v = pickle.load(open(PATH / "macroscopic-test-{}.pkl".format(i), "rb"))
+    s, ref = fixtures.state(i), fixtures.load("step-{}".format(i))
     u = cupy.zeros((2, nx, ny))
     rho = cupy.zeros((nx, ny))
 
-    threadsperblock, blockspergrid = dispatch(nx, ny)
-    d_fin, d_v = map(cupy.array, (fin, v))
-    macroscopic[blockspergrid, threadsperblock](d_fin, d_v, rho, u, nx, ny)
+    threadsperblock, blockspergrid = dispatch2D(nx, ny, layout)
+    d_fin = cupy.array(s.outflowed)
+    macroscopic[blockspergrid, threadsperblock](d_fin, rho, u, nx, ny)
     a1 = rho.get()
     a2 = u.get()
-    b1, b2 = np_macroscopic(fin, v)
-    return [np.linalg.norm(a1 - b1), np.linalg.norm(a2 - b2)]
+    return [np.linalg.norm(a1 - ref["rho"]), np.linalg.norm(a2 - ref["u"])]
 
 
 @testing(name="Inflow")
 def test_inflow(i):
-    u, vel, rho, fin, col2, col3 = pickle.load(
-        open(PATH / "inflow-test-{}.pkl".format(i), "rb")
-    )
+    s, ref = fixtures.state(i), fixtures.load("step-{}".format(i))
 
     threadsperblock, blockspergrid = dispatch1D(ny)
-    d_u, d_vel, d_rho, d_fin = map(cupy.array, (u, vel, rho, fin))
+    d_u, d_vel, d_rho, d_fin = map(cupy.array, (s.u, vel, s.rho, s.outflowed))
     inflow[blockspergrid, threadsperblock](d_u, d_vel, d_rho, d_fin, ny)
     a1 = d_rho.get()
     a2 = d_u.get()
-    np_inflow(u, vel, rho, fin, col2, col3)
-    b1, b2 = rho, u
-    return [np.linalg.norm(a1 - b1), np.linalg.norm(a2 - b2)]
+    # Only the first row is written
+    return [
+        np.linalg.norm(a1[0] - ref["inflow_rho"]),
+        np.linalg.norm(a2[:, 0] - ref["inflow_u"]),
+        np.linalg.norm(a1[1:] - s.rho[1:]),
+        np.linalg.norm(a2[:, 1:] - s.u[:, 1:]),
+    ]
 
 
 @testing(name="Update fin")
 def test_updatefin(i):
-    fin, feq = pickle.load(open(PATH / "updatefin-test-{}.pkl".format(i), "rb"))
+    s, ref = fixtures.state(i), fixtures.load("step-{}".format(i))
 
-    d_fin, d_feq = map(cupy.array, (fin, feq))
+    d_fin, d_feq = map(cupy.array, (s.outflowed, s.feq))
 
     threadsperblock, blockspergrid = dispatch1D(ny)
     update_fin[blockspergrid, threadsperblock](d_fin, d_feq, ny)
     a = d_fin.get()
-    np_update_fin(fin, feq)
-    b = fin
-    return [np.linalg.norm(a - b)]
+    # Only the first row is written
+    return [
+        np.linalg.norm(a[:, 0] - ref["update_fin"]),
+        np.linalg.norm(a[:, 1:] - s.outflowed[:, 1:]),
+    ]
 
 
 @testing(name="Collision")
 def test_collision(i):
-    fin, feq, omega = pickle.load(open(PATH / "collision-test-{}.pkl".format(i), "rb"))
+    s, ref = fixtures.state(i), fixtures.load("step-{}".format(i))
     fout = cupy.zeros((9, nx, ny))
 
-    threadsperblock, blockspergrid = dispatch(nx, ny)
+    threadsperblock, blockspergrid = dispatch2D(nx, ny, layout)
     omega_ = np.full((nx, ny), omega)
-    d_fin, d_feq, d_omega = map(cupy.array, (fin, feq, omega_))
+    d_fin, d_feq, d_omega = map(cupy.array, (s.updated, s.feq, omega_))
     collision[blockspergrid, threadsperblock](d_omega, d_fin, d_feq, fout, nx, ny)
     a = fout.get()
-    b = np_collision(fin, feq, omega)
-    return [np.linalg.norm(a - b)]
+    return [np.linalg.norm(a - ref["collision"])]
 
 
 @testing(name="Bounce back")
 def test_bounce_back(i):
-    fout, feq, obstacle = pickle.load(open(PATH / "bounceback-test-{}.pkl".format(i), "rb"))
+    s, ref = fixtures.state(i), fixtures.load("step-{}".format(i))
+
+    threadsperblock, blockspergrid = dispatch2D(nx, ny, layout)
+    d_fout, d_fin, d_obstacle = map(cupy.array, (s.collided, s.updated, obstacle))
+    bounce_back[blockspergrid, threadsperblock](d_fout, d_fin, d_obstacle, nx, ny)
+    a = d_fout.get()
+    # Only the cells of the obstacle are written
+    return [
+        np.linalg.norm(a[:, obstacle] - ref["bounce_back"]),
+        np.linalg.norm(a[:, ~obstacle] - s.collided[:, ~obstacle]),
+    ]
+
+
+@testing(name="Bounce back of the boundary cells")
+def test_bounce_back_cells(i):
+    s, ref = fixtures.state(i), fixtures.load("step-{}".format(i))
+    cells = np_boundary_cells(obstacle, v)
 
-    threadsperblock, blockspergrid = dispatch(nx, ny)
-    d_fout, d_feq, d_obstacle = map(cupy.array, (fout, feq, obstacle))
-    bounce_back[blockspergrid, threadsperblock](d_fout, d_feq, d_obstacle, nx, ny)
+    threadsperblock, blockspergrid = dispatch1D(cells.shape[1])
+    d_fout, d_fin, d_cells = map(cupy.array, (s.collided, s.updated, cells))
+    bounce_back_cells[blockspergrid, threadsperblock](d_fout, d_fin, d_cells, cells.shape[1])
     a = d_fout.get()
-    np_bounce_back(fout, feq, obstacle)
-    b = fout
-    return [np.linalg.norm(a - b)]
+    # Same populations streamed into the fluid as the bounce-back of the whole obstacle
+    streamed = np.empty_like(a)
+    np_streaming_step(streamed, a, v)
+    return [np.linalg.norm(streamed[:, ~obstacle] - ref["streamed"][:, ~obstacle])]
 
 
 @testing(name="Streaming step")
 def test_streaming_step(i):
-    fin, fout, v = pickle.load(open(PATH / "streaming-test-{}.pkl".format(i), "rb"))
+    s, ref = fixtures.state(i), fixtures.load("step-{}".format(i))
 
-    threadsperblock, blockspergrid = dispatch(nx, ny)
-    d_fin, d_fout, d_v = map(cupy.array, (fin, fout, v))
-    streaming_step[blockspergrid, threadsperblock](d_fin, d_fout, d_v, nx, ny)
+    threadsperblock, blockspergrid = dispatch2D(nx, ny, layout)
+    d_fin, d_fout = map(cupy.array, (s.fin, s.bounced))
+    streaming_step[blockspergrid, threadsperblock](d_fin, d_fout, nx, ny)
     a = d_fin.get()
-    np_streaming_step(fin, fout, v)
-    b = fin
-    return [np.linalg.norm(a - b)]
+    return [np.linalg.norm(a - ref["streamed"])]
+
+
+@testing(name="Tiled streaming")
+def test_streaming_tiled(i):
+    s, ref = fixtures.state(i), fixtures.load("step-{}".format(i))
+    streamed = ref["streamed"]
+    norms = []
+    # Tiles follow the contiguous axis of every layout
+    for name in LAYOUTS:
+        kernels = backend.specialize(precision, name)
+        threadsperblock, blockspergrid = dispatch_tiled(nx, ny, name)
+        d_fin = layout_empty((9, nx, ny), np.float64, name)
+        d_fout = layout_array(s.bounced, name)
+        d_rows, d_cols = map(cupy.array, (np_halo_indices(nx), np_halo_indices(ny)))
+        kernels.streaming_tiled[blockspergrid, threadsperblock](
+            d_fin, d_fout, d_rows, d_cols, nx, ny
+        )
+        norms.append(np.linalg.norm(to_host(d_fin) - streamed))
+    return norms
+
+
+@testing(name="Collide and stream")
+def test_collide_and_stream(i):
+    s, ref = fixtures.state(i), fixtures.load("step-{}".format(i))
+    fout = cupy.zeros((9, nx, ny))
+    rho = cupy.zeros((nx, ny))
+    u = cupy.zeros((2, nx, ny))
+
+    threadsperblock, blockspergrid = dispatch2D(nx, ny, layout)
+    omega_ = np.full((nx, ny), omega)
+    d_fin, d_vel, d_obstacle, d_omega = map(cupy.array, (s.fin, vel, obstacle, omega_))
+    collide_and_stream[blockspergrid, threadsperblock](
+        d_fin, fout, d_vel, d_obstacle, d_omega, rho, u, nx, ny
+    )
+    a1 = fout.get()
+    a2 = rho.get()
+    a3 = u.get()
+    return [
+        np.linalg.norm(a1 - ref["streamed"]),
+        np.linalg.norm(a2 - s.inflow_rho),
+        np.linalg.norm(a3 - s.inflow_u),
+    ]
+
+
+@testing(name="In-place (AA) streaming")
+def test_aa(i):
+    s = fixtures.state(i)
+    rho = cupy.zeros((nx, ny))
+    u = cupy.zeros((2, nx, ny))
+
+    threadsperblock, blockspergrid = dispatch2D(nx, ny, layout)
+    threadsperblock1D, blockspergrid1D = dispatch1D(ny)
+    omega_ = np.full((nx, ny), omega)
+    d_fin, d_vel, d_obstacle, d_omega = map(cupy.array, (s.fin, vel, obstacle, omega_))
+    norms = []
+    # An even and an odd step
+    for parity in range(2):
+        aa_outflow[blockspergrid1D, threadsperblock1D](d_fin, parity, nx, ny)
+        aa_step[blockspergrid, threadsperblock](
+            d_fin, parity, d_vel, d_obstacle, d_omega, rho, u, nx, ny
+        )
+        a1 = np_aa_populations(d_fin.get(), 1 - parity, v)
+        a2 = u.get()
+        ref = fixtures.load("step-{}".format(i + parity))
+        b2 = fixtures.state(i + parity).inflow_u
+        norms += [np.linalg.norm(a1 - ref["streamed"]), np.linalg.norm(a2 - b2)]
+    return norms
+
+
+@testing(name="Memory layouts")
+def test_layouts(i):
+    s, ref = fixtures.state(i), fixtures.load("step-{}".format(i))
+    omega_ = np.full((nx, ny), omega)
+    results = []
+    for name in LAYOUTS:
+        kernels = specialize("float64", name)
+        threadsperblock, blockspergrid = dispatch2D(nx, ny, name)
+        d_fin, d_vel, d_obstacle, d_omega = (
+            layout_array(array, name) for array in (s.fin, vel, obstacle, omega_)
+        )
+        fout = layout_empty((9, nx, ny), np.float64, name)
+        rho = layout_empty((nx, ny), np.float64, name)
+        u = layout_empty((2, nx, ny), np.float64, name)
+        kernels.collide_and_stream[blockspergrid, threadsperblock](
+            d_fin, fout, d_vel, d_obstacle, d_omega, rho, u, nx, ny
+        )
+        results.append((fout.get(), u.get()))
+    b1, b3 = ref["streamed"], s.inflow_u
+    return [np.linalg.norm(a - b) for a1, a3 in results for a, b in ((a1, b1), (a3, b3))]
+
+
+@testing(name="Autotuner")
+def test_autotune(i):
+    s, ref = fixtures.state(i), fixtures.load("step-{}".format(i))
+    fout = cupy.zeros((9, nx, ny))
+    rho = cupy.zeros((nx, ny))
+    u = cupy.zeros((2, nx, ny))
+    omega_ = np.full((nx, ny), omega)
+    d_fin, d_vel, d_obstacle, d_omega = map(cupy.array, (s.fin, vel, obstacle, omega_))
+    cache = Path(tempfile.mkdtemp()) / "autotune.json"
+    specialization = (precision, layout, "field", operator)
+    # A tuner started before the winners are saved keeps them when saving its own
+    other = Autotuner(backend, cache)
+    tuner = Autotuner(backend, cache, repeats=1)
+    k = tuner.tune(kernels, nx, ny, specialization)
+    k.collide_and_stream(d_fin, fout, d_vel, d_obstacle, d_omega, rho, u, nx, ny)
+    a1 = fout.get()
+    # The winner is reloaded from the cache without timing
+    tuner = Autotuner(backend, cache)
+    reloaded = tuner.tune(kernels, nx, ny, specialization)
+    reloaded.collide_and_stream(d_fin, fout, d_vel, d_obstacle, d_omega, rho, u, nx, ny)
+    same = reloaded.collide_and_stream.config == k.collide_and_stream.config
+    other.save("other", [1, 1])
+    merged = Autotuner(backend, cache).cache
+    kept = reloaded.collide_and_stream.key in merged and "other" in merged
+    # Every compiled kernel has its own winner
+    keys = {
+        tuner.key("collide_and_stream", nx, ny, (name, layout, relaxation, op))
+        for name in PRECISIONS
+        for relaxation in ("scalar", "field")
+        for op in ("bgk", "trt", "regularized")
+    }
+    return [
+        np.linalg.norm(a1 - ref["streamed"]),
+        tuner.timed,
+        float(not same),
+        float(not kept),
+        3 * 2 * 3 - len(keys),
+    ]
+
+
+@testing(name="Frame export")
+def test_frames(i):
+    u = fixtures.state(i).u
+    frames = []
+    exporter = FrameExporter(
+        backend, kernels, lambda frame: frames.append(frame.copy()), nx, ny, np.float64, layout
+    )
+    exporter.push(cupy.array(u))
+    exporter.close()
+    arr = np.sqrt(u[0] ** 2 + u[1] ** 2).transpose()
+    new_arr = ((arr / arr.max()) * 255).astype("uint8")
+    return [np.abs(frames[0].astype(int) - new_arr).max()]
+
+
+@testing(name="Ensemble")
+def test_ensemble(n):
+    configs = [
+        LatticeConfig(64, 40),
+        LatticeConfig(64, 40, Re=220.0),
+        LatticeConfig(64, 40, uLB=0.06, r=6),
+    ]
+    ensemble = Ensemble(configs, backend)
+    ensemble.run(n)
+    norms = []
+    for m, config in enumerate(configs):
+        # Same populations and velocity as the member run alone
+        solo = Simulation(config, backend, "fused", tune=False)
+        solo.run(n)
+        norms.append(np.linalg.norm(ensemble.populations(m) - solo.populations()))
+        norms.append(np.linalg.norm(ensemble.velocity(m) - solo.velocity()))
+    return norms
+
+
+@testing(name="Sparse (fluid cells only)")
+def test_sparse(n):
+    config = LatticeConfig(64, 40)
+    # Cylinder and a porous block: a third of the lattice is skipped
+    obstacle = config.obstacle() | (np.random.default_rng(0).random((64, 40)) < 0.3)
+    obstacle[20:50, 5:35] = True
+    obstacle[[0, -1]] = False
+    sparse = SparseSimulation(config, backend, obstacle)
+    sparse.run(n)
+    # Same populations and velocity on the fluid cells as the fused scheme
+    dense = Simulation(config, backend, "fused", tune=False, obstacle=obstacle)
+    dense.run(n)
+    fluid = ~obstacle
+    return [
+        np.linalg.norm(sparse.populations()[:, fluid] - dense.populations()[:, fluid]),
+        np.linalg.norm(sparse.velocity()[:, fluid] - dense.velocity()[:, fluid]),
+    ]
+
+
+@testing(name="Steps in a single call")
+def test_advance(n):
+    norms = []
+    for scheme in SCHEMES:
+        config = LatticeConfig(64, 40)
+        advanced = Simulation(config, backend, scheme, tune=False)
+        stepped = Simulation(config, backend, scheme, tune=False)
+        # Odd and even numbers of steps from odd and even times
+        for steps in (1, n, 2, n + 1):
+            advanced.advance(steps)
+            stepped.run(steps)
+        norms += [
+            np.linalg.norm(advanced.populations() - stepped.populations()),
+            np.linalg.norm(advanced.velocity() - stepped.velocity()),
+            float(advanced.time != stepped.time),
+        ]
+    return norms
+
+
+def overlapped(compute=None):
+    """Whether a step of a large lattice launched on `compute` (the default stream
+    without it) after a copy of its populations on a stream of copies
+    (`new_stream`) ends before the copy, instead of waiting for it."""
+    lattice = LatticeConfig(2048, 1408)
+    sim = Simulation(lattice, backend, "fused", tune=False)
+    stored = backend.stored_view(sim.d_fin, lattice.layout)
+    pinned = backend.pinned_empty(stored.shape, lattice.dtype)
+    threadsperblock, blockspergrid = backend.dispatch2D(2048, 1408, lattice.layout)
+    kernel = sim.kernels.collide_and_stream
+    if compute is None:
+        launch = kernel[blockspergrid, threadsperblock]
+    else:
+        launch = backend.on_stream(kernel, blockspergrid, threadsperblock, compute)
+    backend.synchronize()
+    done = backend.copy_to_host_async(stored, pinned, backend.new_stream(), compute)
+    launch(
+        sim.d_fin,
+        sim.d_fout,
+        sim.d_vel,
+        sim.d_obstacle,
+        sim.d_omega,
+        sim.d_rho,
+        sim.d_u,
+        2048,
+        1408,
+    )
+    computed = cupy.cuda.Event()
+    computed.record(compute)
+    computed.synchronize()
+    copying = not done.done
+    backend.synchronize()
+    return copying
+
+
+@testing(name="Domain decomposition")
+def test_decomposition(n):
+    config = LatticeConfig(50, 32)
+    # Three slabs (of 17, 17 and 16 rows), one process each, run in two parts
+    decomposition = Decomposition(config, backend, 3)
+    decomposition.run(n // 2)
+    processes = list(decomposition.processes)
+    decomposition.run(n - n // 2)
+    # Same populations and velocity as the whole lattice in one simulation, same processes
+    whole = Simulation(config, backend, "fused", tune=False)
+    whole.run(n)
+    norms = [
+        np.linalg.norm(decomposition.populations() - whole.populations()),
+        np.linalg.norm(decomposition.velocity() - whole.velocity()),
+        float(decomposition.processes != processes),
+    ]
+    decomposition.close()
+    # The copies of the halos overlap the interior rows
+    norms.append(float(not overlapped(backend.new_stream())))
+    return norms
+
+
+@testing(name="Forces (momentum exchange)")
+def test_forces(n):
+    config = fixtures.lattice
+    reference = Simulation(config, backend, "fused", tune=False)
+    forces = []
+    for _ in range(2 * n):
+        reference.run(1)
+        forces.append(np_momentum_exchange(reference.populations(), reference.obstacle, v))
+    norms = []
+    for scheme in SCHEMES:
+        # Mean force of n steps summed on the device, from odd and even times
+        for steps in ("run", "advance"):
+            sim = Simulation(config, backend, scheme, tune=False, forces=True)
+            getattr(sim, steps)(n)
+            first = sim.forces()
+            getattr(sim, steps)(n)
+            norms += [
+                np.abs(first - np.mean(forces[:n], axis=0)).max(),
+                np.abs(sim.forces() - np.mean(forces[n:], axis=0)).max(),
+            ]
+    # Both storages of the in-place scheme on a porous obstacle
+    rng = np.random.default_rng(0)
+    porous, fin = rng.random((nx, ny)) < 0.5, rng.random((9, nx, ny))
+    cells = np_boundary_cells(porous, v)
+    threadsperblock, blockspergrid = dispatch_reduce(cells.shape[1])
+    d_fin, d_porous, d_cells = map(cupy.array, (fin, porous, cells))
+    for parity in (0, 1):
+        d_force = cupy.array(np.zeros(2))
+        momentum_exchange[blockspergrid, threadsperblock](
+            d_fin, parity, d_porous, d_cells, cells.shape[1], d_force, nx, ny
+        )
+        reference = np_momentum_exchange(np_aa_populations(fin, parity, v), porous, v)
+        norms.append(np.abs(d_force.get() - reference).max() / np.abs(reference).max())
+    return norms
+
+
+@testing(name="Probes")
+def test_probes(n):
+    config = fixtures.lattice
+    rng = np.random.default_rng(0)
+    rho, u = 1 + rng.random((2 * n, nx, ny)), rng.random((2 * n, 2, nx, ny))
+    norms = []
+    for interpolate in (True, False):
+        # Two points (one on the corner), a line across the wake, n - 1 steps in the ring
+        probes = Probes(
+            [(10.3, 5.7), (nx - 1, ny - 1)], [(60, 0.5, 60, ny - 1, 17)], interpolate, slots=n - 1
+        )
+        cells, weights = probes.tables(nx, ny)
+        # Kernel: 2 n launches on the fields of each step, the slot of a step is
+        # overwritten `slots` steps later
+        threadsperblock, _ = dispatch_reduce(len(probes))
+        d_cells, d_weights = map(cupy.array, (cells, weights))
+        ring = cupy.array(np.zeros((probes.slots, 3, len(probes))))
+        count = cupy.array(np.zeros(1, np.int64))
+        for step in range(2 * n):
+            sample_probes[1, threadsperblock](
+                cupy.array(rho[step]),
+                cupy.array(u[step]),
+                d_cells,
+                d_weights,
+                len(probes),
+                ring,
+                count,
+            )
+        kept = np.arange(2 * n - probes.slots, 2 * n)
+        expected = [np_sample_probes(rho[step], u[step], cells, weights) for step in kept]
+        norms += [
+            np.abs(ring.get()[kept % probes.slots] - np.array(expected)).max(),
+            float(count.get()[0] != 2 * n),
+        ]
+        # Ring of the simulators: a partial ring read, then more steps than slots
+        reference = Simulation(config, backend, "fused", tune=False)
+        values = []
+        for _ in range(2 * n):
+            reference.run(1)
+            values.append(
+                np_sample_probes(
+                    backend.to_host(reference.d_rho), reference.velocity(), cells, weights
+                )
+            )
+        for scheme in SCHEMES:
+            for steps in ("run", "advance"):
+                sim = Simulation(config, backend, scheme, tune=False, probes=probes)
+                getattr(sim, steps)(n // 2)
+                first, a = sim.samples()
+                getattr(sim, steps)(2 * n - n // 2)
+                last, b = sim.samples()
+                norms += [
+                    np.abs(a - np.array(values)[first]).max(),
+                    np.abs(b - np.array(values)[last]).max(),
+                    float(
+                        list(first) + list(last) != list(range(n // 2)) + list(range(n + 1, 2 * n))
+                    ),
+                ]
+    return norms
+
+
+@testing(name="Copies overlapping the kernels")
+def test_overlap(n):
+    # A frame or a snapshot copied on the stream of the copies does not delay the
+    # steps launched after it on the default stream
+    return [float(not overlapped())]
+
+
+@testing(name="Field store")
+def test_store(n):
+    # Snapshots of every step, pushed without waiting for their copies to the host
+    lattice = fixtures.lattice
+    reference = Simulation(lattice, backend, "fused", tune=False)
+    references = []
+    for _ in range(n):
+        reference.advance(1)
+        references.append(
+            (backend.to_host(reference.d_rho), reference.velocity(), reference.populations())
+        )
+    sim = Simulation(lattice, backend, "fused", tune=False)
+    path = Path(tempfile.mkdtemp())
+    store = FieldStore.create(path / "fields", nx, ny, ("rho", "u", "fin"), "float64")
+    writer = FieldWriter(store, backend, nx, ny, lattice.dtype, lattice.layout)
+    for time in range(n):
+        sim.advance(1)
+        writer.push(time, rho=sim.d_rho, u=sim.d_u, fin=sim.d_fin)
+    writer.close()
+    norms = [
+        np.abs(store.read(name, index) - array).max()
+        for index, arrays in enumerate(references)
+        for name, array in zip(("rho", "u", "fin"), arrays)
+    ]
+    # Time of the steps after a snapshot of the populations of a large lattice, and of
+    # its copy to the host: the steps only wait for its copy on the device
+    lattice = LatticeConfig(2048, 1408)
+    sim = Simulation(lattice, backend, "fused", tune=False)
+    store = FieldStore.create(path / "large", 2048, 1408, ("fin",), "float16", compression="none")
+    writer = FieldWriter(store, backend, 2048, 1408, lattice.dtype, lattice.layout)
+    sim.advance(n)
+    times = {"steps": [], "snapshot": []}
+    for time in range(3):
+        for name in times:
+            backend.synchronize()
+            start = backend.record_event()
+            if name == "snapshot":
+                writer.push(time, fin=sim.d_fin)
+            sim.advance(n)
+            times[name].append(backend.elapsed_ns(start, backend.record_event()))
+    writer.close()
+    stored = backend.stored_view(sim.d_fin, lattice.layout)
+    pinned = backend.pinned_empty(stored.shape, lattice.dtype)
+    backend.synchronize()
+    start = backend.record_event()
+    copy = backend.elapsed_ns(
+        start, backend.copy_to_host_async(stored, pinned, backend.new_stream())
+    )
+    slowdown = min(times["snapshot"]) - min(times["steps"])
+    return norms + [float(slowdown > copy / 2)]
 
 
 maxIter = 10
 for i in range(maxIter):
     print("Step :", i)
-    test_equilibrium(1 + i * 8)
-    test_outflow(2 + i * 8)
-    test_macroscopic(3 + i * 8)
-    test_inflow(4 + i * 8)
-    test_updatefin(5 + i * 8)
-    test_collision(6 + i * 8)
-    test_bounce_back(7 + i * 8)
-    test_streaming_step(8 + i * 8)
+    test_equilibrium(i)
+    test_outflow(i)
+    test_macroscopic(i)
+    test_inflow(i)
+    test_updatefin(i)
+    test_collision(i)
+    test_bounce_back(i)
+    test_bounce_back_cells(i)
+    test_streaming_step(i)
+    test_streaming_tiled(i)
+    test_collide_and_stream(i)
+    test_aa(i)
+    test_layouts(i)
+    test_frames(i)
+test_autotune(0)
+test_ensemble(5)
+test_sparse(5)
+test_advance(5)
+test_decomposition(5)
+test_forces(5)
+test_probes(6)
+test_overlap(0)
+test_store(5)
@@ -0,0 +1,17 @@
+from utils.parameters import t, v
+from utils.numpy_functions import np_equilibrium
+
+from tests.fixtures import fixtures, references, stages
+
+maxIter = 10
+
+# Populations at rest with the inflow velocity
+fin = np_equilibrium(1, fixtures.lattice.velocity(), v, t)
+
+# One more step than the tests, whose in-place scheme compares two steps
+for i in range(maxIter + 1):
+    s = stages(fin, fixtures.lattice)
+    fixtures.save_inputs(i, fin)
+    fixtures.save("step-{}".format(i), **references(s))
+    fin = s.streamed
+    print("{}/{} steps".format(i + 1, maxIter + 1))
@@ -0,0 +1,109 @@
+import os
+
+import numpy as np
+from pathlib import Path
+from types import SimpleNamespace
+
+from utils.parameters import col2, col3, t, v
+from utils.numpy_functions import (
+    np_bounce_back,
+    np_collision,
+    np_equilibrium,
+    np_inflow,
+    np_macroscopic,
+    np_outflow,
+    np_streaming_step,
+    np_update_fin,
+)
+from utils.simulation import LatticeConfig
+
+PATH = Path().absolute() / "tests" / "fixturefiles"
+
+# Lattice of the fixtures: the stages of a step are recomputed in milliseconds,
+# and its columns are not a multiple of the tiles of `streaming_tiled`
+LATTICE = LatticeConfig(96, 72)
+
+
+def stages(fin, lattice=LATTICE):
+    """States of the numpy stepper along the step from the populations `fin`: the
+    input of every stage and the populations `streamed` of the next step."""
+    s = SimpleNamespace(fin=fin)
+    s.outflowed = fin.copy()
+    np_outflow(s.outflowed, col3, lattice.nx)
+    s.rho, s.u = np_macroscopic(s.outflowed, v)
+    s.inflow_rho, s.inflow_u, s.updated = s.rho.copy(), s.u.copy(), s.outflowed.copy()
+    np_inflow(s.inflow_u, lattice.velocity(), s.inflow_rho, s.updated, col2, col3)
+    s.feq = np_equilibrium(s.inflow_rho, s.inflow_u, v, t)
+    np_update_fin(s.updated, s.feq)
+    s.collided = np_collision(s.updated, s.feq, lattice.omega)
+    s.bounced = s.collided.copy()
+    np_bounce_back(s.bounced, s.updated, lattice.obstacle())
+    s.streamed = np.empty_like(fin)
+    np_streaming_step(s.streamed, s.bounced, v)
+    return s
+
+
+def references(s, lattice=LATTICE):
+    """Results of the stages of `s` compared by the tests, restricted to the cells
+    each stage writes: a row for the outflow and the inflow, the obstacle for
+    the bounce-back, the whole lattice for the others."""
+    return dict(
+        outflow=s.outflowed[:, -1],
+        rho=s.rho,
+        u=s.u,
+        inflow_rho=s.inflow_rho[0],
+        inflow_u=s.inflow_u[:, 0],
+        feq=s.feq,
+        update_fin=s.updated[:, 0],
+        collision=s.collided,
+        bounce_back=s.bounced[:, lattice.obstacle()],
+        streamed=s.streamed,
+    )
+
+
+class FixtureStore:
+    """Reference results of the numpy stepper on the small lattice `LATTICE`.
+
+    The fixture `fin-{i}` holds the populations at the start of the step i, the
+    input of the tests. It is an uncompressed `.npy` file, memory-mapped copy on
+    write (`inputs`): the states of the stages of the step (`state`) are
+    recomputed from it in milliseconds. The fixture `step-{i}` holds the results
+    of the stages of the step i (`references`), in a compressed `.npz` file whose
+    arrays are decompressed one by one when they are read.
+    """
+
+    def __init__(self, path=PATH, lattice=LATTICE):
+        self.path = Path(path)
+        self.lattice = lattice
+
+    def save(self, name, **arrays):
+        """Store `arrays` as the fixture `name` (written next to it, then renamed)."""
+        self.path.mkdir(parents=True, exist_ok=True)
+        tmp = self.path / (name + ".tmp.npz")
+        np.savez_compressed(tmp, **arrays)
+        os.replace(tmp, self.path / (name + ".npz"))
+
+    def save_inputs(self, i, fin):
+        """Store the populations `fin` at the start of the step i."""
+        self.path.mkdir(parents=True, exist_ok=True)
+        tmp = self.path / "fin-{}.tmp.npy".format(i)
+        np.save(tmp, fin)
+        os.replace(tmp, self.path / "fin-{}.npy".format(i))
+
+    def load(self, name):
+        """Arrays of the fixture `name`, read (and decompressed) on access."""
+        return np.load(self.path / (name + ".npz"))
+
+    def inputs(self, i):
+        """Populations at the start of the step i, memory-mapped: only the pages
+        read are loaded, and writes stay in memory."""
+        return np.load(self.path / "fin-{}.npy".format(i), mmap_mode="c")
+
+    def state(self, i):
+        """States of the stages of the step i (see `stages`), from its inputs."""
+        s = stages(self.inputs(i), self.lattice)
+        # Copies: the tests modify the arrays in place
+        return SimpleNamespace(**{name: np.array(array) for name, array in vars(s).items()})
+
+
+fixtures = FixtureStore()
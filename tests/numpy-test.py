@@ -0,0 +1,647 @@
+import numpy as np
+
+from utils.parameters import *
+from utils.numpy_functions import *
+from utils import numba_cpu_kernels as cpu
+from utils.video import FrameExporter
+from utils.checkpoint import check_checkpoint, load_checkpoint, parameters, save_checkpoint
+from utils.simulation import SCHEMES, LatticeConfig, Simulation
+from utils.ensemble import Ensemble
+from utils.sparse import SparseSimulation
+from utils.decomposition import Decomposition
+from utils.store import FieldStore, FieldWriter
+from utils.probes import Probes
+from utils.forces import ForceLog
+
+import tempfile
+from functools import partial
+from pathlib import Path
+
+# Colors
+class bcolors:
+    HEADER = "\033[95m"
+    OKBLUE = "\033[94m"
+    OKCYAN = "\033[96m"
+    OKGREEN = "\033[92m"
+    WARNING = "\033[93m"
+    FAIL = "\033[91m"
+    ENDC = "\033[0m"
+    BOLD = "\033[1m"
+    UNDERLINE = "\033[4m"
+
+
+def testing(name=""):
+    def decorator(function):
+        def wrapper(*args, **kwargs):
+            try:
+                norms = function(*args, **kwargs)
+                if all((n < 1e-10 for n in norms)):
+                    print(f"{bcolors.OKGREEN}{name}: Passed !\n{bcolors.ENDC}")
+                else:
+                    print(bcolors.WARNING + str(norms) + bcolors.ENDC)
+                    print(f"{bcolors.FAIL}{name}: >>> Failed ! <<<\n{bcolors.ENDC}")
+            except Exception as e:
+                print(bcolors.WARNING + str(e) + bcolors.ENDC)
+                print(f"{bcolors.FAIL}{name}: >>> Failed ! <<<\n{bcolors.ENDC}")
+                raise
+
+        return wrapper
+
+    return decorator
+
+
+def reference_step(fin, vel, obstacle):
+    np_outflow(fin, col3, nx)
+    rho, u = np_macroscopic(fin, v)
+    np_inflow(u, vel, rho, fin, col2, col3)
+    feq = np_equilibrium(rho, u, v, t)
+    np_update_fin(fin, feq)
+    fout = np_collision(fin, feq, omega)
+    np_bounce_back(fout, fin, obstacle)
+    np_streaming_step(fin, fout, v)
+    return rho, u
+
+
+obstacle = np.fromfunction(partial(np_obstacle_fun, cx=cx, cy=cy, r=r), (nx, ny))
+vel = np.fromfunction(partial(np_inivel, ly=ly, uLB=uLB), (2, nx, ny))
+
+
+@testing(name="Step")
+def test_step(n):
+    fin = np_equilibrium(1, vel, v, t)
+    d_fin = fin.copy()
+    fout, feq, rho, u, tmp = np_allocate(nx, ny)
+    slices = np_streaming_slices(v)
+    for _ in range(n):
+        b1, b2 = reference_step(fin, vel, obstacle)
+        np_step(d_fin, fout, feq, rho, u, tmp, vel, obstacle, omega, v, t, slices)
+    return [np.linalg.norm(d_fin - fin), np.linalg.norm(rho - b1), np.linalg.norm(u - b2)]
+
+
+@testing(name="Numba CPU step")
+def test_numba_cpu(n):
+    fin = np_equilibrium(1, vel, v, t)
+    d_fin = fin.copy()
+    rho = np.full((nx, ny), 1.0)
+    u = np.zeros((2, nx, ny))
+    feq = np.zeros((9, nx, ny))
+    fout = np.zeros((9, nx, ny))
+    omega_ = np.full((nx, ny), omega)
+    for _ in range(n):
+        b1, b2 = reference_step(fin, vel, obstacle)
+        cpu.outflow(d_fin, nx, ny)
+        cpu.macroscopic(d_fin, rho, u, nx, ny)
+        cpu.inflow(u, vel, rho, d_fin, ny)
+        cpu.equilibrium(rho, u, feq, nx, ny)
+        cpu.update_fin(d_fin, feq, ny)
+        cpu.collision(omega_, d_fin, feq, fout, nx, ny)
+        cpu.bounce_back(fout, d_fin, obstacle, nx, ny)
+        cpu.streaming_step(d_fin, fout, nx, ny)
+    return [np.linalg.norm(d_fin - fin), np.linalg.norm(rho - b1), np.linalg.norm(u - b2)]
+
+
+@testing(name="Numba CPU bounce-back of the boundary cells")
+def test_numba_cpu_boundary(n):
+    cells = np_boundary_cells(obstacle, v)
+    fluid = ~obstacle
+    norms = []
+    for seed in range(n):
+        fin, fout = np.random.default_rng(seed).random((2, 9, nx, ny))
+        a, b = fout.copy(), fout
+        cpu.bounce_back_cells(a, fin, cells, cells.shape[1])
+        np_bounce_back(b, fin, obstacle)
+        # Same populations streamed into the fluid as the bounce-back of the whole obstacle
+        np_streaming_step(fin, a, v)
+        streamed = fin.copy()
+        np_streaming_step(fin, b, v)
+        norms.append(np.linalg.norm(streamed[:, fluid] - fin[:, fluid]))
+    # At most twice the circumference of the cylinder, not its area
+    return norms + [float(cells.shape[1] > 4 * np.pi * r)]
+
+
+@testing(name="Numba CPU collide and stream")
+def test_numba_cpu_fused(n):
+    fin = np_equilibrium(1, vel, v, t)
+    d_fin = fin.copy()
+    d_fout = np.zeros((9, nx, ny))
+    rho = np.zeros((nx, ny))
+    u = np.zeros((2, nx, ny))
+    omega_ = np.full((nx, ny), omega)
+    for _ in range(n):
+        b1, b2 = reference_step(fin, vel, obstacle)
+        cpu.collide_and_stream(d_fin, d_fout, vel, obstacle, omega_, rho, u, nx, ny)
+        d_fin, d_fout = d_fout, d_fin
+    return [np.linalg.norm(d_fin - fin), np.linalg.norm(rho - b1), np.linalg.norm(u - b2)]
+
+
+@testing(name="Numba CPU in-place (AA) streaming")
+def test_numba_cpu_aa(n):
+    fin = np_equilibrium(1, vel, v, t)
+    d_fin = fin.copy()
+    rho = np.zeros((nx, ny))
+    u = np.zeros((2, nx, ny))
+    omega_ = np.full((nx, ny), omega)
+    for time in range(n):
+        b1, b2 = reference_step(fin, vel, obstacle)
+        cpu.aa_outflow(d_fin, time % 2, nx, ny)
+        cpu.aa_step(d_fin, time % 2, vel, obstacle, omega_, rho, u, nx, ny)
+    a = np_aa_populations(d_fin, n % 2, v)
+    return [np.linalg.norm(a - fin), np.linalg.norm(rho - b1), np.linalg.norm(u - b2)]
+
+
+@testing(name="Numba CPU memory layouts")
+def test_numba_cpu_layouts(n):
+    fin = np_equilibrium(1, vel, v, t)
+    omega_ = np.full((nx, ny), omega)
+    runs = []
+    for name in LAYOUTS:
+        d_fin, d_vel, d_obstacle, d_omega = (
+            cpu.layout_array(array, name) for array in (fin, vel, obstacle, omega_)
+        )
+        d_fout = cpu.layout_empty((9, nx, ny), np.float64, name)
+        rho = cpu.layout_empty((nx, ny), np.float64, name)
+        u = cpu.layout_empty((2, nx, ny), np.float64, name)
+        for _ in range(n):
+            cpu.collide_and_stream(d_fin, d_fout, d_vel, d_obstacle, d_omega, rho, u, nx, ny)
+            d_fin, d_fout = d_fout, d_fin
+        runs.append((d_fin, u))
+    for _ in range(n):
+        b1, b2 = reference_step(fin, vel, obstacle)
+    return [np.linalg.norm(a - b) for a1, a2 in runs for a, b in ((a1, fin), (a2, b2))]
+
+
+@testing(name="Numba CPU tiled streaming")
+def test_numba_cpu_tiled(n):
+    norms = []
+    for seed in range(n):
+        fout = np.random.default_rng(seed).random((9, nx, ny))
+        fin = np.empty_like(fout)
+        np_streaming_step(fin, fout, v)
+        rows, cols = np_halo_indices(nx), np_halo_indices(ny)
+        for name in LAYOUTS:
+            d_fin = cpu.layout_empty((9, nx, ny), np.float64, name)
+            d_fout = cpu.layout_array(fout, name)
+            cpu.specialize(precision, name).streaming_tiled(d_fin, d_fout, rows, cols, nx, ny)
+            norms.append(np.linalg.norm(d_fin - fin))
+    return norms
+
+
+@testing(name="Numba CPU temporal blocking")
+def test_numba_cpu_blocked(n):
+    fin = np_equilibrium(1, vel, v, t)
+    for _ in range(n):
+        b1, b2 = reference_step(fin, vel, obstacle)
+    norms = []
+    # Tiles which divide the lattice or not, whole lattice, and a tile deeper than n
+    for blocking in ((64, ny, 4), (100, 300, 3), (nx, ny, 1), (16, 16, n + 1)):
+        sim = Simulation(LatticeConfig(), cpu, "fused", tune=False, blocking=blocking)
+        sim.advance(n)
+        norms += [
+            np.linalg.norm(sim.populations() - fin),
+            np.linalg.norm(sim.d_rho - b1),
+            np.linalg.norm(sim.velocity() - b2),
+        ]
+    return norms
+
+
+@testing(name="Frame export")
+def test_frames(n):
+    fin = np_equilibrium(1, vel, v, t)
+    frames, references = [], []
+    exporter = FrameExporter(
+        cpu, cpu.kernels, lambda frame: frames.append(frame.copy()), nx, ny, np.float64
+    )
+    for _ in range(n):
+        _, u = reference_step(fin, vel, obstacle)
+        exporter.push(u.copy())
+        arr = np.sqrt(u[0] ** 2 + u[1] ** 2).transpose()
+        references.append(((arr / arr.max()) * 255).astype("uint8"))
+    exporter.close()
+    norms = [np.abs(a.astype(int) - b).max() for a, b in zip(frames, references)]
+
+    # An error of `write` is raised again by `push` and `close` instead of a hang
+    def write(frame):
+        raise OSError("disk full")
+
+    exporter, raised = FrameExporter(cpu, cpu.kernels, write, nx, ny, np.float64), 0
+    try:
+        for _ in range(4):
+            exporter.push(u)
+    except OSError:
+        raised += 1
+    try:
+        exporter.close()
+    except OSError:
+        raised += 1
+    return norms + [n - len(frames), 2 - raised]
+
+
+@testing(name="Checkpoint and restart")
+def test_checkpoint(n):
+    fin = np_equilibrium(1, vel, v, t)
+    fout, feq, rho, u, tmp = np_allocate(nx, ny)
+    slices = np_streaming_slices(v)
+    path = Path(tempfile.mkdtemp()) / "checkpoint.lbm"
+    for time in range(2 * n):
+        if time == n:
+            save_checkpoint(path, time, "numpy", parameters(globals()), fin=fin, vel=vel)
+        np_step(fin, fout, feq, rho, u, tmp, vel, obstacle, omega, v, t, slices)
+    checkpoint = load_checkpoint(path)
+    resumed, saved_vel = np.array(checkpoint.arrays["fin"]), checkpoint.arrays["vel"]
+    for time in range(checkpoint.time, 2 * n):
+        np_step(resumed, fout, feq, rho, u, tmp, saved_vel, obstacle, omega, v, t, slices)
+    # A checkpoint of the blocked fused scheme is not resumed by the fused scheme
+    blocked = path.with_name("blocked.lbm")
+    save_checkpoint(blocked, n, "blocked", parameters(globals()), fin=fin)
+    try:
+        check_checkpoint(load_checkpoint(blocked), "fused", parameters(globals()))
+        rejected = False
+    except ValueError:
+        rejected = True
+    return [
+        np.abs(resumed - fin).max(),
+        float(checkpoint.parameters != parameters(globals())),
+        float(not rejected),
+    ]
+
+
+@testing(name="Simulations of several sizes")
+def test_simulations(n):
+    configs = [LatticeConfig(64, 40), LatticeConfig(48, 32)]
+    sims = [Simulation(config, cpu, scheme, tune=False) for config in configs for scheme in SCHEMES]
+    for _ in range(n):
+        for sim in sims:
+            sim.step()
+    norms = []
+    for config in configs:
+        vel, obstacle = config.velocity(), config.obstacle()
+        fin = np_equilibrium(1, vel, v, t)
+        fout, feq, rho, u, tmp = np_allocate(config.nx, config.ny)
+        slices = np_streaming_slices(v)
+        for _ in range(n):
+            np_step(fin, fout, feq, rho, u, tmp, vel, obstacle, config.omega, v, t, slices)
+        for sim in (sim for sim in sims if sim.config is config):
+            populations = sim.populations()
+            if sim.scheme == "inplace":
+                populations = np_aa_populations(populations, n % 2, v)
+            # The stages leave the interior of the obstacle at rest
+            cells = ~obstacle if sim.scheme == "stages" else slice(None)
+            norms += [
+                np.linalg.norm(populations[:, cells] - fin[:, cells]),
+                np.linalg.norm(sim.velocity()[:, cells] - u[:, cells]),
+            ]
+    # Every size launches the same compiled kernels
+    kernels = cpu.specialize(*configs[0].specialization)
+    return norms + [float(any(sim.kernels is not kernels for sim in sims))]
+
+
+@testing(name="Schemes, run and advance")
+def test_schemes(n):
+    config = LatticeConfig(64, 40)
+    reference = Simulation(config, cpu, "fused", tune=False)
+    reference.run(n)
+    norms = []
+    for scheme in SCHEMES:
+        # With the forces on the cells next to the fluid
+        for steps in ("run", "advance"):
+            sim = Simulation(config, cpu, scheme, tune=False, forces=True)
+            getattr(sim, steps)(n)
+            populations = sim.populations()
+            if scheme == "inplace":
+                populations = np_aa_populations(populations, n % 2, v)
+            # The stages leave the interior of the obstacle at rest
+            cells = ~config.obstacle() if scheme == "stages" else slice(None)
+            norms += [
+                np.linalg.norm(populations[:, cells] - reference.populations()[:, cells]),
+                np.linalg.norm(sim.velocity()[:, cells] - reference.velocity()[:, cells]),
+            ]
+    return norms
+
+
+@testing(name="Ensemble")
+def test_ensemble(n):
+    configs = [
+        LatticeConfig(64, 40),
+        LatticeConfig(64, 40, Re=220.0),
+        LatticeConfig(64, 40, uLB=0.06, r=6),
+    ]
+    ensemble = Ensemble(configs, cpu)
+    ensemble.run(n)
+    norms = []
+    for m, config in enumerate(configs):
+        # Same populations and velocity as the member run alone
+        solo = Simulation(config, cpu, "fused", tune=False)
+        solo.run(n)
+        norms.append(np.linalg.norm(ensemble.populations(m) - solo.populations()))
+        norms.append(np.linalg.norm(ensemble.velocity(m) - solo.velocity()))
+    return norms
+
+
+@testing(name="Sparse (fluid cells only)")
+def test_sparse(n):
+    config = LatticeConfig(64, 40)
+    # Cylinder and a porous block: a third of the lattice is skipped
+    obstacle = config.obstacle() | (np.random.default_rng(0).random((64, 40)) < 0.3)
+    obstacle[20:50, 5:35] = True
+    obstacle[[0, -1]] = False
+    sparse = SparseSimulation(config, cpu, obstacle)
+    sparse.run(n)
+    # Same populations and velocity on the fluid cells as the fused scheme
+    dense = Simulation(config, cpu, "fused", tune=False, obstacle=obstacle)
+    dense.run(n)
+    fluid = ~obstacle
+    return [
+        np.linalg.norm(sparse.populations()[:, fluid] - dense.populations()[:, fluid]),
+        np.linalg.norm(sparse.velocity()[:, fluid] - dense.velocity()[:, fluid]),
+    ]
+
+
+@testing(name="Collision operators")
+def test_operators(n):
+    norms = []
+    for name in ("trt", "regularized"):
+        config = LatticeConfig(64, 40, operator=name)
+        vel, obstacle = config.velocity(), config.obstacle()
+        fin = np_equilibrium(1, vel, v, t)
+        for _ in range(n):
+            np_outflow(fin, col3, config.nx)
+            rho, u = np_macroscopic(fin, v)
+            np_inflow(u, vel, rho, fin, col2, col3)
+            feq = np_equilibrium(rho, u, v, t)
+            np_update_fin(fin, feq)
+            fout = np_operator_collision(name, fin, feq, config.omega, v, t, magic)
+            # Density and velocity are conserved by the collision (the inflow imposes them)
+            frho, fu = np_macroscopic(fout, v)
+            norms += [np.linalg.norm((frho - rho)[1:]), np.linalg.norm((fu - u)[:, 1:])]
+            np_bounce_back(fout, fin, obstacle)
+            np_streaming_step(fin, fout, v)
+        for scheme in SCHEMES:
+            sim = Simulation(config, cpu, scheme, tune=False)
+            sim.run(n)
+            populations = sim.populations()
+            if scheme == "inplace":
+                populations = np_aa_populations(populations, n % 2, v)
+            # The stages leave the interior of the obstacle at rest
+            cells = ~obstacle if scheme == "stages" else slice(None)
+            norms += [
+                np.linalg.norm(populations[:, cells] - fin[:, cells]),
+                np.linalg.norm(sim.velocity()[:, cells] - u[:, cells]),
+            ]
+        ensemble = Ensemble([config, config], cpu)
+        ensemble.run(n)
+        norms.append(np.linalg.norm(ensemble.populations(1) - fin))
+    # With this magic parameter, both rates of TRT are omega: TRT is BGK
+    fin = np_equilibrium(1, vel, v, t) * (1 + 1e-3 * np.sin(np.arange(9)))[:, None, None]
+    feq = np_equilibrium(*np_macroscopic(fin, v), v, t)
+    bgk = np_collision(fin, feq, omega)
+    trt = np_collision_trt(fin, feq, omega, (1 / omega - 0.5) ** 2)
+    return norms + [np.linalg.norm(trt - bgk)]
+
+
+@testing(name="Steps in a single call")
+def test_advance(n):
+    norms = []
+    for scheme in SCHEMES:
+        config = LatticeConfig(64, 40)
+        advanced = Simulation(config, cpu, scheme, tune=False)
+        stepped = Simulation(config, cpu, scheme, tune=False)
+        # Odd and even numbers of steps from odd and even times
+        for steps in (1, n, 2, n + 1):
+            advanced.advance(steps)
+            stepped.run(steps)
+        norms += [
+            np.linalg.norm(advanced.populations() - stepped.populations()),
+            np.linalg.norm(advanced.velocity() - stepped.velocity()),
+            float(advanced.time != stepped.time),
+        ]
+    return norms
+
+
+@testing(name="Domain decomposition")
+def test_decomposition(n):
+    config = LatticeConfig(50, 32)
+    # Three slabs (of 17, 17 and 16 rows), one process each, run in three parts
+    decomposition = Decomposition(config, cpu, 3)
+    decomposition.run(n // 2)
+    processes = list(decomposition.processes)
+    decomposition.run(1)
+    # Same processes, the state gathered when it is read
+    whole = Simulation(config, cpu, "fused", tune=False)
+    whole.run(n // 2 + 1)
+    norms = [
+        float(decomposition.processes != processes),
+        np.linalg.norm(decomposition.populations() - whole.populations()),
+    ]
+    # Continued by new processes from the state gathered by `close`
+    decomposition.close()
+    decomposition.run(n - n // 2 - 1)
+    whole.run(n - n // 2 - 1)
+    norms += [
+        np.linalg.norm(decomposition.populations() - whole.populations()),
+        np.linalg.norm(decomposition.velocity() - whole.velocity()),
+    ]
+    decomposition.close()
+    return norms
+
+
+@testing(name="Field store")
+def test_store(n):
+    norms = []
+    # Whole uncompressed fields (memory-mapped), and tiles not dividing the lattice
+    for layout, dtype, chunks, compression in (
+        ("xy", "float64", None, "none"),
+        ("aos", "float16", (24, 16), "zlib"),
+    ):
+        config = LatticeConfig(50, 40, layout=layout)
+        sim = Simulation(config, cpu, "fused", tune=False)
+        path = Path(tempfile.mkdtemp()) / "fields"
+        store = FieldStore.create(path, 50, 40, ("rho", "u", "fin"), dtype, chunks, compression)
+        writer = FieldWriter(store, cpu, 50, 40, config.dtype, layout)
+        references = []
+        for time in range(n):
+            sim.advance(1)
+            writer.push(time, rho=sim.d_rho, u=sim.d_u, fin=sim.d_fin)
+            references.append((np.array(sim.d_rho), sim.velocity(), sim.populations()))
+        writer.close()
+        for index, arrays in enumerate(references):
+            for name, reference in zip(("rho", "u", "fin"), arrays):
+                stored = store.read(name, index)
+                window = store.read(name, index, slice(10, 35), slice(5, 30))
+                reference = reference.astype(dtype)
+                norms += [
+                    float(np.abs(stored - reference).max()),
+                    float(np.abs(window - reference[..., 10:35, 5:30]).max()),
+                ]
+        norms += [
+            float(store.times("u") != list(range(n))),
+            float((chunks is None) != isinstance(store.read("u", -1), np.memmap)),
+        ]
+    # Populations of the in-place scheme stored as the usual ones, after odd and even steps
+    config = LatticeConfig(50, 40)
+    sim = Simulation(config, cpu, "inplace", tune=False)
+    store = FieldStore.create(Path(tempfile.mkdtemp()) / "fields", 50, 40, ("fin",), "float64")
+    writer = FieldWriter(store, cpu, 50, 40, config.dtype)
+    references = []
+    for time in range(2):
+        sim.advance(1)
+        writer.push(time, sim.time % 2, fin=sim.d_fin)
+        references.append(np_aa_populations(sim.populations(), sim.time % 2, v))
+    writer.close()
+    norms += [np.abs(store.read("fin", i) - fin).max() for i, fin in enumerate(references)]
+
+    # An error of the store is raised again by `push` and `close` instead of a hang
+    def append(name, time, array):
+        raise OSError("disk full")
+
+    store.append, raised = append, 0
+    writer = FieldWriter(store, cpu, 50, 40, config.dtype)
+    try:
+        for time in range(4):
+            writer.push(time, fin=sim.d_fin)
+    except OSError:
+        raised += 1
+    try:
+        writer.close()
+    except OSError:
+        raised += 1
+    return norms + [2 - raised]
+
+
+@testing(name="Forces (momentum exchange)")
+def test_forces(n):
+    config = LatticeConfig(64, 40)
+    reference = Simulation(config, cpu, "fused", tune=False)
+    forces = []
+    for _ in range(2 * n):
+        reference.run(1)
+        forces.append(np_momentum_exchange(reference.populations(), reference.obstacle, v))
+    norms = []
+    for scheme in SCHEMES:
+        # Mean force of n steps summed on the device, from odd and even times
+        for steps in ("run", "advance"):
+            sim = Simulation(config, cpu, scheme, tune=False, forces=True)
+            getattr(sim, steps)(n)
+            first = sim.forces()
+            getattr(sim, steps)(n)
+            norms += [
+                np.abs(first - np.mean(forces[:n], axis=0)).max(),
+                np.abs(sim.forces() - np.mean(forces[n:], axis=0)).max(),
+            ]
+    # Both storages of the in-place scheme on a porous obstacle
+    rng = np.random.default_rng(0)
+    porous, fin = rng.random((nx, ny)) < 0.5, rng.random((9, nx, ny))
+    cells = np_boundary_cells(porous, v)
+    for parity in (0, 1):
+        force = np.zeros(2)
+        cpu.momentum_exchange(fin, parity, porous, cells, cells.shape[1], force, nx, ny)
+        reference = np_momentum_exchange(np_aa_populations(fin, parity, v), porous, v)
+        norms.append(np.abs(force - reference).max() / np.abs(reference).max())
+    return norms
+
+
+@testing(name="Forces across a restart")
+def test_forces_restart(n):
+    config = LatticeConfig(64, 40)
+    directory = Path(tempfile.mkdtemp())
+    norms = []
+    for scheme in SCHEMES:
+        # Lines every n iterations, checkpoint in the middle of the mean of a line
+        uninterrupted, resumed = directory / f"{scheme}.txt", directory / f"{scheme}-resumed.txt"
+        path = directory / f"{scheme}.lbm"
+        sim = Simulation(config, cpu, scheme, tune=False, forces=True)
+        log = ForceLog(uninterrupted, config)
+        for time in range(3 * n):
+            sim.run(1)
+            if time % n == 0:
+                log.write(time, sim.forces())
+            if time + 1 == n + n // 2:
+                save_checkpoint(
+                    path,
+                    time + 1,
+                    scheme,
+                    config.parameters(),
+                    fin=sim.populations(),
+                    vel=sim.vel,
+                    obstacle=sim.obstacle,
+                    **sim.forces_state(),
+                )
+        log.close()
+        # The lines written after the checkpoint by the first run are dropped on resume
+        resumed.write_text(uninterrupted.read_text())
+        checkpoint = load_checkpoint(path)
+        sim = Simulation(
+            config, cpu, scheme, tune=False, forces=True, time=checkpoint.time, **checkpoint.arrays
+        )
+        log = ForceLog(resumed, config, resume=True, time=checkpoint.time)
+        for time in range(checkpoint.time, 3 * n):
+            sim.run(1)
+            if time % n == 0:
+                log.write(time, sim.forces())
+        log.close()
+        expected, lines = np.loadtxt(uninterrupted), np.loadtxt(resumed)
+        norms += [
+            np.abs(lines - expected).max(),
+            float(lines.shape != expected.shape),
+        ]
+    return norms
+
+
+@testing(name="Probes")
+def test_probes(n):
+    config = LatticeConfig(64, 40)
+    # Two points (one on the corner), a line across the wake, n - 1 steps in the ring
+    probes = Probes([(10.3, 5.7), (63, 39)], [(40, 0.5, 40, 39, 17)], slots=n - 1)
+    cells, weights = probes.tables(64, 40)
+    reference = Simulation(config, cpu, "fused", tune=False)
+    values = []
+    for _ in range(2 * n):
+        reference.run(1)
+        values.append(np_sample_probes(reference.d_rho, reference.velocity(), cells, weights))
+    norms = []
+    for scheme in SCHEMES:
+        for steps in ("run", "advance"):
+            sim = Simulation(config, cpu, scheme, tune=False, probes=probes)
+            getattr(sim, steps)(n // 2)
+            first, a = sim.samples()
+            getattr(sim, steps)(2 * n - n // 2)
+            last, b = sim.samples()
+            norms += [
+                np.abs(a - np.array(values)[first]).max(),
+                np.abs(b - np.array(values)[last]).max(),
+                float(list(first) + list(last) != list(range(n // 2)) + list(range(n + 1, 2 * n))),
+            ]
+    # Bilinear interpolation exact on linear fields, nearest cell without it
+    x, y = np.meshgrid(np.arange(nx), np.arange(ny), indexing="ij")
+    px, py = np.random.default_rng(0).random((2, 50)) * ((nx - 1,), (ny - 1,))
+    rho, u, locations = 1 + 0.01 * x + 0.02 * y, np.stack([x, -y]), np.stack([px, py], axis=1)
+    interpolated = np_sample_probes(rho, u, *np_probe_tables(locations, nx, ny))
+    nearest = np_sample_probes(rho, u, *np_probe_tables(locations, nx, ny, interpolate=False))
+    rx, ry = np.rint(px), np.rint(py)
+    norms += [
+        np.abs(interpolated - np.stack([1 + 0.01 * px + 0.02 * py, px, -py])).max(),
+        np.abs(nearest - np.stack([1 + 0.01 * rx + 0.02 * ry, rx, -ry])).max(),
+    ]
+    return norms
+
+
+test_step(10)
+test_numba_cpu(10)
+test_numba_cpu_boundary(3)
+test_numba_cpu_fused(10)
+test_numba_cpu_aa(9)
+test_numba_cpu_layouts(10)
+test_numba_cpu_tiled(3)
+test_numba_cpu_blocked(10)
+test_frames(3)
+test_checkpoint(5)
+test_simulations(5)
+test_schemes(5)
+test_ensemble(5)
+test_sparse(5)
+test_operators(5)
+test_advance(5)
+test_decomposition(5)
+test_store(5)
+test_forces(5)
+test_forces_restart(4)
+test_probes(6)
@@ -0,0 +1,148 @@
+import fcntl
+import json
+import os
+from pathlib import Path
+from time import perf_counter as pf
+from types import SimpleNamespace
+
+import numpy as np
+
+# Cache of the best launch configurations, reloaded by every `Autotuner`
+CACHE = Path(
+    os.environ.get("LBM_AUTOTUNE_CACHE", Path.home() / ".cache" / "lbm-gpu" / "autotune.json")
+)
+
+KERNELS1D = ("outflow", "inflow", "update_fin", "aa_outflow")
+KERNELS2D = (
+    "equilibrium",
+    "macroscopic",
+    "collision",
+    "bounce_back",
+    "streaming_step",
+    "collide_and_stream",
+    "aa_step",
+)
+
+
+def as_config(config):
+    """Launch configuration from its JSON form (lists become tuples)."""
+    return tuple(tuple(c) if isinstance(c, list) else c for c in config)
+
+
+class Autotuner:
+    """Times each kernel over the candidate launch configurations of `backend`
+    (a kernel module) on its first launch and keeps the fastest one.
+
+    The winners are keyed by (kernel, nx, ny, specialization, device name) and
+    saved in `path`, which is reloaded at startup. The specialization (precision,
+    layout, relaxation and collision operator, see `specialize`) selects the
+    compiled kernel, whose registers and arithmetic differ from one to another.
+    Candidates are timed on scratch copies of the arguments of the first launch,
+    which the repeated launches may overwrite.
+    """
+
+    def __init__(self, backend, path=CACHE, repeats=10):
+        self.backend = backend
+        self.path = Path(path)
+        self.repeats = repeats
+        self.device = backend.device_name()
+        self.cache = json.loads(self.path.read_text()) if self.path.exists() else {}
+        self.timed = 0  # Number of kernels timed (not found in the cache)
+
+    def key(self, name, nx, ny, specialization):
+        return "|".join((name, "{}x{}".format(nx, ny), *specialization, self.device))
+
+    def best(self, key, kernel, candidates, args, layout="xy"):
+        """Fastest configuration of `candidates` for `kernel(*args)`, the arrays of
+        `args` being stored in `layout`."""
+        if len(candidates) == 1:
+            return candidates[0]
+        if key in self.cache:
+            return as_config(self.cache[key])
+        args = self.scratch(args, layout)
+        timings = []
+        for threadsperblock, blockspergrid in candidates:
+            launch = kernel[blockspergrid, threadsperblock]
+            launch(*args)  # Compilation on the first launch
+            self.backend.synchronize()
+            start = pf()
+            for _ in range(self.repeats):
+                launch(*args)
+            self.backend.synchronize()
+            timings.append(pf() - start)
+        self.timed += 1
+        config = candidates[int(np.argmin(timings))]
+        self.save(key, config)
+        return as_config(config)
+
+    def scratch(self, args, layout="xy"):
+        """Copies of the arrays of `args` stored in the same `layout` (scalars are
+        kept): the arrays of the simulation, aliased or not, are left untouched."""
+        backend = self.backend
+        copies = []
+        for arg in args:
+            if np.ndim(arg) in (2, 3):
+                arg = backend.layout_array(backend.to_host(arg), layout)
+            elif np.ndim(arg):
+                arg = backend.to_device(backend.to_host(arg))
+            copies.append(arg)
+        return copies
+
+    def save(self, key, config):
+        """Add the winner `config` of `key` to the file, merged under a lock with the
+        winners saved meanwhile by other processes, then replaced atomically (a
+        reader never sees a partial file)."""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path.with_name(self.path.name + ".lock"), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if self.path.exists():
+                self.cache.update(json.loads(self.path.read_text()))
+            self.cache[key] = config
+            tmp = self.path.with_name(self.path.name + ".tmp")
+            tmp.write_text(json.dumps(self.cache, indent=1, sort_keys=True))
+            os.replace(tmp, self.path)
+
+    def tune(self, kernels, nx, ny, specialization):
+        """Kernels of `kernels`, compiled by `specialize(*specialization)`, launched
+        with their best configuration: call them without
+        `[blockspergrid, threadsperblock]`.
+        """
+        layout = specialization[1]
+        tuned = {}
+        for name in KERNELS1D + KERNELS2D:
+            candidates = (
+                self.backend.candidates1D(ny)
+                if name in KERNELS1D
+                else self.backend.candidates2D(nx, ny, layout)
+            )
+            key = self.key(name, nx, ny, specialization)
+            tuned[name] = Tuned(self, key, getattr(kernels, name), candidates, layout)
+        return SimpleNamespace(**tuned)
+
+
+class Tuned:
+    """Kernel whose launch configuration is chosen by an `Autotuner` on its first call."""
+
+    def __init__(self, tuner, key, kernel, candidates, layout="xy"):
+        self.tuner = tuner
+        self.key = key
+        self.kernel = kernel
+        self.candidates = candidates
+        self.layout = layout
+        self.config = None
+
+    def __call__(self, *args):
+        if self.config is None:
+            self.config = self.tuner.best(self.key, self.kernel, self.candidates, args, self.layout)
+        threadsperblock, blockspergrid = self.config
+        self.kernel[blockspergrid, threadsperblock](*args)
+
+
+def dispatched(backend, kernels, nx, ny, layout="xy"):
+    """Kernels of `kernels` launched with the default configurations of `backend`
+    (`dispatch1D`, `dispatch2D`), called like the kernels of `Autotuner.tune`."""
+    TPB1D, BPG1D = backend.dispatch1D(ny)
+    TPB2D, BPG2D = backend.dispatch2D(nx, ny, layout)
+    launches = {name: getattr(kernels, name)[BPG1D, TPB1D] for name in KERNELS1D}
+    launches.update({name: getattr(kernels, name)[BPG2D, TPB2D] for name in KERNELS2D})
+    return SimpleNamespace(**launches)
@@ -0,0 +1,134 @@
+import json
+import os
+import struct
+from pathlib import Path
+from types import SimpleNamespace
+
+import numpy as np
+
+# File: MAGIC, length of the header (uint64), JSON header, then the raw arrays
+# (C order) each aligned on ALIGN bytes so that they can be memory-mapped.
+MAGIC = b"LBMCKPT1"
+ALIGN = 64
+
+# Parameters of `utils.parameters` (or of a driver) saved with the state
+PARAMETERS = (
+    "maxIter",
+    "Re",
+    "nx",
+    "ny",
+    "ly",
+    "cx",
+    "cy",
+    "r",
+    "uLB",
+    "omega",
+    "precision",
+    "layout",
+    "operator",
+)
+
+
+def add_arguments(parser):
+    """Options of the drivers to write checkpoints and to resume from one."""
+    parser.add_argument(
+        "--checkpoint", default="checkpoint.lbm", help="Checkpoint file (default: %(default)s)"
+    )
+    parser.add_argument(
+        "--checkpoint-every",
+        type=int,
+        default=0,
+        metavar="N",
+        help="Write a checkpoint every N iterations (0: never)",
+    )
+    parser.add_argument(
+        "--resume", action="store_true", help="Continue the simulation saved in --checkpoint"
+    )
+
+
+def parameters(namespace):
+    """Parameters of `PARAMETERS` defined in `namespace` (e.g. `globals()`)."""
+    return {
+        name: namespace[name].item() if hasattr(namespace[name], "item") else namespace[name]
+        for name in PARAMETERS
+        if name in namespace
+    }
+
+
+def aligned(n):
+    return -(-n // ALIGN) * ALIGN
+
+
+def save_checkpoint(path, time, mode, params, **arrays):
+    """Write the state of the simulation before iteration `time`.
+
+    The file is written next to `path` then renamed, so that `path` is always a
+    complete checkpoint even if the job is killed while writing.
+    """
+    arrays = {name: np.ascontiguousarray(array) for name, array in arrays.items()}
+    header, offset = {"time": time, "mode": mode, "parameters": params, "arrays": {}}, 0
+    for name, array in arrays.items():
+        header["arrays"][name] = {
+            "dtype": array.dtype.str,
+            "shape": array.shape,
+            "offset": offset,
+        }
+        offset = aligned(offset + array.nbytes)
+    encoded = json.dumps(header).encode()
+
+    path = Path(path)
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "wb") as f:
+        f.write(MAGIC + struct.pack("<Q", len(encoded)) + encoded)
+        start = aligned(f.tell())
+        for name, array in arrays.items():
+            f.seek(start + header["arrays"][name]["offset"])
+            f.write(array.data)
+        f.truncate(start + offset)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def load_checkpoint(path):
+    """Checkpoint written by `save_checkpoint`: `time`, `mode`, `parameters` and
+    `arrays` (read-only memory maps of the file).
+    """
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError("{} is not a checkpoint".format(path))
+        (length,) = struct.unpack("<Q", f.read(8))
+        header = json.loads(f.read(length))
+    start = aligned(len(MAGIC) + 8 + length)
+    arrays = {
+        name: np.memmap(
+            path,
+            dtype=np.dtype(meta["dtype"]),
+            mode="r",
+            offset=start + meta["offset"],
+            shape=tuple(meta["shape"]),
+        )
+        for name, meta in header["arrays"].items()
+    }
+    return SimpleNamespace(
+        time=header["time"], mode=header["mode"], parameters=header["parameters"], arrays=arrays
+    )
+
+
+def check_checkpoint(checkpoint, mode, params):
+    """Raise a `ValueError` if `checkpoint` cannot be continued bit-identically
+    with `mode` and `params` (the number of iterations may differ).
+    """
+    if checkpoint.mode != mode:
+        raise ValueError(
+            "checkpoint written in mode {!r}, cannot resume in mode {!r}".format(
+                checkpoint.mode, mode
+            )
+        )
+    different = [
+        "{}={!r} (checkpoint: {!r})".format(name, value, checkpoint.parameters.get(name))
+        for name, value in params.items()
+        if name != "maxIter" and checkpoint.parameters.get(name) != value
+    ]
+    if different:
+        raise ValueError("parameters differ from the checkpoint: " + ", ".join(different))
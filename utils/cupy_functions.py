@@ -0,0 +1,108 @@
+import cupy as cp
+import numpy
+from types import SimpleNamespace
+
+from utils.parameters import PRECISIONS, dtype, precision
+
+v = cp.array([[1, 1], [1, 0], [1, -1], [0, 1], [0, 0], [0, -1], [-1, 1], [-1, 0], [-1, -1]])
+numpy_v = numpy.array(
+    [[1, 1], [1, 0], [1, -1], [0, 1], [0, 0], [0, -1], [-1, 1], [-1, 0], [-1, -1]]
+)
+t = cp.array([1 / 36, 1 / 9, 1 / 36, 1 / 9, 4 / 9, 1 / 9, 1 / 36, 1 / 9, 1 / 36], dtype=dtype)
+acc = PRECISIONS[precision][1]  # Type in which the moments are accumulated.
+
+col1 = cp.array([0, 1, 2])
+col2 = cp.array([3, 4, 5])
+col3 = cp.array([6, 7, 8])
+
+
+def cp_macroscopic(fin):
+    """Compute macroscopic variables (density, velocity)
+    fluid density is 0th moment of distribution functions
+    fluid velocity components are 1st order moments of dist. functions
+    """
+    rho = cp.sum(fin, axis=0, dtype=acc)
+    u = cp.zeros((2,) + fin.shape[1:], dtype=acc)
+    for i in range(9):
+        u[0, :, :] += v[i, 0] * fin[i, :, :]
+        u[1, :, :] += v[i, 1] * fin[i, :, :]
+    u /= rho
+    return rho.astype(dtype, copy=False), u.astype(dtype, copy=False)
+
+
+def cp_equilibrium(rho, u):
+    """Equilibrium distribution function."""
+    usqr = 1.5 * (u[0] ** 2 + u[1] ** 2)
+    feq = cp.zeros((9,) + u.shape[1:], dtype=dtype)
+    for i in range(9):
+        cu = 3 * (v[i, 0] * u[0, :, :] + v[i, 1] * u[1, :, :])
+        feq[i, :, :] = rho * t[i] * (1 + cu + 0.5 * cu ** 2 - usqr)
+    return feq
+
+
+def cp_outflow(fin):
+    """Right wall: outflow condition.
+    we only need here to specify distrib. function for velocities
+    that enter the domain (other that go out, are set by the streaming step)
+    """
+    nx = fin.shape[1]
+    fin[col3, nx - 1, :] = fin[col3, nx - 2, :]
+
+
+def cp_inflow(u, vel, rho, fin):
+    """Left wall: inflow condition."""
+    u[:, 0, :] = vel[:, 0, :]
+    rho[0, :] = (
+        1
+        / (1 - u[0, 0, :])
+        * (cp.sum(fin[col2, 0, :], axis=0) + 2 * cp.sum(fin[col3, 0, :], axis=0))
+    )
+
+
+def cp_update_fin(fin, feq):
+    fin[[0, 1, 2], 0, :] = feq[[0, 1, 2], 0, :] + fin[[8, 7, 6], 0, :] - feq[[8, 7, 6], 0, :]
+
+
+def cp_collision(fin, feq, omega):
+    return fin - omega * (fin - feq)
+
+
+def cp_bounce_back(fout, fin, obstacle):
+    """Bounce-back condition for obstacle.
+    in python language, we "slice" fout by obstacle
+    """
+    for i in range(9):
+        fout[i, obstacle] = fin[8 - i, obstacle]
+
+
+def cp_streaming_step(fin, fout):
+    for i in range(9):
+        fin[i, :, :] = cp.roll(cp.roll(fout[i, :, :], numpy_v[i, 0], axis=0), numpy_v[i, 1], axis=1)
+
+
+# Stages of `cp_step`, named as the kernels (see `utils.profiler.Profiler.wrap`)
+STAGES = SimpleNamespace(
+    outflow=cp_outflow,
+    macroscopic=cp_macroscopic,
+    inflow=cp_inflow,
+    equilibrium=cp_equilibrium,
+    update_fin=cp_update_fin,
+    collision=cp_collision,
+    bounce_back=cp_bounce_back,
+    streaming_step=cp_streaming_step,
+)
+
+
+def cp_step(fin, vel, obstacle, omega, stages=STAGES):
+    """One time step of `fin` (updated in place), with cupy arrays.
+    Returns the density and the velocity computed during the step.
+    """
+    stages.outflow(fin)
+    rho, u = stages.macroscopic(fin)
+    stages.inflow(u, vel, rho, fin)
+    feq = stages.equilibrium(rho, u)
+    stages.update_fin(fin, feq)
+    fout = stages.collision(fin, feq, omega)
+    stages.bounce_back(fout, fin, obstacle)
+    stages.streaming_step(fin, fout)
+    return rho, u
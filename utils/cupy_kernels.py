@@ -1,8 +1,16 @@
+import numpy
+import cupy
+import cupyx
 from cupyx import jit
-from cupy import float64
 from math import log, floor, ceil
+from functools import lru_cache
+from types import SimpleNamespace
+
+from utils.parameters import LAYOUTS, OPERATORS, PRECISIONS, layout, magic, operator, precision
 
 SM = 22
+TILE = (8, 32)  # Rows and columns of the tiles of `streaming_tiled`
+REDUCE = 256  # Threads per block of the reductions (`momentum_exchange`), a power of 2
 
 
 def dispatch(m, n):
@@ -24,94 +32,1021 @@ def dispatch1D(n):
     return threadsperblock, blockspergrid
 
 
-@jit.rawkernel()
-def equilibrium(rho, u, v, t, feq, nx, ny):
-    row, col = jit.grid(2)
-    if row < nx and col < ny:
-        vx = u[0, row, col]
-        vy = u[1, row, col]
-        usqr = 1.5 * (vx * vx + vy * vy)
-        for i in range(9):
-            cu = 3 * (v[i, 0] * vx + v[i, 1] * vy)
-            feq[i, row, col] = rho[row, col] * t[i] * (1 + cu + 0.5 * cu * cu - usqr)
-
-
-@jit.rawkernel()
-def macroscopic(fin, v, rho, u, nx, ny):
-    row, col = jit.grid(2)
-    if row < nx and col < ny:
-        trho = float64(0.0)
-        tu0 = float64(0.0)
-        tu1 = float64(0.0)
-        for i in range(9):
-            fvalue = fin[i, row, col]
-            trho += fvalue
-            tu0 += v[i, 0] * fvalue
-            tu1 += v[i, 1] * fvalue
-
-        rho[row, col] = trho
-        u[0, row, col] = tu0 / trho
-        u[1, row, col] = tu1 / trho
-
-
-@jit.rawkernel()
-def outflow(fin, nx, ny):
-    col = jit.grid(1)
-    if col < ny:
-        for i in range(3):
-            fin[6 + i, nx - 1, col] = fin[6 + i, nx - 2, col]
-
-
-@jit.rawkernel()
-def inflow(u, vel, rho, fin, ny):
-    col = jit.grid(1)
-    if col < ny:
-        u[0, 0, col] = vel[0, 0, col]
-        u[1, 0, col] = vel[1, 0, col]
-        t2 = fin[3, 0, col] + fin[4, 0, col] + fin[5, 0, col]
-        t3 = fin[6, 0, col] + fin[7, 0, col] + fin[8, 0, col]
-        rho[0, col] = (t2 + 2 * t3) / (1 - u[0, 0, col])
-
-
-@jit.rawkernel()
-def update_fin(fin, feq, ny):
-    col = jit.grid(1)
-    if col < ny:
-        for i in range(3):
-            fin[i, 0, col] = feq[i, 0, col] + fin[8 - i, 0, col] - feq[8 - i, 0, col]
-
-
-@jit.rawkernel()
-def collision(omega, fin, feq, fout, nx, ny):
-    row, col = jit.grid(2)
-    if row < nx and col < ny:
-        for i in range(9):
-            vomega = omega[row, col]
-            fout[i, row, col] = (1 - vomega) * fin[i, row, col] + vomega * feq[i, row, col]
-
-
-@jit.rawkernel()
-def bounce_back(fout, fin, obstacle, nx, ny):
-    row, col = jit.grid(2)
-    if row < nx and col < ny:
-        if obstacle[row, col]:
+def dispatch_reduce(n):
+    """Launch configuration of a reduction over n items: blocks of `REDUCE` threads."""
+    return REDUCE, n // REDUCE + bool(n % REDUCE)
+
+
+def layout_axes(ndim, layout="xy"):
+    """Axes of an array (9, nx, ny), (2, nx, ny) or (nx, ny) in the order they are stored."""
+    axes = LAYOUTS[layout]
+    return axes if ndim == 3 else tuple(a - 1 for a in axes if a != 0)
+
+
+def grid2D(nx, ny, layout="xy"):
+    """Extents of the thread grid of the 2D kernels specialized for `layout`:
+    threads along x follow the axis of the cells which is contiguous in memory.
+    """
+    axes = LAYOUTS[layout]
+    return (ny, nx) if axes.index(2) > axes.index(1) else (nx, ny)
+
+
+def dispatch2D(nx, ny, layout="xy"):
+    """Launch configuration of the 2D kernels specialized for `layout`."""
+    return dispatch(*grid2D(nx, ny, layout))
+
+
+def dispatch_ensemble(nx, ny, members, layout="xy"):
+    """Launch configuration of `ensemble_step`: the grid of `dispatch2D` for each member."""
+    (tx, ty), (bx, by) = dispatch2D(nx, ny, layout)
+    return (tx, ty, 1), (bx, by, members)
+
+
+def dispatch_tiled(nx, ny, layout="xy"):
+    """Launch configuration of `streaming_tiled`: one block of threads per tile of
+    `TILE` cells, threads along x following the axis contiguous in memory."""
+    rows, cols = TILE
+    threadsperblock = (rows, cols)
+    blockspergrid = (nx // rows + bool(nx % rows), ny // cols + bool(ny % cols))
+    if LAYOUTS[layout].index(2) > LAYOUTS[layout].index(1):
+        return threadsperblock[::-1], blockspergrid[::-1]
+    return threadsperblock, blockspergrid
+
+
+def candidates2D(nx, ny, layout="xy"):
+    """Launch configurations of the 2D kernels tried by `utils.autotune.Autotuner`:
+    blocks of 64 to 1024 threads not much larger than the grid, and `dispatch2D`.
+    """
+    m, n = grid2D(nx, ny, layout)
+    configs = [dispatch(m, n)]
+    for size in (64, 128, 256, 512, 1024):
+        for tx in (2 ** a for a in range(11) if 2 ** a <= size):
+            ty = size // tx
+            config = ((tx, ty), (m // tx + bool(m % tx), n // ty + bool(n % ty)))
+            if tx < 2 * m and ty < 2 * n and config not in configs:
+                configs.append(config)
+    return configs
+
+
+def candidates1D(n):
+    """Launch configurations of the 1D kernels tried by `utils.autotune.Autotuner`."""
+    configs = [dispatch1D(n)]
+    for t in (2 ** a for a in range(5, 11)):
+        config = (t, n // t + bool(n % t))
+        if t < 2 * n and config not in configs:
+            configs.append(config)
+    return configs
+
+
+to_device = cupy.asarray
+device_array = cupy.empty
+to_host = cupy.asnumpy
+
+
+def synchronize():
+    cupy.cuda.runtime.deviceSynchronize()
+
+
+def device_name():
+    name = cupy.cuda.runtime.getDeviceProperties(cupy.cuda.Device().id)["name"]
+    return name.decode() if isinstance(name, bytes) else name
+
+
+def use_device(rank, ranks):
+    """Device of the process `rank` out of `ranks` (processes share the GPUs in turn)."""
+    cupy.cuda.Device(rank % cupy.cuda.runtime.getDeviceCount()).use()
+
+
+def layout_array(array, layout="xy"):
+    """Copy of the host array `array` stored on the device in `layout` and seen
+    with its usual axes (kernels index it as usual)."""
+    axes = layout_axes(array.ndim, layout)
+    stored = cupy.asarray(numpy.ascontiguousarray(numpy.transpose(array, axes)))
+    return stored.transpose(numpy.argsort(axes))
+
+
+def layout_empty(shape, dtype=numpy.float64, layout="xy"):
+    """Device array stored in `layout` and seen with its usual axes `shape`."""
+    axes = layout_axes(len(shape), layout)
+    stored = cupy.empty(tuple(shape[a] for a in axes), dtype)
+    return stored.transpose(numpy.argsort(axes))
+
+
+def stored_view(array, layout="xy"):
+    """View of the device array `array` (seen with its usual axes) with its axes in
+    the order they are stored: C-contiguous, it is copied as a whole
+    (`copy_to_host_async`)."""
+    return array.transpose(layout_axes(array.ndim, layout))
+
+
+def amax(array, out):
+    """Maximum of `array` in `out[0]`, on the device."""
+    cupy.amax(array, out=out.reshape(()))
+
+
+pinned_empty = cupyx.empty_pinned
+
+
+def new_stream():
+    return cupy.cuda.Stream(non_blocking=True)
+
+
+def copy_on_device(array, out):
+    """Copy the device array `array` into the device array `out` (same shape) on the
+    current stream. Returns `out`."""
+    cupy.copyto(out, array)
+    return out
+
+
+def on_stream(kernel, blockspergrid, threadsperblock, stream):
+    """`kernel[blockspergrid, threadsperblock]` launched on `stream` instead of the
+    current stream."""
+    launch = kernel[blockspergrid, threadsperblock]
+
+    def launch_on_stream(*args):
+        with stream:
+            launch(*args)
+
+    return launch_on_stream
+
+
+def copy_to_host_async(array, out, stream, compute=None):
+    """Copy `array` into the pinned host array `out` on `stream`, once the work
+    queued before on `compute` (the current stream without it) is done. Returns
+    the event of the end of the copy.
+    """
+    ready = cupy.cuda.Event()
+    ready.record(compute)
+    stream.wait_event(ready)
+    array.get(stream=stream, out=out)
+    done = cupy.cuda.Event()
+    done.record(stream)
+    return done
+
+
+def copy_to_device_async(array, out, stream, compute=None):
+    """Copy the pinned host array `array` into `out` on `stream`: the work queued
+    afterwards on `compute` (the current stream without it) waits for the end of
+    the copy, the host does not.
+    """
+    out.set(array, stream=stream)
+    done = cupy.cuda.Event()
+    done.record(stream)
+    (cupy.cuda.get_current_stream() if compute is None else compute).wait_event(done)
+
+
+def record_event():
+    """Event at the current position of the current stream."""
+    event = cupy.cuda.Event()
+    event.record()
+    return event
+
+
+def elapsed_ns(start, end):
+    """Nanoseconds between two `record_event`."""
+    end.synchronize()
+    return int(cupy.cuda.get_elapsed_time(start, end) * 1e6)
+
+
+def capture(launch):
+    """CUDA graph of the kernels launched by `launch`, captured once on a new
+    stream: `graph.launch()` replays them on the current stream, without going
+    through Python and the marshalling of the arguments of each kernel."""
+    stream = cupy.cuda.Stream(non_blocking=True)
+    with stream:
+        stream.begin_capture()
+        launch()
+        return stream.end_capture()
+
+
+@lru_cache(maxsize=None)
+def specialize(precision="float64", layout="xy", relaxation="field", operator="bgk"):
+    """Kernels compiled for a precision of `utils.parameters.PRECISIONS`:
+    `real` is the type of the arithmetic (and of the arrays given to the kernels)
+    and `acc` the type in which the moments are accumulated.
+    With `layout`, threads along x follow the axis of the cells which is
+    contiguous in memory (see `dispatch2D`).
+    With `relaxation="scalar"`, the kernels take `omega` as a single relaxation
+    rate instead of a field (nx, ny) of rates.
+    `operator` is the collision of the kernels which relax the populations, one
+    of `utils.parameters.OPERATORS`.
+    """
+    fast_col = LAYOUTS[layout].index(2) > LAYOUTS[layout].index(1)
+    TR, TC = TILE
+    real, acc = (getattr(cupy, name) for name in PRECISIONS[precision])
+
+    # D2Q9 velocities (1 - k // 3, 1 - k % 3) and weights as constants, not
+    # tables read by the kernels
+    @jit.rawkernel(device=True)
+    def cx(k):
+        return 1 - k // 3
+
+    @jit.rawkernel(device=True)
+    def cy(k):
+        return 1 - k % 3
+
+    @jit.rawkernel(device=True)
+    def weight(k):
+        if k == 4:
+            return real(4 / 9)
+        if k % 2 == 1:
+            return real(1 / 9)
+        return real(1 / 36)
+
+    # Relaxation rate of a cell: the same scalar for every cell or a field (nx, ny)
+    if relaxation == "scalar":
+
+        @jit.rawkernel(device=True)
+        def omega_at(omega, row, col):
+            return omega
+
+    else:
+
+        @jit.rawkernel(device=True)
+        def omega_at(omega, row, col):
+            return omega[row, col]
+
+    # Collision operator (see `utils.parameters.OPERATORS`): `relax` gives the
+    # population k after the collision from the populations k and 8 - k and their
+    # equilibria (read only with `pairs`), `rate` the relaxation rate of the odd
+    # part (TRT) and `pxx`, `pxy`, `pyy` are the non-equilibrium momentum flux
+    # (regularized)
+    stress = operator == "regularized"
+    pairs = operator == "trt"
+    if operator == "trt":
+
+        @jit.rawkernel(device=True)
+        def rate(omega):
+            return real(1) / (real(magic) / (real(1) / omega - real(0.5)) + real(0.5))
+
+    else:
+
+        @jit.rawkernel(device=True)
+        def rate(omega):
+            return omega
+
+    if operator == "trt":
+
+        @jit.rawkernel(device=True)
+        def relax(f, fo, feq, feqo, omega, odd, k, pxx, pxy, pyy):
+            even = real(0.5) * (f + fo - feq - feqo)
+            return f - omega * even - odd * (f - feq - even)
+
+    elif operator == "regularized":
+
+        @jit.rawkernel(device=True)
+        def relax(f, fo, feq, feqo, omega, odd, k, pxx, pxy, pyy):
+            qxx = real(cx(k) * cx(k)) - real(1 / 3)
+            qyy = real(cy(k) * cy(k)) - real(1 / 3)
+            qxy = real(cx(k) * cy(k))
+            neq = real(4.5) * weight(k) * (qxx * pxx + real(2) * qxy * pxy + qyy * pyy)
+            return feq + (real(1) - omega) * neq
+
+    elif operator == "bgk":
+
+        @jit.rawkernel(device=True)
+        def relax(f, fo, feq, feqo, omega, odd, k, pxx, pxy, pyy):
+            return (real(1) - omega) * f + omega * feq
+
+    else:
+        raise ValueError("unknown operator {!r} (expected one of {})".format(operator, OPERATORS))
+
+    @jit.rawkernel()
+    def equilibrium(rho, u, feq, nx, ny):
+        row, col = jit.grid(2)
+        if fast_col:
+            row, col = col, row
+        if row < nx and col < ny:
+            vx = u[0, row, col]
+            vy = u[1, row, col]
+            usqr = real(1.5) * (vx * vx + vy * vy)
+            for i in range(9):
+                cu = real(3) * (real(cx(i)) * vx + real(cy(i)) * vy)
+                feq[i, row, col] = (
+                    rho[row, col] * weight(i) * (real(1) + cu + real(0.5) * cu * cu - usqr)
+                )
+
+    @jit.rawkernel()
+    def macroscopic(fin, rho, u, nx, ny):
+        row, col = jit.grid(2)
+        if fast_col:
+            row, col = col, row
+        if row < nx and col < ny:
+            trho = acc(0.0)
+            tu0 = acc(0.0)
+            tu1 = acc(0.0)
+            for i in range(9):
+                fvalue = acc(fin[i, row, col])
+                trho += fvalue
+                tu0 += acc(cx(i)) * fvalue
+                tu1 += acc(cy(i)) * fvalue
+
+            rho[row, col] = trho
+            u[0, row, col] = tu0 / trho
+            u[1, row, col] = tu1 / trho
+
+    @jit.rawkernel()
+    def outflow(fin, nx, ny):
+        col = jit.grid(1)
+        if col < ny:
+            for i in range(3):
+                fin[6 + i, nx - 1, col] = fin[6 + i, nx - 2, col]
+
+    @jit.rawkernel()
+    def inflow(u, vel, rho, fin, ny):
+        col = jit.grid(1)
+        if col < ny:
+            u[0, 0, col] = vel[0, 0, col]
+            u[1, 0, col] = vel[1, 0, col]
+            t2 = acc(fin[3, 0, col]) + fin[4, 0, col] + fin[5, 0, col]
+            t3 = acc(fin[6, 0, col]) + fin[7, 0, col] + fin[8, 0, col]
+            rho[0, col] = (t2 + acc(2) * t3) / (acc(1) - u[0, 0, col])
+
+    @jit.rawkernel()
+    def update_fin(fin, feq, ny):
+        col = jit.grid(1)
+        if col < ny:
+            for i in range(3):
+                fin[i, 0, col] = feq[i, 0, col] + fin[8 - i, 0, col] - feq[8 - i, 0, col]
+
+    @jit.rawkernel()
+    def collision(omega, fin, feq, fout, nx, ny):
+        row, col = jit.grid(2)
+        if fast_col:
+            row, col = col, row
+        if row < nx and col < ny:
+            vomega = omega_at(omega, row, col)
+            vodd = rate(vomega)
+            pxx = real(0)
+            pxy = real(0)
+            pyy = real(0)
+            if stress:
+                for i in range(9):
+                    fneq = fin[i, row, col] - feq[i, row, col]
+                    pxx += real(cx(i) * cx(i)) * fneq
+                    pxy += real(cx(i) * cy(i)) * fneq
+                    pyy += real(cy(i) * cy(i)) * fneq
+            for i in range(9):
+                fvalue = fin[i, row, col]
+                feqi = feq[i, row, col]
+                fopp, feqo = fvalue, feqi
+                if pairs:
+                    fopp = fin[8 - i, row, col]
+                    feqo = feq[8 - i, row, col]
+                fout[i, row, col] = relax(fvalue, fopp, feqi, feqo, vomega, vodd, i, pxx, pxy, pyy)
+
+    @jit.rawkernel()
+    def bounce_back(fout, fin, obstacle, nx, ny):
+        row, col = jit.grid(2)
+        if fast_col:
+            row, col = col, row
+        if row < nx and col < ny:
+            if obstacle[row, col]:
+                for i in range(9):
+                    fout[i, row, col] = fin[8 - i, row, col]
+
+    @jit.rawkernel()
+    def bounce_back_cells(fout, fin, cells, n):
+        """`bounce_back` of the n obstacle cells listed in `cells` (2, n) (rows and
+        columns, see `np_obstacle_cells`): a 1D launch over the obstacle only."""
+        c = jit.grid(1)
+        if c < n:
+            row = cells[0, c]
+            col = cells[1, c]
             for i in range(9):
                 fout[i, row, col] = fin[8 - i, row, col]
 
+    @jit.rawkernel()
+    def streaming_step(fin, fout, nx, ny):
+        row, col = jit.grid(2)
+        if fast_col:
+            row, col = col, row
+        if row < nx and col < ny:
+            for k in range(9):
+                i = row + cx(k)
+                j = col + cy(k)
+                if i == nx:
+                    i = 0
+                elif i == -1:
+                    i = nx - 1
+                if j == ny:
+                    j = 0
+                elif j == -1:
+                    j = ny - 1
+                fin[k, i, j] = fout[k, row, col]
 
-@jit.rawkernel()
-def streaming_step(fin, fout, v, nx, ny):
-    row, col = jit.grid(2)
-    if row < nx and col < ny:
+    @jit.rawkernel()
+    def streaming_tiled(fin, fout, rows, cols, nx, ny):
+        """`streaming_step` as a gather through shared memory: each block loads the
+        tile of `fout` it writes with a halo of one cell, and shifts it in the tile
+        (launched with `dispatch_tiled`). `rows` (nx + 2) and `cols` (ny + 2) are
+        the periodic indices of the halo (see `np_halo_indices`).
+        """
+        tile = jit.shared_memory(real, (TR + 2) * (TC + 2))
+        if fast_col:
+            tr, tc = jit.threadIdx.y, jit.threadIdx.x
+            top, left = jit.blockIdx.y * TR, jit.blockIdx.x * TC
+            thread = tr * TC + tc
+        else:
+            tr, tc = jit.threadIdx.x, jit.threadIdx.y
+            top, left = jit.blockIdx.x * TR, jit.blockIdx.y * TC
+            thread = tc * TR + tr
+        row = top + tr
+        col = left + tc
         for k in range(9):
-            i = row + v[k, 0]
-            j = col + v[k, 1]
-            if i == nx:
-                i = 0
-            elif i == -1:
-                i = nx - 1
-            if j == ny:
-                j = 0
-            elif j == -1:
-                j = ny - 1
-            fin[k, i, j] = fout[k, row, col]
+            # Tile cell (i, j) is the cell (top + i - 1, left + j - 1) of the lattice
+            for index in range(thread, (TR + 2) * (TC + 2), TR * TC):
+                if fast_col:
+                    i, j = index // (TC + 2), index % (TC + 2)
+                else:
+                    i, j = index % (TR + 2), index // (TR + 2)
+                if top + i <= nx + 1 and left + j <= ny + 1:
+                    tile[i * (TC + 2) + j] = fout[k, rows[top + i], cols[left + j]]
+            jit.syncthreads()
+            if row < nx and col < ny:
+                fin[k, row, col] = tile[(tr + 1 - cx(k)) * (TC + 2) + tc + 1 - cy(k)]
+            jit.syncthreads()
+
+    @jit.rawkernel(device=True)
+    def feq_k(rho, vx, vy, usqr, k):
+        cu = real(3) * (real(cx(k)) * vx + real(cy(k)) * vy)
+        return rho * weight(k) * (real(1) + cu + real(0.5) * cu * cu - usqr)
+
+    @jit.rawkernel(device=True)
+    def fin_k(fin, rho, vx, vy, usqr, k, row, col, nx):
+        # Population k once `outflow` and `update_fin` are applied to the cell
+        value = fin[k, row, col]
+        if row == nx - 1 and k >= 6:
+            value = fin[k, nx - 2, col]
+        elif row == 0 and k < 3:
+            value = feq_k(rho, vx, vy, usqr, k) + fin[8 - k, 0, col]
+            value -= feq_k(rho, vx, vy, usqr, 8 - k)
+        return value
+
+    @jit.rawkernel()
+    def collide_and_stream(fin, fout, vel, obstacle, omega, rho, u, nx, ny):
+        """`outflow`, `macroscopic`, `inflow`, `equilibrium`, `update_fin`,
+        `collision`, `bounce_back` and `streaming_step` in one pass per cell:
+        `fin` is only read and the next populations are written in `fout`.
+        """
+        row, col = jit.grid(2)
+        if fast_col:
+            row, col = col, row
+        if row < nx and col < ny:
+            trho = acc(0.0)
+            tu0 = acc(0.0)
+            tu1 = acc(0.0)
+            for i in range(9):
+                fvalue = acc(fin[i, row, col])
+                if row == nx - 1 and i >= 6:
+                    fvalue = acc(fin[i, nx - 2, col])
+                trho += fvalue
+                tu0 += acc(cx(i)) * fvalue
+                tu1 += acc(cy(i)) * fvalue
+
+            vx = real(tu0 / trho)
+            vy = real(tu1 / trho)
+            vrho = real(trho)
+            if row == 0:
+                vx = vel[0, 0, col]
+                vy = vel[1, 0, col]
+                t2 = acc(fin[3, 0, col]) + fin[4, 0, col] + fin[5, 0, col]
+                t3 = acc(fin[6, 0, col]) + fin[7, 0, col] + fin[8, 0, col]
+                vrho = real((t2 + acc(2) * t3) / (acc(1) - vx))
+            rho[row, col] = vrho
+            u[0, row, col] = vx
+            u[1, row, col] = vy
+
+            usqr = real(1.5) * (vx * vx + vy * vy)
+            vomega = omega_at(omega, row, col)
+            vodd = rate(vomega)
+            pxx = real(0)
+            pxy = real(0)
+            pyy = real(0)
+            if stress:
+                for i in range(9):
+                    fneq = fin_k(fin, vrho, vx, vy, usqr, i, row, col, nx)
+                    fneq -= feq_k(vrho, vx, vy, usqr, i)
+                    pxx += real(cx(i) * cx(i)) * fneq
+                    pxy += real(cx(i) * cy(i)) * fneq
+                    pyy += real(cy(i) * cy(i)) * fneq
+            for k in range(9):
+                if obstacle[row, col]:
+                    value = fin_k(fin, vrho, vx, vy, usqr, 8 - k, row, col, nx)
+                else:
+                    fvalue = fin_k(fin, vrho, vx, vy, usqr, k, row, col, nx)
+                    feqk = feq_k(vrho, vx, vy, usqr, k)
+                    fopp, feqo = fvalue, feqk
+                    if pairs:
+                        fopp = fin_k(fin, vrho, vx, vy, usqr, 8 - k, row, col, nx)
+                        feqo = feq_k(vrho, vx, vy, usqr, 8 - k)
+                    value = relax(fvalue, fopp, feqk, feqo, vomega, vodd, k, pxx, pxy, pyy)
+                i = row + cx(k)
+                j = col + cy(k)
+                if i == nx:
+                    i = 0
+                elif i == -1:
+                    i = nx - 1
+                if j == ny:
+                    j = 0
+                elif j == -1:
+                    j = ny - 1
+                fout[k, i, j] = value
+
+    @jit.rawkernel(device=True)
+    def member_fin_k(fin, m, rho, vx, vy, usqr, k, row, col, nx):
+        # `fin_k` of the member m of an ensemble
+        value = fin[m, k, row, col]
+        if row == nx - 1 and k >= 6:
+            value = fin[m, k, nx - 2, col]
+        elif row == 0 and k < 3:
+            value = feq_k(rho, vx, vy, usqr, k) + fin[m, 8 - k, 0, col]
+            value -= feq_k(rho, vx, vy, usqr, 8 - k)
+        return value
+
+    @jit.rawkernel()
+    def ensemble_step(fin, fout, vel, obstacle, omega, rho, u, nx, ny):
+        """`collide_and_stream` on a batch of independent lattices of the same size:
+        every array has a leading axis of members, `vel` is the inflow profile
+        (members, 2, ny) and `omega` has one value per member. The third axis of
+        the grid is the member (see `dispatch_ensemble`).
+        """
+        row, col, m = jit.grid(3)
+        if fast_col:
+            row, col = col, row
+        if row < nx and col < ny and m < fin.shape[0]:
+            trho = acc(0.0)
+            tu0 = acc(0.0)
+            tu1 = acc(0.0)
+            for i in range(9):
+                fvalue = acc(fin[m, i, row, col])
+                if row == nx - 1 and i >= 6:
+                    fvalue = acc(fin[m, i, nx - 2, col])
+                trho += fvalue
+                tu0 += acc(cx(i)) * fvalue
+                tu1 += acc(cy(i)) * fvalue
+
+            vx = real(tu0 / trho)
+            vy = real(tu1 / trho)
+            vrho = real(trho)
+            if row == 0:
+                vx = vel[m, 0, col]
+                vy = vel[m, 1, col]
+                t2 = acc(fin[m, 3, 0, col]) + fin[m, 4, 0, col] + fin[m, 5, 0, col]
+                t3 = acc(fin[m, 6, 0, col]) + fin[m, 7, 0, col] + fin[m, 8, 0, col]
+                vrho = real((t2 + acc(2) * t3) / (acc(1) - vx))
+            rho[m, row, col] = vrho
+            u[m, 0, row, col] = vx
+            u[m, 1, row, col] = vy
+
+            usqr = real(1.5) * (vx * vx + vy * vy)
+            vomega = omega[m]
+            vodd = rate(vomega)
+            pxx = real(0)
+            pxy = real(0)
+            pyy = real(0)
+            if stress:
+                for i in range(9):
+                    fneq = member_fin_k(fin, m, vrho, vx, vy, usqr, i, row, col, nx)
+                    fneq -= feq_k(vrho, vx, vy, usqr, i)
+                    pxx += real(cx(i) * cx(i)) * fneq
+                    pxy += real(cx(i) * cy(i)) * fneq
+                    pyy += real(cy(i) * cy(i)) * fneq
+            for k in range(9):
+                if obstacle[m, row, col]:
+                    value = member_fin_k(fin, m, vrho, vx, vy, usqr, 8 - k, row, col, nx)
+                else:
+                    fvalue = member_fin_k(fin, m, vrho, vx, vy, usqr, k, row, col, nx)
+                    feqk = feq_k(vrho, vx, vy, usqr, k)
+                    fopp, feqo = fvalue, feqk
+                    if pairs:
+                        fopp = member_fin_k(fin, m, vrho, vx, vy, usqr, 8 - k, row, col, nx)
+                        feqo = feq_k(vrho, vx, vy, usqr, 8 - k)
+                    value = relax(fvalue, fopp, feqk, feqo, vomega, vodd, k, pxx, pxy, pyy)
+                i = row + cx(k)
+                j = col + cy(k)
+                if i == nx:
+                    i = 0
+                elif i == -1:
+                    i = nx - 1
+                if j == ny:
+                    j = 0
+                elif j == -1:
+                    j = ny - 1
+                fout[m, k, i, j] = value
+
+    @jit.rawkernel(device=True)
+    def slab_fin_k(fin, rho, vx, vy, usqr, k, row, col, cell, nx):
+        # `fin_k` of the row `row` of a slab, row `cell` of the lattice
+        value = fin[k, row, col]
+        if cell == nx - 1 and k >= 6:
+            value = fin[k, row - 1, col]
+        elif cell == 0 and k < 3:
+            value = feq_k(rho, vx, vy, usqr, k) + fin[8 - k, row, col]
+            value -= feq_k(rho, vx, vy, usqr, 8 - k)
+        return value
+
+    @jit.rawkernel()
+    def slab_step(fin, fout, vel, obstacle, omega, rho, u, first, last, offset, nx, ny):
+        """`collide_and_stream` of the rows `first` to `last - 1` of a slab of the
+        lattice (see `utils.decomposition`): row r of the arrays (9, m + 2, ny) is
+        the row `offset + r - 1` of the lattice, rows 0 and m + 1 are halos. The
+        populations leaving the slab are written in the halos of `fout`.
+        """
+        row, col = jit.grid(2)
+        if fast_col:
+            row, col = col, row
+        row += first
+        if row < last and col < ny:
+            cell = offset + row - 1  # Row of the lattice
+            trho = acc(0.0)
+            tu0 = acc(0.0)
+            tu1 = acc(0.0)
+            for i in range(9):
+                fvalue = acc(fin[i, row, col])
+                if cell == nx - 1 and i >= 6:
+                    fvalue = acc(fin[i, row - 1, col])
+                trho += fvalue
+                tu0 += acc(cx(i)) * fvalue
+                tu1 += acc(cy(i)) * fvalue
+
+            vx = real(tu0 / trho)
+            vy = real(tu1 / trho)
+            vrho = real(trho)
+            if cell == 0:
+                vx = vel[0, row, col]
+                vy = vel[1, row, col]
+                t2 = acc(fin[3, row, col]) + fin[4, row, col] + fin[5, row, col]
+                t3 = acc(fin[6, row, col]) + fin[7, row, col] + fin[8, row, col]
+                vrho = real((t2 + acc(2) * t3) / (acc(1) - vx))
+            rho[row, col] = vrho
+            u[0, row, col] = vx
+            u[1, row, col] = vy
+
+            usqr = real(1.5) * (vx * vx + vy * vy)
+            vomega = omega_at(omega, row, col)
+            vodd = rate(vomega)
+            pxx = real(0)
+            pxy = real(0)
+            pyy = real(0)
+            if stress:
+                for i in range(9):
+                    fneq = slab_fin_k(fin, vrho, vx, vy, usqr, i, row, col, cell, nx)
+                    fneq -= feq_k(vrho, vx, vy, usqr, i)
+                    pxx += real(cx(i) * cx(i)) * fneq
+                    pxy += real(cx(i) * cy(i)) * fneq
+                    pyy += real(cy(i) * cy(i)) * fneq
+            for k in range(9):
+                if obstacle[row, col]:
+                    value = slab_fin_k(fin, vrho, vx, vy, usqr, 8 - k, row, col, cell, nx)
+                else:
+                    fvalue = slab_fin_k(fin, vrho, vx, vy, usqr, k, row, col, cell, nx)
+                    feqk = feq_k(vrho, vx, vy, usqr, k)
+                    fopp, feqo = fvalue, feqk
+                    if pairs:
+                        fopp = slab_fin_k(fin, vrho, vx, vy, usqr, 8 - k, row, col, cell, nx)
+                        feqo = feq_k(vrho, vx, vy, usqr, 8 - k)
+                    value = relax(fvalue, fopp, feqk, feqo, vomega, vodd, k, pxx, pxy, pyy)
+                j = col + cy(k)
+                if j == ny:
+                    j = 0
+                elif j == -1:
+                    j = ny - 1
+                fout[k, row + cx(k), j] = value
+
+    @jit.rawkernel()
+    def pack_halos(fout, send, m, ny):
+        """Populations leaving a slab (see `slab_step`), 6 to 8 in the halo row 0 and
+        0 to 2 in the halo row m + 1 of `fout`, gathered in `send` (2, 3, ny) to be
+        copied in one transfer."""
+        col = jit.grid(1)
+        if col < ny:
+            for k in range(3):
+                send[0, k, col] = fout[6 + k, 0, col]
+                send[1, k, col] = fout[k, m + 1, col]
+
+    @jit.rawkernel()
+    def unpack_halos(fout, recv, m, ny):
+        """Populations entering a slab: 0 to 2 from the previous slab (`recv[0]`) in
+        the row 1 of `fout`, 6 to 8 from the next one (`recv[1]`) in the row m."""
+        col = jit.grid(1)
+        if col < ny:
+            for k in range(3):
+                fout[k, 1, col] = recv[0, k, col]
+                fout[6 + k, m, col] = recv[1, k, col]
+
+    @jit.rawkernel(device=True)
+    def sparse_fin_k(fin, rho, vx, vy, usqr, k, c, west, row, nx):
+        # `fin_k` of the cell c of a compacted list
+        value = fin[k, c]
+        if row == nx - 1 and k >= 6:
+            value = fin[k, west]
+        elif row == 0 and k < 3:
+            value = feq_k(rho, vx, vy, usqr, k) + fin[8 - k, c]
+            value -= feq_k(rho, vx, vy, usqr, 8 - k)
+        return value
+
+    @jit.rawkernel()
+    def sparse_step(fin, fout, cells, neighbours, solid, vel, omega, rho, u, n, nx):
+        """`collide_and_stream` on the compacted list of cells of `utils.sparse`:
+        `fin[k, c]` is population k of cell c, at row `cells[0, c]`, and its
+        population k streams to cell `neighbours[k, c]` (the last cell is a sink
+        for the links towards the skipped solid cells). `vel`, `omega` and `solid`
+        are given per cell.
+        """
+        c = jit.grid(1)
+        if c < n:
+            row = cells[0, c]
+            west = neighbours[7, c]  # Cell (row - 1, col), read by the outflow
+            trho = acc(0.0)
+            tu0 = acc(0.0)
+            tu1 = acc(0.0)
+            for i in range(9):
+                fvalue = acc(fin[i, c])
+                if row == nx - 1 and i >= 6:
+                    fvalue = acc(fin[i, west])
+                trho += fvalue
+                tu0 += acc(cx(i)) * fvalue
+                tu1 += acc(cy(i)) * fvalue
+
+            vx = real(tu0 / trho)
+            vy = real(tu1 / trho)
+            vrho = real(trho)
+            if row == 0:
+                vx = vel[0, c]
+                vy = vel[1, c]
+                t2 = acc(fin[3, c]) + fin[4, c] + fin[5, c]
+                t3 = acc(fin[6, c]) + fin[7, c] + fin[8, c]
+                vrho = real((t2 + acc(2) * t3) / (acc(1) - vx))
+            rho[c] = vrho
+            u[0, c] = vx
+            u[1, c] = vy
+
+            usqr = real(1.5) * (vx * vx + vy * vy)
+            vomega = omega[c]
+            vodd = rate(vomega)
+            pxx = real(0)
+            pxy = real(0)
+            pyy = real(0)
+            if stress:
+                for i in range(9):
+                    fneq = sparse_fin_k(fin, vrho, vx, vy, usqr, i, c, west, row, nx)
+                    fneq -= feq_k(vrho, vx, vy, usqr, i)
+                    pxx += real(cx(i) * cx(i)) * fneq
+                    pxy += real(cx(i) * cy(i)) * fneq
+                    pyy += real(cy(i) * cy(i)) * fneq
+            for k in range(9):
+                if solid[c]:
+                    value = sparse_fin_k(fin, vrho, vx, vy, usqr, 8 - k, c, west, row, nx)
+                else:
+                    fvalue = sparse_fin_k(fin, vrho, vx, vy, usqr, k, c, west, row, nx)
+                    feqk = feq_k(vrho, vx, vy, usqr, k)
+                    fopp, feqo = fvalue, feqk
+                    if pairs:
+                        fopp = sparse_fin_k(fin, vrho, vx, vy, usqr, 8 - k, c, west, row, nx)
+                        feqo = feq_k(vrho, vx, vy, usqr, 8 - k)
+                    value = relax(fvalue, fopp, feqk, feqo, vomega, vodd, k, pxx, pxy, pyy)
+                fout[k, neighbours[k, c]] = value
+
+    @jit.rawkernel(device=True)
+    def aa_shift(x, c, parity, n):
+        # On odd steps, population with velocity c of cell x is stored in cell x - c
+        y = x
+        if parity == 1:
+            y = x - c
+            if y == n:
+                y = 0
+            elif y == -1:
+                y = n - 1
+        return y
+
+    @jit.rawkernel(device=True)
+    def aa_slot(k, parity):
+        return k + parity * (8 - 2 * k)
+
+    @jit.rawkernel()
+    def aa_outflow(f, parity, nx, ny):
+        """`outflow` on the single population array of the in-place (AA) pattern."""
+        col = jit.grid(1)
+        if col < ny:
+            for k in range(6, 9):
+                i = aa_slot(k, parity)
+                y = aa_shift(col, cy(k), parity, ny)
+                x1 = aa_shift(nx - 1, cx(k), parity, nx)
+                x2 = aa_shift(nx - 2, cx(k), parity, nx)
+                f[i, x1, y] = f[i, x2, y]
+
+    @jit.rawkernel()
+    def aa_step(f, parity, vel, obstacle, omega, rho, u, nx, ny):
+        """Same step as `collide_and_stream` but in place on a single population
+        array with the AA access pattern: on even steps (parity 0), a cell reads its
+        populations and writes them back reversed in its own location; on odd steps
+        (parity 1), it reads the reversed populations from its neighbours and writes
+        them streamed in their natural location. `aa_outflow` is applied before.
+        """
+        row, col = jit.grid(2)
+        if fast_col:
+            row, col = col, row
+        if row < nx and col < ny:
+            trho = acc(0.0)
+            tu0 = acc(0.0)
+            tu1 = acc(0.0)
+            for i in range(9):
+                x = aa_shift(row, cx(i), parity, nx)
+                y = aa_shift(col, cy(i), parity, ny)
+                fvalue = acc(f[aa_slot(i, parity), x, y])
+                trho += fvalue
+                tu0 += acc(cx(i)) * fvalue
+                tu1 += acc(cy(i)) * fvalue
+
+            vx = real(tu0 / trho)
+            vy = real(tu1 / trho)
+            vrho = real(trho)
+            if row == 0:
+                vx = vel[0, 0, col]
+                vy = vel[1, 0, col]
+                t2 = acc(0.0)
+                t3 = acc(0.0)
+                for i in range(3):
+                    y = aa_shift(col, cy(3 + i), parity, ny)
+                    t2 += f[aa_slot(3 + i, parity), 0, y]
+                    x = aa_shift(0, cx(6 + i), parity, nx)
+                    y = aa_shift(col, cy(6 + i), parity, ny)
+                    t3 += f[aa_slot(6 + i, parity), x, y]
+                vrho = real((t2 + acc(2) * t3) / (acc(1) - vx))
+            rho[row, col] = vrho
+            u[0, row, col] = vx
+            u[1, row, col] = vy
+
+            usqr = real(1.5) * (vx * vx + vy * vy)
+            vomega = omega_at(omega, row, col)
+            vodd = rate(vomega)
+            pxx = real(0)
+            pxy = real(0)
+            pyy = real(0)
+            if stress:
+                for i in range(9):
+                    j = i
+                    if row == 0 and i < 3:
+                        j = 8 - i  # Inflow: same flux as the opposite populations
+                    x = aa_shift(row, cx(j), parity, nx)
+                    y = aa_shift(col, cy(j), parity, ny)
+                    fneq = f[aa_slot(j, parity), x, y] - feq_k(vrho, vx, vy, usqr, j)
+                    pxx += real(cx(i) * cx(i)) * fneq
+                    pxy += real(cx(i) * cy(i)) * fneq
+                    pyy += real(cy(i) * cy(i)) * fneq
+            # Populations k and 8 - k swap their locations: they are read and written together
+            for k in range(5):
+                i1 = aa_slot(k, parity)
+                x1 = aa_shift(row, cx(k), parity, nx)
+                y1 = aa_shift(col, cy(k), parity, ny)
+                i2 = aa_slot(8 - k, parity)
+                x2 = aa_shift(row, cx(8 - k), parity, nx)
+                y2 = aa_shift(col, cy(8 - k), parity, ny)
+                a = f[i1, x1, y1]
+                b = f[i2, x2, y2]
+                feqa = feq_k(vrho, vx, vy, usqr, k)
+                feqb = feq_k(vrho, vx, vy, usqr, 8 - k)
+                if row == 0 and k < 3:
+                    a = feqa + b - feqb
+                if obstacle[row, col]:
+                    f[i2, x2, y2] = b
+                    f[i1, x1, y1] = a
+                else:
+                    f[i2, x2, y2] = relax(a, b, feqa, feqb, vomega, vodd, k, pxx, pxy, pyy)
+                    f[i1, x1, y1] = relax(b, a, feqb, feqa, vomega, vodd, 8 - k, pxx, pxy, pyy)
+
+    @jit.rawkernel()
+    def momentum_exchange(f, parity, obstacle, cells, n, force, nx, ny):
+        """Add to `force` (2,) the force of the fluid on the obstacle in the last step
+        (see `np_momentum_exchange`), summed over the n cells of the obstacle next to
+        the fluid listed in `cells` (see `np_boundary_cells`). `parity` is the one of
+        the next step of the in-place scheme, 0 for the other schemes. Each block
+        sums its cells in shared memory (tree reduction, launched with
+        `dispatch_reduce`), then adds its sum to `force` with one atomic per axis.
+        """
+        fx = jit.shared_memory(cupy.float64, REDUCE)
+        fy = jit.shared_memory(cupy.float64, REDUCE)
+        c = jit.grid(1)
+        thread = jit.threadIdx.x
+        fx[thread] = 0.0
+        fy[thread] = 0.0
+        if c < n:
+            row = cells[0, c]
+            col = cells[1, c]
+            for k in range(9):
+                # Population k streamed from the cell (row - cx(k), col - cy(k))
+                if not obstacle[aa_shift(row, cx(k), 1, nx), aa_shift(col, cy(k), 1, ny)]:
+                    x = aa_shift(row, cx(k), parity, nx)
+                    y = aa_shift(col, cy(k), parity, ny)
+                    value = cupy.float64(f[aa_slot(k, parity), x, y])
+                    fx[thread] += cx(k) * value
+                    fy[thread] += cy(k) * value
+        jit.syncthreads()
+        half = REDUCE // 2
+        while half > 0:
+            if thread < half:
+                fx[thread] += fx[thread + half]
+                fy[thread] += fy[thread + half]
+            jit.syncthreads()
+            half = half // 2
+        if thread == 0:
+            jit.atomic_add(force, 0, 2 * fx[0])
+            jit.atomic_add(force, 1, 2 * fy[0])
+
+    @jit.rawkernel()
+    def sample_probes(rho, u, cells, weights, m, ring, count):
+        """Density and velocity of the m probes (see `np_sample_probes`, `cells` and
+        `weights` of `np_probe_tables`) in the slot `count[0]` (modulo the number
+        of slots) of `ring` (slots, 3, m), then `count[0]` is incremented. A single
+        block (launched on [1, REDUCE]) strides over the probes: every thread reads
+        the slot before the increment, and the launch needs no argument of the
+        step (it is replayed as is from a CUDA graph).
+        """
+        slot = count[0] % ring.shape[0]
+        p = jit.threadIdx.x
+        while p < m:
+            r = 0.0
+            vx = 0.0
+            vy = 0.0
+            for c in range(4):
+                row = cells[0, c, p]
+                col = cells[1, c, p]
+                r += weights[c, p] * rho[row, col]
+                vx += weights[c, p] * u[0, row, col]
+                vy += weights[c, p] * u[1, row, col]
+            ring[slot, 0, p] = r
+            ring[slot, 1, p] = vx
+            ring[slot, 2, p] = vy
+            p += jit.blockDim.x
+        jit.syncthreads()
+        if jit.threadIdx.x == 0:
+            count[0] += 1
+
+    @jit.rawkernel()
+    def speed(u, s, nx, ny):
+        row, col = jit.grid(2)
+        if fast_col:
+            row, col = col, row
+        if row < nx and col < ny:
+            vx = u[0, row, col]
+            vy = u[1, row, col]
+            s[col, row] = cupy.sqrt(vx * vx + vy * vy)
+
+    @jit.rawkernel()
+    def to_frame(s, vmax, frame, nx, ny):
+        row, col = jit.grid(2)
+        if fast_col:
+            row, col = col, row
+        if row < nx and col < ny:
+            frame[col, row] = cupy.uint8(s[col, row] / vmax[0] * real(255))
+
+    return SimpleNamespace(
+        equilibrium=equilibrium,
+        macroscopic=macroscopic,
+        outflow=outflow,
+        inflow=inflow,
+        update_fin=update_fin,
+        collision=collision,
+        bounce_back=bounce_back,
+        bounce_back_cells=bounce_back_cells,
+        streaming_step=streaming_step,
+        streaming_tiled=streaming_tiled,
+        collide_and_stream=collide_and_stream,
+        ensemble_step=ensemble_step,
+        slab_step=slab_step,
+        pack_halos=pack_halos,
+        unpack_halos=unpack_halos,
+        sparse_step=sparse_step,
+        aa_outflow=aa_outflow,
+        aa_step=aa_step,
+        momentum_exchange=momentum_exchange,
+        sample_probes=sample_probes,
+        speed=speed,
+        to_frame=to_frame,
+    )
+
+
+kernels = specialize(precision, layout, operator=operator)
+equilibrium = kernels.equilibrium
+macroscopic = kernels.macroscopic
+outflow = kernels.outflow
+inflow = kernels.inflow
+update_fin = kernels.update_fin
+collision = kernels.collision
+bounce_back = kernels.bounce_back
+bounce_back_cells = kernels.bounce_back_cells
+streaming_step = kernels.streaming_step
+streaming_tiled = kernels.streaming_tiled
+collide_and_stream = kernels.collide_and_stream
+ensemble_step = kernels.ensemble_step
+slab_step = kernels.slab_step
+pack_halos = kernels.pack_halos
+unpack_halos = kernels.unpack_halos
+sparse_step = kernels.sparse_step
+aa_outflow = kernels.aa_outflow
+aa_step = kernels.aa_step
+momentum_exchange = kernels.momentum_exchange
+sample_probes = kernels.sample_probes
+speed = kernels.speed
+to_frame = kernels.to_frame
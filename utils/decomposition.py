@@ -0,0 +1,239 @@
+import multiprocessing
+from importlib import import_module
+from multiprocessing.connection import wait
+
+import numpy as np
+
+
+def slabs(nx, ranks):
+    """Offset and number of rows of the slab of each rank, the rows of the lattice
+    being split as evenly as possible."""
+    sizes = [nx // ranks + (rank < nx % ranks) for rank in range(ranks)]
+    if min(sizes) < 2:
+        raise ValueError("{} rows cannot be split in {} slabs of 2 rows".format(nx, ranks))
+    offsets = np.cumsum([0] + sizes[:-1])
+    return [(int(offset), size) for offset, size in zip(offsets, sizes)]
+
+
+class Decomposition:
+    """Fused scheme of `config` on a lattice split in `ranks` slabs along x, one
+    process per slab (and per device of `backend` with `use_device`).
+
+    Each process keeps its m rows in arrays (9, m + 2, ny) with one halo row on
+    each side, where `slab_step` writes the populations leaving the slab. A step
+    computes the two edge rows first and gathers their outgoing populations
+    (`pack_halos`), which are copied to pinned host memory in one transfer on a
+    stream of copies while the interior rows are computed, then published in a
+    shared buffer. The populations coming from the neighbours are copied back in
+    one transfer on that stream, and written in the edge rows (`unpack_halos`)
+    once the copy is done, before the next step: the host never waits for the
+    interior rows.
+    The kernels run on a stream of their own, ordered against the copies by
+    events only, so that the copies overlap the interior rows on the numba CUDA
+    and cupy backends. The numba CPU backend has no stream: its copies are
+    synchronous and run after the interior rows.
+    The first and last slabs are neighbours (periodic lattice), and the inflow
+    and outflow rows are the ones of the lattice, so that the result is exactly
+    the one of the fused scheme of a single `utils.simulation.Simulation`.
+
+    The processes are started by the first command and kept with their compiled
+    kernels and device arrays until `close`: `run` only sends them the number of
+    steps. The state of the lattice is gathered in shared host memory only when
+    it is read (`populations` and `velocity`) or the processes are closed, from
+    which the next `run` starts them again.
+    """
+
+    def __init__(self, config, backend, ranks, obstacle=None):
+        self.config, self.backend, self.ranks, self.time = config, backend, ranks, 0
+        self.obstacle = obstacle
+        self.slabs = slabs(config.nx, ranks)
+        self.context = multiprocessing.get_context("spawn")  # CUDA is not fork-safe
+        nx, ny, ctype = config.nx, config.ny, np.ctypeslib.as_ctypes_type(config.dtype)
+        self.shared = [self.context.RawArray(ctype, n) for n in (9 * nx * ny, 2 * nx * ny)]
+        # Outgoing populations: per parity of the step, rank, side and population
+        self.halos = self.context.RawArray(ctype, 2 * ranks * 2 * 3 * ny)
+        self.barrier = self.context.Barrier(ranks)
+        self.processes, self.commands, self.gathered = [], [], None
+
+    def start(self):
+        for rank in range(self.ranks):
+            commands, worker = self.context.Pipe()
+            process = self.context.Process(
+                target=run_slab,
+                args=(
+                    rank,
+                    self.ranks,
+                    self.config,
+                    self.backend.__name__,
+                    self.obstacle,
+                    self.time,
+                    self.halos,
+                    self.barrier,
+                    self.shared,
+                    worker,
+                ),
+                daemon=True,
+            )
+            process.start()
+            worker.close()
+            self.processes.append(process)
+            self.commands.append(commands)
+
+    def command(self, *command):
+        """Send `command` to every process and wait for all of them to execute it."""
+        if not self.processes:
+            self.start()
+        for commands in self.commands:
+            commands.send(command)
+        ranks = {commands: rank for rank, commands in enumerate(self.commands)}
+        ranks.update({process.sentinel: rank for rank, process in enumerate(self.processes)})
+        pending = set(self.commands)
+        while pending:
+            for ready in wait(list(ranks)):
+                try:
+                    # A sentinel is only ready once its process has exited
+                    if ready not in pending:
+                        raise EOFError
+                    ready.recv()
+                    pending.remove(ready)
+                except (EOFError, OSError):
+                    # A failed process breaks the barrier instead of leaving the others waiting
+                    self.barrier.abort()
+                    for process in self.processes:
+                        process.terminate()
+                        process.join()
+                    self.stop()
+                    raise RuntimeError("the process of the slab {} failed".format(ranks[ready]))
+
+    def run(self, n):
+        """Iterations `time` to `time + n - 1`, one process per slab."""
+        self.command("run", n)
+        self.time += n
+
+    def close(self):
+        """Gather the state on the host and stop the processes."""
+        if self.processes:
+            self.gather()
+        self.stop()
+
+    def stop(self):
+        for commands, process in zip(self.commands, self.processes):
+            if process.is_alive():
+                commands.send(("stop",))
+            process.join()
+            commands.close()
+        self.processes, self.commands, self.gathered = [], [], None
+        self.barrier = self.context.Barrier(self.ranks)
+
+    def populations(self):
+        """Populations (9, nx, ny) on the host."""
+        return self.array(0, (9, self.config.nx, self.config.ny)).copy()
+
+    def velocity(self):
+        """Velocity (2, nx, ny) of the last step on the host."""
+        return self.array(1, (2, self.config.nx, self.config.ny)).copy()
+
+    def gather(self):
+        # The slabs are copied to the host once per state
+        if self.gathered != self.time:
+            self.command("gather")
+            self.gathered = self.time
+
+    def array(self, index, shape):
+        if self.processes:
+            self.gather()
+        return np.frombuffer(self.shared[index], dtype=self.config.dtype).reshape(shape)
+
+
+def run_slab(rank, ranks, config, name, obstacle, time, halos, barrier, shared, commands):
+    """Process of the slab `rank` (see `Decomposition`) from iteration `time`, the
+    state being loaded from `shared` after the first one. It executes the commands
+    received from `commands` until "stop": ("run", n) for n iterations, ("gather",)
+    to save its rows in `shared`. Each command is acknowledged once executed."""
+    backend = import_module(name)
+    backend.use_device(rank, ranks)
+    kernels = backend.specialize(config.precision, "xy", "scalar", config.operator)
+    nx, ny, dtype = config.nx, config.ny, config.dtype
+    offset, m = slabs(nx, ranks)[rank]
+    rows = np.arange(offset - 1, offset + m + 1) % nx  # Rows of the lattice, with the halos
+    fin, u = (
+        np.frombuffer(array, dtype=dtype).reshape(shape)
+        for array, shape in zip(shared, ((9, nx, ny), (2, nx, ny)))
+    )
+    buffers = np.frombuffer(halos, dtype=dtype).reshape(2, ranks, 2, 3, ny)
+    previous, following = (rank - 1) % ranks, (rank + 1) % ranks
+
+    # Kernels on `compute`, copies on `stream`, ordered by events: nothing is queued on
+    # the default stream, which would serialize them
+    compute, stream = backend.new_stream(), backend.new_stream()
+    vel = config.velocity(rows).astype(dtype)
+    d_obstacle = backend.to_device(config.obstacle(rows) if obstacle is None else obstacle[rows])
+    d_vel = backend.to_device(vel)
+    d_omega = dtype.type(config.omega)
+    d_rho = backend.to_device(np.ones((m + 2, ny), dtype=dtype))
+    d_u = backend.device_array((2, m + 2, ny), dtype)
+    d_fout = backend.device_array((9, m + 2, ny), dtype)
+    if time == 0:
+        # Populations at equilibrium with the initial velocity, as a `Simulation`
+        d_fin = backend.device_array((9, m + 2, ny), dtype)
+        threadsperblock, blockspergrid = backend.dispatch2D(m + 2, ny)
+        kernels.equilibrium[blockspergrid, threadsperblock](d_rho, d_vel, d_fin, m + 2, ny)
+    else:
+        d_fin = backend.to_device(np.ascontiguousarray(fin[:, rows]))
+    backend.synchronize()
+
+    def step(first, last):
+        threadsperblock, blockspergrid = backend.dispatch2D(last - first, ny)
+        backend.on_stream(kernels.slab_step, blockspergrid, threadsperblock, compute)(
+            d_fin,
+            d_fout,
+            d_vel,
+            d_obstacle,
+            d_omega,
+            d_rho,
+            d_u,
+            first,
+            last,
+            offset,
+            nx,
+            ny,
+        )
+
+    # Populations leaving and entering the slab, each way in one transfer on `stream`
+    d_send, d_recv = (backend.device_array((2, 3, ny), dtype) for _ in range(2))
+    send, recv = (backend.pinned_empty((2, 3, ny), dtype) for _ in range(2))
+    threadsperblock, blockspergrid = backend.dispatch1D(ny)
+    pack = backend.on_stream(kernels.pack_halos, blockspergrid, threadsperblock, compute)
+    unpack = backend.on_stream(kernels.unpack_halos, blockspergrid, threadsperblock, compute)
+
+    while True:
+        command = commands.recv()
+        if command[0] == "stop":
+            break
+        if command[0] == "run":
+            for i in range(command[1]):
+                outgoing = buffers[(time + i) % 2]
+                step(1, 2)
+                step(m, m + 1)
+                pack(d_fout, d_send, m, ny)
+                done = backend.copy_to_host_async(d_send, send, stream, compute)
+                if m > 2:
+                    step(2, m)
+                # The host only waits for the edge rows, the interior ones are computed meanwhile
+                if done is not None:
+                    done.synchronize()
+                outgoing[rank] = send
+                barrier.wait()
+                # Populations 0, 1, 2 come from the previous slab, 6, 7, 8 from the next one,
+                # copied in the edge rows before the next step
+                recv[0], recv[1] = outgoing[previous, 1], outgoing[following, 0]
+                backend.copy_to_device_async(recv, d_recv, stream, compute)
+                unpack(d_fout, d_recv, m, ny)
+                d_fin, d_fout = d_fout, d_fin
+            time += command[1]
+        else:
+            # The copies to the host are on the default stream, after the kernels
+            backend.synchronize()
+            fin[:, offset : offset + m] = backend.to_host(d_fin)[:, 1 : m + 1]
+            u[:, offset : offset + m] = backend.to_host(d_u)[:, 1 : m + 1]
+        commands.send(command[0])
@@ -0,0 +1,87 @@
+import numpy as np
+
+
+class Ensemble:
+    """Independent simulations of `configs` (`utils.simulation.LatticeConfig` of
+    the same size, precision and operator, e.g. a sweep over `Re`, `uLB` or `r`)
+    advanced together: one launch of `ensemble_step` per step for all the members.
+
+    Populations are stacked in a (members, 9, nx, ny) array (each member in the
+    "xy" layout), with one `omega`, inflow profile and obstacle per member. Each
+    member follows exactly the fused scheme of a `Simulation` of its config.
+    """
+
+    def __init__(self, configs, backend):
+        self.configs, self.backend, self.time = list(configs), backend, 0
+        first = self.configs[0]
+        key = (first.nx, first.ny, first.precision, first.operator)
+        for config in self.configs:
+            if (config.nx, config.ny, config.precision, config.operator) != key:
+                raise ValueError(
+                    "members must have the same size, precision and operator: {!r} and {!r}".format(
+                        first, config
+                    )
+                )
+        nx, ny, dtype, members = first.nx, first.ny, first.dtype, len(self.configs)
+        self.kernels = backend.specialize(first.precision, "xy", operator=first.operator)
+        self.threadsperblock, self.blockspergrid = backend.dispatch_ensemble(nx, ny, members)
+
+        velocities = [config.velocity().astype(dtype) for config in self.configs]
+        self.d_obstacle = backend.to_device(
+            np.stack([config.obstacle() for config in self.configs])
+        )
+        self.d_vel = backend.to_device(np.stack([vel[:, 0, :] for vel in velocities]))
+        self.d_omega = backend.to_device(
+            np.array([config.omega for config in self.configs], dtype=dtype)
+        )
+        self.d_rho = backend.to_device(np.ones((members, nx, ny), dtype=dtype))
+        self.d_u = backend.device_array((members, 2, nx, ny), dtype)
+        self.d_fin = backend.device_array((members, 9, nx, ny), dtype)
+        self.d_fout = backend.device_array((members, 9, nx, ny), dtype)
+
+        # Populations at equilibrium with the initial velocity, member by member
+        # (same kernel as the initialisation of a `Simulation`)
+        threadsperblock, blockspergrid = backend.dispatch2D(nx, ny)
+        for m, vel in enumerate(velocities):
+            self.kernels.equilibrium[blockspergrid, threadsperblock](
+                self.d_rho[m], backend.to_device(vel), self.d_fin[m], nx, ny
+            )
+
+    def __len__(self):
+        return len(self.configs)
+
+    def step(self):
+        """One iteration of every member."""
+        nx, ny = self.configs[0].nx, self.configs[0].ny
+        self.kernels.ensemble_step[self.blockspergrid, self.threadsperblock](
+            self.d_fin,
+            self.d_fout,
+            self.d_vel,
+            self.d_obstacle,
+            self.d_omega,
+            self.d_rho,
+            self.d_u,
+            nx,
+            ny,
+        )
+        self.d_fin, self.d_fout = self.d_fout, self.d_fin
+        self.time += 1
+
+    def run(self, n):
+        for _ in range(n):
+            self.step()
+
+    def populations(self, member=None):
+        """Populations (9, nx, ny) of `member` on the host, or of every member."""
+        array = self.d_fin if member is None else self.d_fin[member]
+        return self.backend.to_host(array)
+
+    def velocity(self, member=None):
+        """Velocity (2, nx, ny) of the last step of `member` on the host, or of every member."""
+        array = self.d_u if member is None else self.d_u[member]
+        return self.backend.to_host(array)
+
+    def density(self, member=None):
+        """Density (nx, ny) of the last step of `member` on the host, or of every member."""
+        array = self.d_rho if member is None else self.d_rho[member]
+        return self.backend.to_host(array)
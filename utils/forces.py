@@ -0,0 +1,68 @@
+from pathlib import Path
+
+import numpy as np
+
+HEADER = "# iteration drag lift cd cl\n"
+
+
+def add_arguments(parser):
+    """Options of the drivers to write the forces on the obstacle in a `ForceLog`."""
+    parser.add_argument(
+        "--forces",
+        default=None,
+        metavar="FILE",
+        help="Write the drag and lift on the cylinder (momentum exchange) in FILE",
+    )
+    parser.add_argument(
+        "--forces-every",
+        type=int,
+        default=10,
+        metavar="N",
+        help="Mean forces over every N iterations (default: %(default)s)",
+    )
+
+
+def coefficients(force, config):
+    """Drag and lift coefficients 2 F / (rho U^2 D) of `force` (2,) on the cylinder
+    of `config` (density 1, inflow velocity `uLB`, diameter 2 r)."""
+    return 2 * np.asarray(force) / (config.uLB ** 2 * 2 * config.r)
+
+
+def strouhal(times, lift, config):
+    """Strouhal number f D / U of the vortex shedding, f being the main frequency
+    of `lift` sampled at the iterations `times` (evenly spaced, after the
+    transient)."""
+    lift = np.asarray(lift, dtype=np.float64)
+    spectrum = np.abs(np.fft.rfft(lift - lift.mean()))
+    frequencies = np.fft.rfftfreq(len(lift), times[1] - times[0])
+    return frequencies[1 + np.argmax(spectrum[1:])] * 2 * config.r / config.uLB
+
+
+class ForceLog:
+    """Text file of the forces on the obstacle (`Simulation.forces`), one line per
+    output: iteration, drag and lift (mean per step since the previous line, in
+    lattice units) and their coefficients. `np.loadtxt(path, unpack=True)` reads
+    the columns back.
+
+    With `resume`, the lines of the iterations from `time` are dropped: a run
+    resumed at `time` writes them again.
+    """
+
+    def __init__(self, path, config, resume=False, time=0):
+        self.config = config
+        lines = [HEADER]
+        if resume and Path(path).exists():
+            lines = [
+                line
+                for line in Path(path).read_text().splitlines(keepends=True)
+                if line.startswith("#") or int(line.split()[0]) < time
+            ]
+        self.file = open(path, "w")
+        self.file.writelines(lines)
+
+    def write(self, time, force):
+        cd, cl = coefficients(force, self.config)
+        self.file.write("{} {:.9e} {:.9e} {:.9e} {:.9e}\n".format(time, *force, cd, cl))
+
+    def close(self):
+        self.file.close()
@@ -0,0 +1,1212 @@
+import numpy as np
+import numba
+from numba import njit, prange, int64, set_num_threads, config
+from functools import lru_cache
+from time import perf_counter_ns
+from types import SimpleNamespace
+
+from utils.parameters import LAYOUTS, OPERATORS, PRECISIONS, layout, magic, operator, precision
+
+
+class Kernel:
+    """Wrap a `@njit(parallel=True)` function so that it is launched like the
+    CUDA kernels of `utils.numba_kernels` (`kernel[blockspergrid, threadsperblock](...)`).
+    The launch configuration is ignored: the loops are split over CPU threads.
+    """
+
+    def __init__(self, function):
+        self.function = njit(parallel=True, cache=True)(function)
+
+    def __getitem__(self, config):
+        return self.function
+
+    def __call__(self, *args):
+        return self.function(*args)
+
+
+def dispatch(m, n):
+    return (1, 1), (m, n)
+
+
+def dispatch1D(n):
+    return 1, n
+
+
+def dispatch_reduce(n):
+    return dispatch1D(n)
+
+
+to_device = np.array
+device_array = np.empty
+to_host = np.array
+
+
+def synchronize():
+    pass
+
+
+def layout_axes(ndim, layout="xy"):
+    """Axes of an array (9, nx, ny), (2, nx, ny) or (nx, ny) in the order they are stored."""
+    axes = LAYOUTS[layout]
+    return axes if ndim == 3 else tuple(a - 1 for a in axes if a != 0)
+
+
+def dispatch2D(nx, ny, layout="xy"):
+    return dispatch(nx, ny)
+
+
+def dispatch_ensemble(nx, ny, members, layout="xy"):
+    return dispatch(nx, ny)
+
+
+def dispatch_tiled(nx, ny, layout="xy"):
+    return dispatch(nx, ny)
+
+
+# A single launch configuration: nothing to tune on CPU
+def candidates2D(nx, ny, layout="xy"):
+    return [dispatch(nx, ny)]
+
+
+def candidates1D(n):
+    return [dispatch1D(n)]
+
+
+def device_name():
+    return "cpu"
+
+
+def use_device(rank, ranks):
+    """Device of the process `rank` out of `ranks`: its share of the CPU cores."""
+    set_num_threads(max(1, config.NUMBA_NUM_THREADS // ranks))
+
+
+def layout_array(array, layout="xy"):
+    """Copy of `array` stored in `layout` and seen with its usual axes."""
+    axes = layout_axes(array.ndim, layout)
+    return np.array(np.transpose(array, axes), order="C").transpose(np.argsort(axes))
+
+
+def layout_empty(shape, dtype=np.float64, layout="xy"):
+    """Array stored in `layout` and seen with its usual axes `shape`."""
+    axes = layout_axes(len(shape), layout)
+    return np.empty(tuple(shape[a] for a in axes), dtype).transpose(np.argsort(axes))
+
+
+def stored_view(array, layout="xy"):
+    """View of `array` (seen with its usual axes) with its axes in the order they
+    are stored: C-contiguous, it is copied as a whole (`copy_to_host_async`)."""
+    return np.transpose(array, layout_axes(array.ndim, layout))
+
+
+def thread_counts():
+    """Thread counts used to report MLUPS: powers of 2 up to all the cores."""
+    n, counts = config.NUMBA_NUM_THREADS, []
+    i = 1
+    while i < n:
+        counts.append(i)
+        i *= 2
+    return counts + [n]
+
+
+def amax(array, out):
+    out[0] = array.max()
+
+
+# No device: frames are copied synchronously, and never overlap the kernels
+pinned_empty = np.empty
+
+
+def new_stream():
+    return None
+
+
+def copy_on_device(array, out):
+    np.copyto(out, array)
+    return out
+
+
+def on_stream(kernel, blockspergrid, threadsperblock, stream):
+    return kernel[blockspergrid, threadsperblock]
+
+
+def copy_to_host_async(array, out, stream, compute=None):
+    np.copyto(out, array)
+
+
+def copy_to_device_async(array, out, stream, compute=None):
+    np.copyto(out, array)
+
+
+# Kernels return once done: events are times
+record_event = perf_counter_ns
+
+
+def elapsed_ns(start, end):
+    return end - start
+
+
+# Nothing to capture: time loops are compiled instead (`*_steps` of `specialize`)
+def capture(launch):
+    return SimpleNamespace(launch=launch)
+
+
+@lru_cache(maxsize=None)
+def specialize(precision="float64", layout="xy", relaxation="field", operator="bgk"):
+    """Kernels compiled for a precision of `utils.parameters.PRECISIONS`:
+    `real` is the type of the arithmetic (and of the arrays given to the kernels)
+    and `acc` the type in which the moments are accumulated.
+    Arrays can be stored in any `layout` (see `layout_array`), the loops stay
+    over rows then columns.
+    With `relaxation="scalar"`, the kernels take `omega` as a single relaxation
+    rate instead of a field (nx, ny) of rates.
+    `operator` is the collision of the kernels which relax the populations, one
+    of `utils.parameters.OPERATORS`.
+    """
+    real, acc = (getattr(numba, name) for name in PRECISIONS[precision])
+
+    # D2Q9 velocities (1 - k // 3, 1 - k % 3) and weights as constants, not
+    # tables read by the kernels
+    @njit
+    def cx(k):
+        return 1 - k // 3
+
+    @njit
+    def cy(k):
+        return 1 - k % 3
+
+    @njit
+    def weight(k):
+        if k == 4:
+            return real(4 / 9)
+        if k % 2 == 1:
+            return real(1 / 9)
+        return real(1 / 36)
+
+    # Relaxation rate of a cell: the same scalar for every cell or a field (nx, ny)
+    if relaxation == "scalar":
+
+        @njit
+        def omega_at(omega, row, col):
+            return omega
+
+    else:
+
+        @njit
+        def omega_at(omega, row, col):
+            return omega[row, col]
+
+    # Collision operator (see `utils.parameters.OPERATORS`): `relax` gives the
+    # population k after the collision from the populations k and 8 - k and their
+    # equilibria (read only with `pairs`), `rate` the relaxation rate of the odd
+    # part (TRT) and `pxx`, `pxy`, `pyy` are the non-equilibrium momentum flux
+    # (regularized)
+    stress = operator == "regularized"
+    pairs = operator == "trt"
+    if operator == "trt":
+
+        @njit
+        def rate(omega):
+            return real(1) / (real(magic) / (real(1) / omega - real(0.5)) + real(0.5))
+
+    else:
+
+        @njit
+        def rate(omega):
+            return omega
+
+    if operator == "trt":
+
+        @njit
+        def relax(f, fo, feq, feqo, omega, odd, k, pxx, pxy, pyy):
+            even = real(0.5) * (f + fo - feq - feqo)
+            return f - omega * even - odd * (f - feq - even)
+
+    elif operator == "regularized":
+
+        @njit
+        def relax(f, fo, feq, feqo, omega, odd, k, pxx, pxy, pyy):
+            qxx = real(cx(k) * cx(k)) - real(1 / 3)
+            qyy = real(cy(k) * cy(k)) - real(1 / 3)
+            qxy = real(cx(k) * cy(k))
+            neq = real(4.5) * weight(k) * (qxx * pxx + real(2) * qxy * pxy + qyy * pyy)
+            return feq + (real(1) - omega) * neq
+
+    elif operator == "bgk":
+
+        @njit
+        def relax(f, fo, feq, feqo, omega, odd, k, pxx, pxy, pyy):
+            return (real(1) - omega) * f + omega * feq
+
+    else:
+        raise ValueError("unknown operator {!r} (expected one of {})".format(operator, OPERATORS))
+
+    @Kernel
+    def equilibrium(rho, u, feq, nx, ny):
+        for row in prange(nx):
+            for col in range(ny):
+                vx = u[0, row, col]
+                vy = u[1, row, col]
+                usqr = real(1.5) * (vx * vx + vy * vy)
+                for i in range(9):
+                    cu = real(3) * (real(cx(i)) * vx + real(cy(i)) * vy)
+                    feq[i, row, col] = (
+                        rho[row, col] * weight(i) * (real(1) + cu + real(0.5) * cu * cu - usqr)
+                    )
+
+    @Kernel
+    def macroscopic(fin, rho, u, nx, ny):
+        for row in prange(nx):
+            for col in range(ny):
+                trho = acc(0.0)
+                tu0 = acc(0.0)
+                tu1 = acc(0.0)
+                for i in range(9):
+                    fvalue = acc(fin[i, row, col])
+                    trho += fvalue
+                    tu0 += acc(cx(i)) * fvalue
+                    tu1 += acc(cy(i)) * fvalue
+
+                rho[row, col] = trho
+                u[0, row, col] = tu0 / trho
+                u[1, row, col] = tu1 / trho
+
+    @Kernel
+    def outflow(fin, nx, ny):
+        for col in prange(ny):
+            for i in range(3):
+                fin[6 + i, nx - 1, col] = fin[6 + i, nx - 2, col]
+
+    @Kernel
+    def inflow(u, vel, rho, fin, ny):
+        for col in prange(ny):
+            u[0, 0, col] = vel[0, 0, col]
+            u[1, 0, col] = vel[1, 0, col]
+            t2 = acc(fin[3, 0, col]) + fin[4, 0, col] + fin[5, 0, col]
+            t3 = acc(fin[6, 0, col]) + fin[7, 0, col] + fin[8, 0, col]
+            rho[0, col] = (t2 + acc(2) * t3) / (acc(1) - u[0, 0, col])
+
+    @Kernel
+    def update_fin(fin, feq, ny):
+        for col in prange(ny):
+            for i in range(3):
+                fin[i, 0, col] = feq[i, 0, col] + fin[8 - i, 0, col] - feq[8 - i, 0, col]
+
+    @Kernel
+    def collision(omega, fin, feq, fout, nx, ny):
+        for row in prange(nx):
+            for col in range(ny):
+                vomega = omega_at(omega, row, col)
+                vodd = rate(vomega)
+                pxx = real(0)
+                pxy = real(0)
+                pyy = real(0)
+                if stress:
+                    for i in range(9):
+                        fneq = fin[i, row, col] - feq[i, row, col]
+                        pxx += real(cx(i) * cx(i)) * fneq
+                        pxy += real(cx(i) * cy(i)) * fneq
+                        pyy += real(cy(i) * cy(i)) * fneq
+                for i in range(9):
+                    fvalue = fin[i, row, col]
+                    feqi = feq[i, row, col]
+                    fopp, feqo = fvalue, feqi
+                    if pairs:
+                        fopp = fin[8 - i, row, col]
+                        feqo = feq[8 - i, row, col]
+                    fout[i, row, col] = relax(
+                        fvalue, fopp, feqi, feqo, vomega, vodd, i, pxx, pxy, pyy
+                    )
+
+    @Kernel
+    def bounce_back(fout, fin, obstacle, nx, ny):
+        for row in prange(nx):
+            for col in range(ny):
+                if obstacle[row, col]:
+                    for i in range(9):
+                        fout[i, row, col] = fin[8 - i, row, col]
+
+    @Kernel
+    def bounce_back_cells(fout, fin, cells, n):
+        """`bounce_back` of the n obstacle cells listed in `cells` (2, n) (rows and
+        columns, see `np_obstacle_cells`): a 1D launch over the obstacle only."""
+        for c in prange(n):
+            row = cells[0, c]
+            col = cells[1, c]
+            for i in range(9):
+                fout[i, row, col] = fin[8 - i, row, col]
+
+    @Kernel
+    def streaming_step(fin, fout, nx, ny):
+        for row in prange(nx):
+            for col in range(ny):
+                for k in range(9):
+                    i = row + cx(k)
+                    j = col + cy(k)
+                    if i == nx:
+                        i = 0
+                    elif i == -1:
+                        i = nx - 1
+                    if j == ny:
+                        j = 0
+                    elif j == -1:
+                        j = ny - 1
+                    fin[k, i, j] = fout[k, row, col]
+
+    @Kernel
+    def streaming_tiled(fin, fout, rows, cols, nx, ny):
+        """`streaming_step` as a gather with the periodic indices of the halo `rows`
+        (nx + 2) and `cols` (ny + 2) (see `np_halo_indices`): no shared memory on
+        CPU, each row is written contiguously without testing the edges.
+        """
+        for index in prange(nx):
+            row = int64(index)
+            for k in range(9):
+                i = rows[row + 1 - cx(k)]
+                for col in range(ny):
+                    fin[k, row, col] = fout[k, i, cols[col + 1 - cy(k)]]
+
+    @njit
+    def feq_k(rho, vx, vy, usqr, k):
+        cu = real(3) * (real(cx(k)) * vx + real(cy(k)) * vy)
+        return rho * weight(k) * (real(1) + cu + real(0.5) * cu * cu - usqr)
+
+    @njit
+    def fin_k(fin, rho, vx, vy, usqr, k, row, col, nx):
+        # Population k once `outflow` and `update_fin` are applied to the cell
+        value = fin[k, row, col]
+        if row == nx - 1 and k >= 6:
+            value = fin[k, nx - 2, col]
+        elif row == 0 and k < 3:
+            value = feq_k(rho, vx, vy, usqr, k) + fin[8 - k, 0, col]
+            value -= feq_k(rho, vx, vy, usqr, 8 - k)
+        return value
+
+    @Kernel
+    def collide_and_stream(fin, fout, vel, obstacle, omega, rho, u, nx, ny):
+        """`outflow`, `macroscopic`, `inflow`, `equilibrium`, `update_fin`,
+        `collision`, `bounce_back` and `streaming_step` in one pass per cell:
+        `fin` is only read and the next populations are written in `fout`.
+        As in `tile_step`, the loops over the columns of a row have no branch per
+        cell: the populations of the row once `outflow` and `update_fin` are
+        applied are copied in `f` (9, ny), relaxed in `g` (9, ny), and only the
+        edge columns are wrapped when `g` is streamed.
+        """
+        for index in prange(nx):
+            row = int64(index)
+            f = np.empty((9, ny), dtype=fin.dtype)
+            g = np.empty((9, ny), dtype=fin.dtype)
+            moments = np.empty((7, ny), dtype=fin.dtype)
+            for i in range(9):
+                source = fin[i, row - 1] if row == nx - 1 and i >= 6 else fin[i, row]
+                for col in range(ny):
+                    f[i, col] = source[col]
+
+            for col in range(ny):
+                trho = acc(0.0)
+                tu0 = acc(0.0)
+                tu1 = acc(0.0)
+                for i in range(9):
+                    fvalue = acc(f[i, col])
+                    trho += fvalue
+                    tu0 += acc(cx(i)) * fvalue
+                    tu1 += acc(cy(i)) * fvalue
+                moments[0, col] = real(trho)
+                moments[1, col] = real(tu0 / trho)
+                moments[2, col] = real(tu1 / trho)
+            if row == 0:
+                for col in range(ny):
+                    vx = vel[0, 0, col]
+                    t2 = acc(f[3, col]) + f[4, col] + f[5, col]
+                    t3 = acc(f[6, col]) + f[7, col] + f[8, col]
+                    moments[0, col] = real((t2 + acc(2) * t3) / (acc(1) - vx))
+                    moments[1, col] = vx
+                    moments[2, col] = vel[1, 0, col]
+            for col in range(ny):
+                vx = moments[1, col]
+                vy = moments[2, col]
+                moments[3, col] = real(1.5) * (vx * vx + vy * vy)
+                rho[row, col] = moments[0, col]
+                u[0, row, col] = vx
+                u[1, row, col] = vy
+            if row == 0:
+                for i in range(3):
+                    for col in range(ny):
+                        vrho = moments[0, col]
+                        vx = moments[1, col]
+                        vy = moments[2, col]
+                        usqr = moments[3, col]
+                        value = feq_k(vrho, vx, vy, usqr, i) + f[8 - i, col]
+                        value -= feq_k(vrho, vx, vy, usqr, 8 - i)
+                        f[i, col] = value
+            if stress:
+                for col in range(ny):
+                    vrho = moments[0, col]
+                    vx = moments[1, col]
+                    vy = moments[2, col]
+                    usqr = moments[3, col]
+                    pxx = real(0)
+                    pxy = real(0)
+                    pyy = real(0)
+                    for i in range(9):
+                        fneq = f[i, col] - feq_k(vrho, vx, vy, usqr, i)
+                        pxx += real(cx(i) * cx(i)) * fneq
+                        pxy += real(cx(i) * cy(i)) * fneq
+                        pyy += real(cy(i) * cy(i)) * fneq
+                    moments[4, col] = pxx
+                    moments[5, col] = pxy
+                    moments[6, col] = pyy
+
+            solid = obstacle[row]
+            for k in range(9):
+                for col in range(ny):
+                    vrho = moments[0, col]
+                    vx = moments[1, col]
+                    vy = moments[2, col]
+                    usqr = moments[3, col]
+                    pxx = real(0)
+                    pxy = real(0)
+                    pyy = real(0)
+                    if stress:
+                        pxx = moments[4, col]
+                        pxy = moments[5, col]
+                        pyy = moments[6, col]
+                    vomega = omega_at(omega, row, col)
+                    vodd = rate(vomega)
+                    fvalue = f[k, col]
+                    feqk = feq_k(vrho, vx, vy, usqr, k)
+                    fopp, feqo = fvalue, feqk
+                    if pairs:
+                        fopp = f[8 - k, col]
+                        feqo = feq_k(vrho, vx, vy, usqr, 8 - k)
+                    value = relax(fvalue, fopp, feqk, feqo, vomega, vodd, k, pxx, pxy, pyy)
+                    if solid[col]:
+                        value = f[8 - k, col]
+                    g[k, col] = value
+
+            for k in range(9):
+                target = fout[k, (row + cx(k)) % nx]
+                shift = cy(k)
+                for col in range(1, ny - 1):
+                    target[col + shift] = g[k, col]
+                target[shift % ny] = g[k, 0]
+                target[(ny - 1 + shift) % ny] = g[k, ny - 1]
+
+    @Kernel
+    def ensemble_step(fin, fout, vel, obstacle, omega, rho, u, nx, ny):
+        """`collide_and_stream` on a batch of independent lattices of the same size:
+        every array has a leading axis of members, `vel` is the inflow profile
+        (members, 2, ny) and `omega` has one value per member. The rows of all the
+        members are split over the CPU threads.
+        """
+        for index in prange(fin.shape[0] * nx):
+            m, row = divmod(int64(index), int64(nx))
+            f = fin[m]
+            vomega = omega[m]
+            vodd = rate(vomega)
+            for col in range(ny):
+                trho = acc(0.0)
+                tu0 = acc(0.0)
+                tu1 = acc(0.0)
+                for i in range(9):
+                    fvalue = acc(f[i, row, col])
+                    if row == nx - 1 and i >= 6:
+                        fvalue = acc(f[i, nx - 2, col])
+                    trho += fvalue
+                    tu0 += acc(cx(i)) * fvalue
+                    tu1 += acc(cy(i)) * fvalue
+
+                vx = real(tu0 / trho)
+                vy = real(tu1 / trho)
+                vrho = real(trho)
+                if row == 0:
+                    vx = vel[m, 0, col]
+                    vy = vel[m, 1, col]
+                    t2 = acc(f[3, 0, col]) + f[4, 0, col] + f[5, 0, col]
+                    t3 = acc(f[6, 0, col]) + f[7, 0, col] + f[8, 0, col]
+                    vrho = real((t2 + acc(2) * t3) / (acc(1) - vx))
+                rho[m, row, col] = vrho
+                u[m, 0, row, col] = vx
+                u[m, 1, row, col] = vy
+
+                usqr = real(1.5) * (vx * vx + vy * vy)
+                pxx = real(0)
+                pxy = real(0)
+                pyy = real(0)
+                if stress:
+                    for i in range(9):
+                        fneq = fin_k(f, vrho, vx, vy, usqr, i, row, col, nx)
+                        fneq -= feq_k(vrho, vx, vy, usqr, i)
+                        pxx += real(cx(i) * cx(i)) * fneq
+                        pxy += real(cx(i) * cy(i)) * fneq
+                        pyy += real(cy(i) * cy(i)) * fneq
+                for k in range(9):
+                    if obstacle[m, row, col]:
+                        value = fin_k(f, vrho, vx, vy, usqr, 8 - k, row, col, nx)
+                    else:
+                        fvalue = fin_k(f, vrho, vx, vy, usqr, k, row, col, nx)
+                        feqk = feq_k(vrho, vx, vy, usqr, k)
+                        fopp, feqo = fvalue, feqk
+                        if pairs:
+                            fopp = fin_k(f, vrho, vx, vy, usqr, 8 - k, row, col, nx)
+                            feqo = feq_k(vrho, vx, vy, usqr, 8 - k)
+                        value = relax(fvalue, fopp, feqk, feqo, vomega, vodd, k, pxx, pxy, pyy)
+                    i = row + cx(k)
+                    j = col + cy(k)
+                    if i == nx:
+                        i = 0
+                    elif i == -1:
+                        i = nx - 1
+                    if j == ny:
+                        j = 0
+                    elif j == -1:
+                        j = ny - 1
+                    fout[m, k, i, j] = value
+
+    @njit
+    def slab_fin_k(fin, rho, vx, vy, usqr, k, row, col, cell, nx):
+        # `fin_k` of the row `row` of a slab, row `cell` of the lattice
+        value = fin[k, row, col]
+        if cell == nx - 1 and k >= 6:
+            value = fin[k, row - 1, col]
+        elif cell == 0 and k < 3:
+            value = feq_k(rho, vx, vy, usqr, k) + fin[8 - k, row, col]
+            value -= feq_k(rho, vx, vy, usqr, 8 - k)
+        return value
+
+    @Kernel
+    def slab_step(fin, fout, vel, obstacle, omega, rho, u, first, last, offset, nx, ny):
+        """`collide_and_stream` of the rows `first` to `last - 1` of a slab of the
+        lattice (see `utils.decomposition`): row r of the arrays (9, m + 2, ny) is
+        the row `offset + r - 1` of the lattice, rows 0 and m + 1 are halos. The
+        populations leaving the slab are written in the halos of `fout`.
+        """
+        for index in prange(first, last):
+            row = int64(index)
+            for col in range(ny):
+                cell = offset + row - 1  # Row of the lattice
+                trho = acc(0.0)
+                tu0 = acc(0.0)
+                tu1 = acc(0.0)
+                for i in range(9):
+                    fvalue = acc(fin[i, row, col])
+                    if cell == nx - 1 and i >= 6:
+                        fvalue = acc(fin[i, row - 1, col])
+                    trho += fvalue
+                    tu0 += acc(cx(i)) * fvalue
+                    tu1 += acc(cy(i)) * fvalue
+
+                vx = real(tu0 / trho)
+                vy = real(tu1 / trho)
+                vrho = real(trho)
+                if cell == 0:
+                    vx = vel[0, row, col]
+                    vy = vel[1, row, col]
+                    t2 = acc(fin[3, row, col]) + fin[4, row, col] + fin[5, row, col]
+                    t3 = acc(fin[6, row, col]) + fin[7, row, col] + fin[8, row, col]
+                    vrho = real((t2 + acc(2) * t3) / (acc(1) - vx))
+                rho[row, col] = vrho
+                u[0, row, col] = vx
+                u[1, row, col] = vy
+
+                usqr = real(1.5) * (vx * vx + vy * vy)
+                vomega = omega_at(omega, row, col)
+                vodd = rate(vomega)
+                pxx = real(0)
+                pxy = real(0)
+                pyy = real(0)
+                if stress:
+                    for i in range(9):
+                        fneq = slab_fin_k(fin, vrho, vx, vy, usqr, i, row, col, cell, nx)
+                        fneq -= feq_k(vrho, vx, vy, usqr, i)
+                        pxx += real(cx(i) * cx(i)) * fneq
+                        pxy += real(cx(i) * cy(i)) * fneq
+                        pyy += real(cy(i) * cy(i)) * fneq
+                for k in range(9):
+                    if obstacle[row, col]:
+                        value = slab_fin_k(fin, vrho, vx, vy, usqr, 8 - k, row, col, cell, nx)
+                    else:
+                        fvalue = slab_fin_k(fin, vrho, vx, vy, usqr, k, row, col, cell, nx)
+                        feqk = feq_k(vrho, vx, vy, usqr, k)
+                        fopp, feqo = fvalue, feqk
+                        if pairs:
+                            fopp = slab_fin_k(fin, vrho, vx, vy, usqr, 8 - k, row, col, cell, nx)
+                            feqo = feq_k(vrho, vx, vy, usqr, 8 - k)
+                        value = relax(fvalue, fopp, feqk, feqo, vomega, vodd, k, pxx, pxy, pyy)
+                    j = col + cy(k)
+                    if j == ny:
+                        j = 0
+                    elif j == -1:
+                        j = ny - 1
+                    fout[k, row + cx(k), j] = value
+
+    @Kernel
+    def pack_halos(fout, send, m, ny):
+        """Populations leaving a slab (see `slab_step`), 6 to 8 in the halo row 0 and
+        0 to 2 in the halo row m + 1 of `fout`, gathered in `send` (2, 3, ny) to be
+        copied in one transfer."""
+        for col in prange(ny):
+            for k in range(3):
+                send[0, k, col] = fout[6 + k, 0, col]
+                send[1, k, col] = fout[k, m + 1, col]
+
+    @Kernel
+    def unpack_halos(fout, recv, m, ny):
+        """Populations entering a slab: 0 to 2 from the previous slab (`recv[0]`) in
+        the row 1 of `fout`, 6 to 8 from the next one (`recv[1]`) in the row m."""
+        for col in prange(ny):
+            for k in range(3):
+                fout[k, 1, col] = recv[0, k, col]
+                fout[6 + k, m, col] = recv[1, k, col]
+
+    @njit(error_model="numpy")
+    def tile_step(fin, fout, solid, vel, omega, rho, u, f, moments, rows, cols, s, last, nx):
+        """One step of `collide_and_stream` on a tile (9, m, p) copied out of the
+        lattice, row i and column j of the tile being the cell `rows[i]`, `cols[j]`
+        (`solid` is the obstacle of the tile): the cells at least s + 1 cells away
+        from the edges of the tile are collided and pushed to their neighbours in
+        `fout`, without periodic wrap. With `last`, the density and velocity of the
+        cells out of the halo of depth s + 2 are written in `rho` and `u` (nx, ny).
+        The loops over the columns of a row have no branch per cell, so that they
+        are vectorized: the populations of the row once `outflow` and `update_fin`
+        are applied are copied in `f` (9, p) and the moments of its cells kept in
+        `moments` (7, p), then the populations are relaxed one direction at a time.
+        The loops run over the n columns from s + 1 on, indexed from 0 in views of
+        the tile: numba then knows the indices are not negative and does not test
+        them, which would keep the loops from being vectorized (as the tests of the
+        divisions by zero, dropped with `error_model="numpy"`).
+        """
+        m, p = fin.shape[1], fin.shape[2]
+        first = s + 1
+        n = p - 2 * first
+        columns = cols[first : first + n]
+        for row in range(first, m - first):
+            cell = rows[row]
+            for i in range(9):
+                source = fin[i, row - 1 if cell == nx - 1 and i >= 6 else row, first:]
+                for j in range(n):
+                    f[i, j] = source[j]
+
+            for j in range(n):
+                trho = acc(0.0)
+                tu0 = acc(0.0)
+                tu1 = acc(0.0)
+                for i in range(9):
+                    fvalue = acc(f[i, j])
+                    trho += fvalue
+                    tu0 += acc(cx(i)) * fvalue
+                    tu1 += acc(cy(i)) * fvalue
+                moments[0, j] = real(trho)
+                moments[1, j] = real(tu0 / trho)
+                moments[2, j] = real(tu1 / trho)
+            if cell == 0:
+                for j in range(n):
+                    vx = vel[0, 0, columns[j]]
+                    t2 = acc(f[3, j]) + f[4, j] + f[5, j]
+                    t3 = acc(f[6, j]) + f[7, j] + f[8, j]
+                    moments[0, j] = real((t2 + acc(2) * t3) / (acc(1) - vx))
+                    moments[1, j] = vx
+                    moments[2, j] = vel[1, 0, columns[j]]
+            for j in range(n):
+                vx = moments[1, j]
+                vy = moments[2, j]
+                moments[3, j] = real(1.5) * (vx * vx + vy * vy)
+            if cell == 0:
+                for i in range(3):
+                    for j in range(n):
+                        vrho = moments[0, j]
+                        vx = moments[1, j]
+                        vy = moments[2, j]
+                        usqr = moments[3, j]
+                        value = feq_k(vrho, vx, vy, usqr, i) + f[8 - i, j]
+                        value -= feq_k(vrho, vx, vy, usqr, 8 - i)
+                        f[i, j] = value
+            if last and first < row < m - first - 1:
+                for j in range(1, n - 1):
+                    rho[cell, columns[j]] = moments[0, j]
+                    u[0, cell, columns[j]] = moments[1, j]
+                    u[1, cell, columns[j]] = moments[2, j]
+            if stress:
+                for j in range(n):
+                    vrho = moments[0, j]
+                    vx = moments[1, j]
+                    vy = moments[2, j]
+                    usqr = moments[3, j]
+                    pxx = real(0)
+                    pxy = real(0)
+                    pyy = real(0)
+                    for i in range(9):
+                        fneq = f[i, j] - feq_k(vrho, vx, vy, usqr, i)
+                        pxx += real(cx(i) * cx(i)) * fneq
+                        pxy += real(cx(i) * cy(i)) * fneq
+                        pyy += real(cy(i) * cy(i)) * fneq
+                    moments[4, j] = pxx
+                    moments[5, j] = pxy
+                    moments[6, j] = pyy
+
+            mask = solid[row, first:]
+            for k in range(9):
+                target = fout[k, row + cx(k), first + cy(k) :]
+                for j in range(n):
+                    vrho = moments[0, j]
+                    vx = moments[1, j]
+                    vy = moments[2, j]
+                    usqr = moments[3, j]
+                    pxx = real(0)
+                    pxy = real(0)
+                    pyy = real(0)
+                    if stress:
+                        pxx = moments[4, j]
+                        pxy = moments[5, j]
+                        pyy = moments[6, j]
+                    vomega = omega_at(omega, cell, columns[j])
+                    vodd = rate(vomega)
+                    fvalue = f[k, j]
+                    feqk = feq_k(vrho, vx, vy, usqr, k)
+                    fopp, feqo = fvalue, feqk
+                    if pairs:
+                        fopp = f[8 - k, j]
+                        feqo = feq_k(vrho, vx, vy, usqr, 8 - k)
+                    value = relax(fvalue, fopp, feqk, feqo, vomega, vodd, k, pxx, pxy, pyy)
+                    if mask[j]:
+                        value = f[8 - k, j]
+                    target[j] = value
+
+    @Kernel
+    def blocked_step(fin, fout, vel, obstacle, omega, rho, u, height, width, depth, nx, ny):
+        """`depth` steps of `collide_and_stream` done tile by tile (temporal
+        blocking): each tile of `height` x `width` cells is copied with a halo of
+        `depth + 1` cells, advanced `depth` steps while it is in cache (the valid
+        cells shrink by one cell per step, see `tile_step`) and its own cells are
+        written in `fout`. The halos are recomputed by the neighbouring tiles, so
+        `fin` is read and `fout` written once for the `depth` steps.
+        """
+        halo = depth + 1
+        tx = (nx + height - 1) // height
+        ty = (ny + width - 1) // width
+        for index in prange(tx * ty):
+            first, second = divmod(int64(index), int64(ty))
+            top = first * height
+            left = second * width
+            m = min(height, nx - top) + 2 * halo
+            p = min(width, ny - left) + 2 * halo
+            rows = np.empty(m, dtype=np.int64)
+            cols = np.empty(p, dtype=np.int64)
+            for i in range(m):
+                rows[i] = (top - halo + i) % nx
+            for j in range(p):
+                cols[j] = (left - halo + j) % ny
+            a = np.empty((9, m, p), dtype=fin.dtype)
+            b = np.empty((9, m, p), dtype=fin.dtype)
+            solid = np.empty((m, p), dtype=np.bool_)
+            f = np.empty((9, p), dtype=fin.dtype)
+            moments = np.empty((7, p), dtype=fin.dtype)
+            for i in range(m):
+                for j in range(p):
+                    solid[i, j] = obstacle[rows[i], cols[j]]
+            for k in range(9):
+                for i in range(m):
+                    source = fin[k, rows[i]]
+                    j = 0
+                    while j < p:
+                        # Consecutive columns up to the periodic wrap
+                        start = cols[j]
+                        run = min(p - j, ny - start)
+                        a[k, i, j : j + run] = source[start : start + run]
+                        j += run
+            for s in range(depth):
+                last = s == depth - 1
+                tile_step(a, b, solid, vel, omega, rho, u, f, moments, rows, cols, s, last, nx)
+                a, b = b, a
+            for k in range(9):
+                for i in range(halo, m - halo):
+                    fout[k, top + i - halo, left : left + p - 2 * halo] = a[k, i, halo : p - halo]
+
+    @njit
+    def sparse_fin_k(fin, rho, vx, vy, usqr, k, c, west, row, nx):
+        # `fin_k` of the cell c of a compacted list
+        value = fin[k, c]
+        if row == nx - 1 and k >= 6:
+            value = fin[k, west]
+        elif row == 0 and k < 3:
+            value = feq_k(rho, vx, vy, usqr, k) + fin[8 - k, c]
+            value -= feq_k(rho, vx, vy, usqr, 8 - k)
+        return value
+
+    @Kernel
+    def sparse_step(fin, fout, cells, neighbours, solid, vel, omega, rho, u, n, nx):
+        """`collide_and_stream` on the compacted list of cells of `utils.sparse`:
+        `fin[k, c]` is population k of cell c, at row `cells[0, c]`, and its
+        population k streams to cell `neighbours[k, c]` (the last cell is a sink
+        for the links towards the skipped solid cells). `vel`, `omega` and `solid`
+        are given per cell.
+        """
+        for c in prange(n):
+            row = cells[0, c]
+            west = neighbours[7, c]  # Cell (row - 1, col), read by the outflow
+            trho = acc(0.0)
+            tu0 = acc(0.0)
+            tu1 = acc(0.0)
+            for i in range(9):
+                fvalue = acc(fin[i, c])
+                if row == nx - 1 and i >= 6:
+                    fvalue = acc(fin[i, west])
+                trho += fvalue
+                tu0 += acc(cx(i)) * fvalue
+                tu1 += acc(cy(i)) * fvalue
+
+            vx = real(tu0 / trho)
+            vy = real(tu1 / trho)
+            vrho = real(trho)
+            if row == 0:
+                vx = vel[0, c]
+                vy = vel[1, c]
+                t2 = acc(fin[3, c]) + fin[4, c] + fin[5, c]
+                t3 = acc(fin[6, c]) + fin[7, c] + fin[8, c]
+                vrho = real((t2 + acc(2) * t3) / (acc(1) - vx))
+            rho[c] = vrho
+            u[0, c] = vx
+            u[1, c] = vy
+
+            usqr = real(1.5) * (vx * vx + vy * vy)
+            vomega = omega[c]
+            vodd = rate(vomega)
+            pxx = real(0)
+            pxy = real(0)
+            pyy = real(0)
+            if stress:
+                for i in range(9):
+                    fneq = sparse_fin_k(fin, vrho, vx, vy, usqr, i, c, west, row, nx)
+                    fneq -= feq_k(vrho, vx, vy, usqr, i)
+                    pxx += real(cx(i) * cx(i)) * fneq
+                    pxy += real(cx(i) * cy(i)) * fneq
+                    pyy += real(cy(i) * cy(i)) * fneq
+            for k in range(9):
+                if solid[c]:
+                    value = sparse_fin_k(fin, vrho, vx, vy, usqr, 8 - k, c, west, row, nx)
+                else:
+                    fvalue = sparse_fin_k(fin, vrho, vx, vy, usqr, k, c, west, row, nx)
+                    feqk = feq_k(vrho, vx, vy, usqr, k)
+                    fopp, feqo = fvalue, feqk
+                    if pairs:
+                        fopp = sparse_fin_k(fin, vrho, vx, vy, usqr, 8 - k, c, west, row, nx)
+                        feqo = feq_k(vrho, vx, vy, usqr, 8 - k)
+                    value = relax(fvalue, fopp, feqk, feqo, vomega, vodd, k, pxx, pxy, pyy)
+                fout[k, neighbours[k, c]] = value
+
+    @njit
+    def aa_shift(x, c, parity, n):
+        # On odd steps, population with velocity c of cell x is stored in cell x - c
+        # (prange indices are unsigned, x is cast to keep an integer index)
+        y = int64(x)
+        if parity == 1:
+            y -= c
+            if y == n:
+                y = 0
+            elif y == -1:
+                y = n - 1
+        return y
+
+    @njit
+    def aa_slot(k, parity):
+        return k + parity * (8 - 2 * k)
+
+    @Kernel
+    def aa_outflow(f, parity, nx, ny):
+        """`outflow` on the single population array of the in-place (AA) pattern."""
+        for col in prange(ny):
+            for k in range(6, 9):
+                i = aa_slot(k, parity)
+                y = aa_shift(col, cy(k), parity, ny)
+                x1 = aa_shift(nx - 1, cx(k), parity, nx)
+                x2 = aa_shift(nx - 2, cx(k), parity, nx)
+                f[i, x1, y] = f[i, x2, y]
+
+    @Kernel
+    def aa_step(f, parity, vel, obstacle, omega, rho, u, nx, ny):
+        """Same step as `collide_and_stream` but in place on a single population
+        array with the AA access pattern: on even steps (parity 0), a cell reads its
+        populations and writes them back reversed in its own location; on odd steps
+        (parity 1), it reads the reversed populations from its neighbours and writes
+        them streamed in their natural location. `aa_outflow` is applied before.
+        """
+        for row in prange(nx):
+            for col in range(ny):
+                trho = acc(0.0)
+                tu0 = acc(0.0)
+                tu1 = acc(0.0)
+                for i in range(9):
+                    x = aa_shift(row, cx(i), parity, nx)
+                    y = aa_shift(col, cy(i), parity, ny)
+                    fvalue = acc(f[aa_slot(i, parity), x, y])
+                    trho += fvalue
+                    tu0 += acc(cx(i)) * fvalue
+                    tu1 += acc(cy(i)) * fvalue
+
+                vx = real(tu0 / trho)
+                vy = real(tu1 / trho)
+                vrho = real(trho)
+                if row == 0:
+                    vx = vel[0, 0, col]
+                    vy = vel[1, 0, col]
+                    t2 = acc(0.0)
+                    t3 = acc(0.0)
+                    for i in range(3):
+                        y = aa_shift(col, cy(3 + i), parity, ny)
+                        t2 += f[aa_slot(3 + i, parity), 0, y]
+                        x = aa_shift(0, cx(6 + i), parity, nx)
+                        y = aa_shift(col, cy(6 + i), parity, ny)
+                        t3 += f[aa_slot(6 + i, parity), x, y]
+                    vrho = real((t2 + acc(2) * t3) / (acc(1) - vx))
+                rho[row, col] = vrho
+                u[0, row, col] = vx
+                u[1, row, col] = vy
+
+                usqr = real(1.5) * (vx * vx + vy * vy)
+                vomega = omega_at(omega, row, col)
+                vodd = rate(vomega)
+                pxx = real(0)
+                pxy = real(0)
+                pyy = real(0)
+                if stress:
+                    for i in range(9):
+                        j = i
+                        if row == 0 and i < 3:
+                            j = 8 - i  # Inflow: same flux as the opposite populations
+                        x = aa_shift(row, cx(j), parity, nx)
+                        y = aa_shift(col, cy(j), parity, ny)
+                        fneq = f[aa_slot(j, parity), x, y] - feq_k(vrho, vx, vy, usqr, j)
+                        pxx += real(cx(i) * cx(i)) * fneq
+                        pxy += real(cx(i) * cy(i)) * fneq
+                        pyy += real(cy(i) * cy(i)) * fneq
+                # Populations k and 8 - k swap their locations: they are read and written together
+                for k in range(5):
+                    i1 = aa_slot(k, parity)
+                    x1 = aa_shift(row, cx(k), parity, nx)
+                    y1 = aa_shift(col, cy(k), parity, ny)
+                    i2 = aa_slot(8 - k, parity)
+                    x2 = aa_shift(row, cx(8 - k), parity, nx)
+                    y2 = aa_shift(col, cy(8 - k), parity, ny)
+                    a = f[i1, x1, y1]
+                    b = f[i2, x2, y2]
+                    feqa = feq_k(vrho, vx, vy, usqr, k)
+                    feqb = feq_k(vrho, vx, vy, usqr, 8 - k)
+                    if row == 0 and k < 3:
+                        a = feqa + b - feqb
+                    if obstacle[row, col]:
+                        f[i2, x2, y2] = b
+                        f[i1, x1, y1] = a
+                    else:
+                        f[i2, x2, y2] = relax(a, b, feqa, feqb, vomega, vodd, k, pxx, pxy, pyy)
+                        f[i1, x1, y1] = relax(b, a, feqb, feqa, vomega, vodd, 8 - k, pxx, pxy, pyy)
+
+    @Kernel
+    def momentum_exchange(f, parity, obstacle, cells, n, force, nx, ny):
+        """Add to `force` (2,) the force of the fluid on the obstacle in the last step
+        (see `np_momentum_exchange`), summed over the n cells of the obstacle next to
+        the fluid listed in `cells` (see `np_boundary_cells`). `parity` is the one of
+        the next step of the in-place scheme, 0 for the other schemes."""
+        fx = 0.0
+        fy = 0.0
+        for c in prange(n):
+            row = cells[0, c]
+            col = cells[1, c]
+            for k in range(9):
+                # Population k streamed from the cell (row - cx(k), col - cy(k))
+                if not obstacle[aa_shift(row, cx(k), 1, nx), aa_shift(col, cy(k), 1, ny)]:
+                    x = aa_shift(row, cx(k), parity, nx)
+                    y = aa_shift(col, cy(k), parity, ny)
+                    value = np.float64(f[aa_slot(k, parity), x, y])
+                    fx += cx(k) * value
+                    fy += cy(k) * value
+        force[0] += 2 * fx
+        force[1] += 2 * fy
+
+    @Kernel
+    def sample_probes(rho, u, cells, weights, m, ring, count):
+        """Density and velocity of the m probes (see `np_sample_probes`, `cells` and
+        `weights` of `np_probe_tables`) in the slot `count[0]` (modulo the number
+        of slots) of `ring` (slots, 3, m), then `count[0]` is incremented."""
+        slot = count[0] % ring.shape[0]
+        for p in prange(m):
+            r = 0.0
+            vx = 0.0
+            vy = 0.0
+            for c in range(4):
+                row = cells[0, c, p]
+                col = cells[1, c, p]
+                r += weights[c, p] * rho[row, col]
+                vx += weights[c, p] * u[0, row, col]
+                vy += weights[c, p] * u[1, row, col]
+            ring[slot, 0, p] = r
+            ring[slot, 1, p] = vx
+            ring[slot, 2, p] = vy
+        count[0] += 1
+
+    @Kernel
+    def speed(u, s, nx, ny):
+        for row in prange(nx):
+            for col in range(ny):
+                vx = u[0, row, col]
+                vy = u[1, row, col]
+                s[col, row] = np.sqrt(vx * vx + vy * vy)
+
+    @Kernel
+    def to_frame(s, vmax, frame, nx, ny):
+        for row in prange(nx):
+            for col in range(ny):
+                frame[col, row] = numba.uint8(s[col, row] / vmax[0] * real(255))
+
+    # Time loops of `utils.simulation.Simulation.advance`: n steps of a scheme in a
+    # single call from Python, the compiled kernels being called from compiled code
+    njit_fused, njit_aa_outflow, njit_aa_step = (
+        kernel.function for kernel in (collide_and_stream, aa_outflow, aa_step)
+    )
+    njit_outflow, njit_macroscopic, njit_inflow, njit_equilibrium = (
+        kernel.function for kernel in (outflow, macroscopic, inflow, equilibrium)
+    )
+    njit_update_fin, njit_collision, njit_bounce_back_cells = (
+        kernel.function for kernel in (update_fin, collision, bounce_back_cells)
+    )
+    njit_streaming_step, njit_streaming_tiled, njit_blocked = (
+        kernel.function for kernel in (streaming_step, streaming_tiled, blocked_step)
+    )
+    njit_momentum_exchange, njit_sample_probes = (
+        kernel.function for kernel in (momentum_exchange, sample_probes)
+    )
+
+    @njit
+    def monitor(f, parity, obstacle, rho, u, boundary, force, probes, nx, ny):
+        # Force on the obstacle (`momentum_exchange` of the cells `boundary`) and
+        # samples of the probes (`sample_probes` of the tables `probes`) after a step
+        # of the time loops, none if their tables are empty
+        if boundary.shape[1]:
+            njit_momentum_exchange(f, parity, obstacle, boundary, boundary.shape[1], force, nx, ny)
+        cells, weights, ring, count = probes
+        if cells.shape[2]:
+            njit_sample_probes(rho, u, cells, weights, cells.shape[2], ring, count)
+
+    @njit(cache=True)
+    def fused_steps(fin, fout, vel, obstacle, omega, rho, u, boundary, force, probes, nx, ny, n):
+        """`n` steps of `collide_and_stream`: the populations end in `fin` if `n` is
+        even, in `fout` otherwise. After each step, the force on the obstacle is
+        added to `force` and the probes are sampled (see `monitor`)."""
+        for _ in range(n):
+            njit_fused(fin, fout, vel, obstacle, omega, rho, u, nx, ny)
+            fin, fout = fout, fin
+            monitor(fin, 0, obstacle, rho, u, boundary, force, probes, nx, ny)
+
+    @njit(cache=True)
+    def inplace_steps(f, time, vel, obstacle, omega, rho, u, boundary, force, probes, nx, ny, n):
+        """Steps `time` to `time + n - 1` of `aa_outflow` and `aa_step` (and
+        `monitor` as in `fused_steps`)."""
+        for i in range(n):
+            parity = (time + i) % 2
+            njit_aa_outflow(f, parity, nx, ny)
+            njit_aa_step(f, parity, vel, obstacle, omega, rho, u, nx, ny)
+            monitor(f, 1 - parity, obstacle, rho, u, boundary, force, probes, nx, ny)
+
+    @njit(cache=True)
+    def stages_steps(
+        fin,
+        fout,
+        feq,
+        vel,
+        omega,
+        rho,
+        u,
+        cells,
+        rows,
+        cols,
+        tiled,
+        obstacle,
+        boundary,
+        force,
+        probes,
+        nx,
+        ny,
+        n,
+    ):
+        """`n` steps of the kernels per stage (`bounce_back_cells`, and
+        `streaming_tiled` if `tiled`, and `monitor` as in `fused_steps`)."""
+        for _ in range(n):
+            njit_outflow(fin, nx, ny)
+            njit_macroscopic(fin, rho, u, nx, ny)
+            njit_inflow(u, vel, rho, fin, ny)
+            njit_equilibrium(rho, u, feq, nx, ny)
+            njit_update_fin(fin, feq, ny)
+            njit_collision(omega, fin, feq, fout, nx, ny)
+            njit_bounce_back_cells(fout, fin, cells, cells.shape[1])
+            if tiled:
+                njit_streaming_tiled(fin, fout, rows, cols, nx, ny)
+            else:
+                njit_streaming_step(fin, fout, nx, ny)
+            monitor(fin, 0, obstacle, rho, u, boundary, force, probes, nx, ny)
+
+    @njit(cache=True)
+    def blocked_steps(fin, fout, vel, obstacle, omega, rho, u, nx, ny, n, height, width, depth):
+        """`n` steps of `blocked_step`, `depth` steps per pass over the lattice (the
+        last pass does the remaining steps): the populations end in `fin` if the
+        number of passes `ceil(n / depth)` is even, in `fout` otherwise."""
+        while n > 0:
+            steps = min(n, depth)
+            njit_blocked(fin, fout, vel, obstacle, omega, rho, u, height, width, steps, nx, ny)
+            fin, fout = fout, fin
+            n -= steps
+
+    return SimpleNamespace(
+        equilibrium=equilibrium,
+        macroscopic=macroscopic,
+        outflow=outflow,
+        inflow=inflow,
+        update_fin=update_fin,
+        collision=collision,
+        bounce_back=bounce_back,
+        bounce_back_cells=bounce_back_cells,
+        streaming_step=streaming_step,
+        streaming_tiled=streaming_tiled,
+        collide_and_stream=collide_and_stream,
+        ensemble_step=ensemble_step,
+        slab_step=slab_step,
+        pack_halos=pack_halos,
+        unpack_halos=unpack_halos,
+        blocked_step=blocked_step,
+        tile_step=tile_step,
+        sparse_step=sparse_step,
+        aa_outflow=aa_outflow,
+        aa_step=aa_step,
+        momentum_exchange=momentum_exchange,
+        sample_probes=sample_probes,
+        speed=speed,
+        to_frame=to_frame,
+        fused_steps=fused_steps,
+        inplace_steps=inplace_steps,
+        stages_steps=stages_steps,
+        blocked_steps=blocked_steps,
+    )
+
+
+kernels = specialize(precision, layout, operator=operator)
+equilibrium = kernels.equilibrium
+macroscopic = kernels.macroscopic
+outflow = kernels.outflow
+inflow = kernels.inflow
+update_fin = kernels.update_fin
+collision = kernels.collision
+bounce_back = kernels.bounce_back
+bounce_back_cells = kernels.bounce_back_cells
+streaming_step = kernels.streaming_step
+streaming_tiled = kernels.streaming_tiled
+collide_and_stream = kernels.collide_and_stream
+ensemble_step = kernels.ensemble_step
+slab_step = kernels.slab_step
+pack_halos = kernels.pack_halos
+unpack_halos = kernels.unpack_halos
+blocked_step = kernels.blocked_step
+sparse_step = kernels.sparse_step
+aa_outflow = kernels.aa_outflow
+aa_step = kernels.aa_step
+momentum_exchange = kernels.momentum_exchange
+sample_probes = kernels.sample_probes
+speed = kernels.speed
+to_frame = kernels.to_frame
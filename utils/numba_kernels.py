@@ -1,7 +1,20 @@
-from numba import cuda, float64
-from math import log, floor, ceil
+import numpy as np
+import numba
+from numba import cuda, config
+from numba.cuda.cudadrv import devicearray, driver, drvapi
+from math import log, floor, ceil, sqrt
+from ctypes import byref
+from functools import lru_cache, partial
+from time import perf_counter_ns
+from types import SimpleNamespace
+import weakref
+
+from utils.parameters import LAYOUTS, OPERATORS, PRECISIONS, layout, magic, operator, precision
 
 SM = 22
+TILE = (8, 32)  # Rows and columns of the tiles of `streaming_tiled`
+REDUCE = 256  # Threads per block of the reductions (`momentum_exchange`), a power of 2
+CU_STREAM_NON_BLOCKING = 0x1  # Flag of `cuStreamCreate`
 
 
 def dispatch(m, n):
@@ -23,98 +36,1033 @@ def dispatch1D(n):
     return threadsperblock, blockspergrid
 
 
-@cuda.jit
-def equilibrium(rho, u, v, t, feq, nx, ny):
-    cv = cuda.const.array_like(v)
-    ct = cuda.const.array_like(t)
-    row, col = cuda.grid(2)
-    if row < nx and col < ny:
-        vx = u[0, row, col]
-        vy = u[1, row, col]
-        usqr = 1.5 * (vx * vx + vy * vy)
-        for i in range(9):
-            cu = 3 * (cv[i, 0] * vx + cv[i, 1] * vy)
-            feq[i, row, col] = rho[row, col] * ct[i] * (1 + cu + 0.5 * cu * cu - usqr)
-
-
-@cuda.jit
-def macroscopic(fin, v, rho, u, nx, ny):
-    cv = cuda.const.array_like(v)
-    row, col = cuda.grid(2)
-    if row < nx and col < ny:
-        trho = float64(0.0)
-        tu0 = float64(0.0)
-        tu1 = float64(0.0)
-        for i in range(9):
-            fvalue = fin[i, row, col]
-            trho += fvalue
-            tu0 += cv[i, 0] * fvalue
-            tu1 += cv[i, 1] * fvalue
-
-        rho[row, col] = trho
-        u[0, row, col] = tu0 / trho
-        u[1, row, col] = tu1 / trho
-
-
-@cuda.jit
-def outflow(fin, nx, ny):
-    col = cuda.grid(1)
-    if col < ny:
-        for i in range(3):
-            fin[6 + i, nx - 1, col] = fin[6 + i, nx - 2, col]
-
-
-@cuda.jit
-def inflow(u, vel, rho, fin, ny):
-    col = cuda.grid(1)
-    if col < ny:
-        u[0, 0, col] = vel[0, 0, col]
-        u[1, 0, col] = vel[1, 0, col]
-        t2 = fin[3, 0, col] + fin[4, 0, col] + fin[5, 0, col]
-        t3 = fin[6, 0, col] + fin[7, 0, col] + fin[8, 0, col]
-        rho[0, col] = (t2 + 2 * t3) / (1 - u[0, 0, col])
-
-
-@cuda.jit
-def update_fin(fin, feq, ny):
-    col = cuda.grid(1)
-    if col < ny:
-        for i in range(3):
-            fin[i, 0, col] = feq[i, 0, col] + fin[8 - i, 0, col] - feq[8 - i, 0, col]
-
-
-@cuda.jit
-def collision(omega, fin, feq, fout, nx, ny):
-    row, col = cuda.grid(2)
-    comega = cuda.const.array_like(omega)
-    if row < nx and col < ny:
-        for i in range(9):
-            vomega = comega[row, col]
-            fout[i, row, col] = (1 - vomega) * fin[i, row, col] + vomega * feq[i, row, col]
-
-
-@cuda.jit
-def bounce_back(fout, fin, obstacle, nx, ny):
-    row, col = cuda.grid(2)
-    if row < nx and col < ny:
-        if obstacle[row, col]:
+def dispatch_reduce(n):
+    """Launch configuration of a reduction over n items: blocks of `REDUCE` threads."""
+    return REDUCE, n // REDUCE + bool(n % REDUCE)
+
+
+def layout_axes(ndim, layout="xy"):
+    """Axes of an array (9, nx, ny), (2, nx, ny) or (nx, ny) in the order they are stored."""
+    axes = LAYOUTS[layout]
+    return axes if ndim == 3 else tuple(a - 1 for a in axes if a != 0)
+
+
+def grid2D(nx, ny, layout="xy"):
+    """Extents of the thread grid of the 2D kernels specialized for `layout`:
+    threads along x follow the axis of the cells which is contiguous in memory.
+    """
+    axes = LAYOUTS[layout]
+    return (ny, nx) if axes.index(2) > axes.index(1) else (nx, ny)
+
+
+def dispatch2D(nx, ny, layout="xy"):
+    """Launch configuration of the 2D kernels specialized for `layout`."""
+    return dispatch(*grid2D(nx, ny, layout))
+
+
+def dispatch_ensemble(nx, ny, members, layout="xy"):
+    """Launch configuration of `ensemble_step`: the grid of `dispatch2D` for each member."""
+    (tx, ty), (bx, by) = dispatch2D(nx, ny, layout)
+    return (tx, ty, 1), (bx, by, members)
+
+
+def dispatch_tiled(nx, ny, layout="xy"):
+    """Launch configuration of `streaming_tiled`: one block of threads per tile of
+    `TILE` cells, threads along x following the axis contiguous in memory."""
+    rows, cols = TILE
+    threadsperblock = (rows, cols)
+    blockspergrid = (nx // rows + bool(nx % rows), ny // cols + bool(ny % cols))
+    if LAYOUTS[layout].index(2) > LAYOUTS[layout].index(1):
+        return threadsperblock[::-1], blockspergrid[::-1]
+    return threadsperblock, blockspergrid
+
+
+def candidates2D(nx, ny, layout="xy"):
+    """Launch configurations of the 2D kernels tried by `utils.autotune.Autotuner`:
+    blocks of 64 to 1024 threads not much larger than the grid, and `dispatch2D`.
+    """
+    m, n = grid2D(nx, ny, layout)
+    configs = [dispatch(m, n)]
+    for size in (64, 128, 256, 512, 1024):
+        for tx in (2 ** a for a in range(11) if 2 ** a <= size):
+            ty = size // tx
+            config = ((tx, ty), (m // tx + bool(m % tx), n // ty + bool(n % ty)))
+            if tx < 2 * m and ty < 2 * n and config not in configs:
+                configs.append(config)
+    return configs
+
+
+def candidates1D(n):
+    """Launch configurations of the 1D kernels tried by `utils.autotune.Autotuner`."""
+    configs = [dispatch1D(n)]
+    for t in (2 ** a for a in range(5, 11)):
+        config = (t, n // t + bool(n % t))
+        if t < 2 * n and config not in configs:
+            configs.append(config)
+    return configs
+
+
+to_device = cuda.to_device
+device_array = cuda.device_array
+synchronize = cuda.synchronize
+
+
+def device_name():
+    if config.ENABLE_CUDASIM:
+        return "SIMULATOR"
+    name = cuda.get_current_device().name
+    return name.decode() if isinstance(name, bytes) else name
+
+
+def use_device(rank, ranks):
+    """Device of the process `rank` out of `ranks` (processes share the GPUs in turn)."""
+    if not config.ENABLE_CUDASIM:
+        cuda.select_device(rank % len(cuda.gpus))
+
+
+def to_host(array):
+    return array.copy_to_host()
+
+
+def logical_view(stored, axes):
+    """View with the usual axes of `stored`, whose axes are in the order `axes`."""
+    inverse = tuple(np.argsort(axes))
+    if config.ENABLE_CUDASIM:
+        return stored.transpose(inverse)
+    shape = tuple(stored.shape[a] for a in inverse)
+    strides = tuple(stored.strides[a] for a in inverse)
+    return devicearray.DeviceNDArray(shape, strides, stored.dtype, gpu_data=stored.gpu_data)
+
+
+def layout_array(array, layout="xy"):
+    """Copy of the host array `array` stored on the device in `layout` and seen
+    with its usual axes (kernels index it as usual)."""
+    axes = layout_axes(array.ndim, layout)
+    return logical_view(cuda.to_device(np.ascontiguousarray(np.transpose(array, axes))), axes)
+
+
+def layout_empty(shape, dtype=np.float64, layout="xy"):
+    """Device array stored in `layout` and seen with its usual axes `shape`."""
+    axes = layout_axes(len(shape), layout)
+    return logical_view(cuda.device_array(tuple(shape[a] for a in axes), dtype), axes)
+
+
+def stored_view(array, layout="xy"):
+    """View of the device array `array` (seen with its usual axes) with its axes in
+    the order they are stored: C-contiguous, it is copied as a whole
+    (`copy_to_host_async`)."""
+    return logical_view(array, tuple(np.argsort(layout_axes(array.ndim, layout))))
+
+
+max_reduce = cuda.reduce(lambda a, b: max(a, b))
+
+
+def amax(array, out):
+    """Maximum of the contiguous device array `array` in `out[0]`, on the device."""
+    max_reduce(array.ravel(), res=out)
+
+
+pinned_empty = cuda.pinned_array
+
+
+def new_stream():
+    """Stream of the copies, which does not synchronize with the default stream
+    (`cuda.stream` does): the kernels launched on the default stream after a copy
+    run while it is in flight, as with cupy. The copies are ordered against the
+    kernels by events only (`copy_to_host_async`, `copy_to_device_async`)."""
+    if config.ENABLE_CUDASIM:
+        return cuda.stream()
+    context = cuda.current_context()
+    if driver.USE_NV_BINDING:
+        handle = driver.driver.cuStreamCreate(CU_STREAM_NON_BLOCKING)
+    else:
+        handle = drvapi.cu_stream()
+        driver.driver.cuStreamCreate(byref(handle), CU_STREAM_NON_BLOCKING)
+    # Destroyed as the streams of `cuda.stream`, with the other resources of the context
+    finalizer = partial(context.deallocations.add_item, driver.driver.cuStreamDestroy, handle)
+    return driver.Stream(weakref.proxy(context), handle, finalizer)
+
+
+def copy_on_device(array, out):
+    """Copy the device array `array` into the device array `out` (same shape, both
+    C-contiguous) on the default stream. Returns `out`."""
+    out.copy_to_device(array)
+    return out
+
+
+def on_stream(kernel, blockspergrid, threadsperblock, stream):
+    """`kernel[blockspergrid, threadsperblock]` launched on `stream` instead of the
+    default stream."""
+    return kernel[blockspergrid, threadsperblock, stream]
+
+
+def copy_to_host_async(array, out, stream, compute=None):
+    """Copy `array` into the pinned host array `out` on `stream`, once the work
+    queued before on `compute` (the default stream without it) is done. Returns
+    the event of the end of the copy.
+    """
+    ready = cuda.event()
+    ready.record(0 if compute is None else compute)
+    ready.wait(stream)
+    array.copy_to_host(out, stream=stream)
+    done = cuda.event()
+    done.record(stream)
+    return done
+
+
+def copy_to_device_async(array, out, stream, compute=None):
+    """Copy the pinned host array `array` into `out` on `stream`: the work queued
+    afterwards on `compute` (the default stream without it) waits for the end of
+    the copy, the host does not.
+    """
+    out.copy_to_device(array, stream=stream)
+    done = cuda.event()
+    done.record(stream)
+    done.wait(0 if compute is None else compute)
+
+
+def record_event():
+    """Event at the current position of the default stream (a time on the simulator,
+    whose event timings are not measured)."""
+    if config.ENABLE_CUDASIM:
+        return perf_counter_ns()
+    event = cuda.event()
+    event.record()
+    return event
+
+
+def elapsed_ns(start, end):
+    """Nanoseconds between two `record_event`."""
+    if config.ENABLE_CUDASIM:
+        return end - start
+    end.synchronize()
+    return int(start.elapsed_time(end) * 1e6)
+
+
+def capture(launch):
+    """Numba cannot capture CUDA graphs: `launch()` calls `launch` again (the
+    kernels are still queued asynchronously, only from Python)."""
+    return SimpleNamespace(launch=launch)
+
+
+@lru_cache(maxsize=None)
+def specialize(precision="float64", layout="xy", relaxation="field", operator="bgk"):
+    """Kernels compiled for a precision of `utils.parameters.PRECISIONS`:
+    `real` is the type of the arithmetic (and of the arrays given to the kernels)
+    and `acc` the type in which the moments are accumulated.
+    With `layout`, threads along x follow the axis of the cells which is
+    contiguous in memory (see `dispatch2D`).
+    With `relaxation="scalar"`, the kernels take `omega` as a single relaxation
+    rate instead of a field (nx, ny) of rates.
+    `operator` is the collision of the kernels which relax the populations, one
+    of `utils.parameters.OPERATORS`.
+    """
+    fast_col = LAYOUTS[layout].index(2) > LAYOUTS[layout].index(1)
+    TR, TC = TILE
+    real, acc = (getattr(numba, name) for name in PRECISIONS[precision])
+
+    # D2Q9 velocities (1 - k // 3, 1 - k % 3) and weights as constants, not
+    # tables read by the kernels
+    @cuda.jit(device=True)
+    def cx(k):
+        return 1 - k // 3
+
+    @cuda.jit(device=True)
+    def cy(k):
+        return 1 - k % 3
+
+    @cuda.jit(device=True)
+    def weight(k):
+        if k == 4:
+            return real(4 / 9)
+        if k % 2 == 1:
+            return real(1 / 9)
+        return real(1 / 36)
+
+    # Relaxation rate of a cell: the same scalar for every cell or a field (nx, ny)
+    if relaxation == "scalar":
+
+        @cuda.jit(device=True)
+        def omega_at(omega, row, col):
+            return omega
+
+    else:
+
+        @cuda.jit(device=True)
+        def omega_at(omega, row, col):
+            return omega[row, col]
+
+    # Collision operator (see `utils.parameters.OPERATORS`): `relax` gives the
+    # population k after the collision from the populations k and 8 - k and their
+    # equilibria (read only with `pairs`), `rate` the relaxation rate of the odd
+    # part (TRT) and `pxx`, `pxy`, `pyy` are the non-equilibrium momentum flux
+    # (regularized)
+    stress = operator == "regularized"
+    pairs = operator == "trt"
+    if operator == "trt":
+
+        @cuda.jit(device=True)
+        def rate(omega):
+            return real(1) / (real(magic) / (real(1) / omega - real(0.5)) + real(0.5))
+
+    else:
+
+        @cuda.jit(device=True)
+        def rate(omega):
+            return omega
+
+    if operator == "trt":
+
+        @cuda.jit(device=True)
+        def relax(f, fo, feq, feqo, omega, odd, k, pxx, pxy, pyy):
+            even = real(0.5) * (f + fo - feq - feqo)
+            return f - omega * even - odd * (f - feq - even)
+
+    elif operator == "regularized":
+
+        @cuda.jit(device=True)
+        def relax(f, fo, feq, feqo, omega, odd, k, pxx, pxy, pyy):
+            qxx = real(cx(k) * cx(k)) - real(1 / 3)
+            qyy = real(cy(k) * cy(k)) - real(1 / 3)
+            qxy = real(cx(k) * cy(k))
+            neq = real(4.5) * weight(k) * (qxx * pxx + real(2) * qxy * pxy + qyy * pyy)
+            return feq + (real(1) - omega) * neq
+
+    elif operator == "bgk":
+
+        @cuda.jit(device=True)
+        def relax(f, fo, feq, feqo, omega, odd, k, pxx, pxy, pyy):
+            return (real(1) - omega) * f + omega * feq
+
+    else:
+        raise ValueError("unknown operator {!r} (expected one of {})".format(operator, OPERATORS))
+
+    @cuda.jit
+    def equilibrium(rho, u, feq, nx, ny):
+        row, col = cuda.grid(2)
+        if fast_col:
+            row, col = col, row
+        if row < nx and col < ny:
+            vx = u[0, row, col]
+            vy = u[1, row, col]
+            usqr = real(1.5) * (vx * vx + vy * vy)
+            for i in range(9):
+                cu = real(3) * (real(cx(i)) * vx + real(cy(i)) * vy)
+                feq[i, row, col] = (
+                    rho[row, col] * weight(i) * (real(1) + cu + real(0.5) * cu * cu - usqr)
+                )
+
+    @cuda.jit
+    def macroscopic(fin, rho, u, nx, ny):
+        row, col = cuda.grid(2)
+        if fast_col:
+            row, col = col, row
+        if row < nx and col < ny:
+            trho = acc(0.0)
+            tu0 = acc(0.0)
+            tu1 = acc(0.0)
+            for i in range(9):
+                fvalue = acc(fin[i, row, col])
+                trho += fvalue
+                tu0 += acc(cx(i)) * fvalue
+                tu1 += acc(cy(i)) * fvalue
+
+            rho[row, col] = trho
+            u[0, row, col] = tu0 / trho
+            u[1, row, col] = tu1 / trho
+
+    @cuda.jit
+    def outflow(fin, nx, ny):
+        col = cuda.grid(1)
+        if col < ny:
+            for i in range(3):
+                fin[6 + i, nx - 1, col] = fin[6 + i, nx - 2, col]
+
+    @cuda.jit
+    def inflow(u, vel, rho, fin, ny):
+        col = cuda.grid(1)
+        if col < ny:
+            u[0, 0, col] = vel[0, 0, col]
+            u[1, 0, col] = vel[1, 0, col]
+            t2 = acc(fin[3, 0, col]) + fin[4, 0, col] + fin[5, 0, col]
+            t3 = acc(fin[6, 0, col]) + fin[7, 0, col] + fin[8, 0, col]
+            rho[0, col] = (t2 + acc(2) * t3) / (acc(1) - u[0, 0, col])
+
+    @cuda.jit
+    def update_fin(fin, feq, ny):
+        col = cuda.grid(1)
+        if col < ny:
+            for i in range(3):
+                fin[i, 0, col] = feq[i, 0, col] + fin[8 - i, 0, col] - feq[8 - i, 0, col]
+
+    @cuda.jit
+    def collision(omega, fin, feq, fout, nx, ny):
+        row, col = cuda.grid(2)
+        if fast_col:
+            row, col = col, row
+        if row < nx and col < ny:
+            vomega = omega_at(omega, row, col)
+            vodd = rate(vomega)
+            pxx = real(0)
+            pxy = real(0)
+            pyy = real(0)
+            if stress:
+                for i in range(9):
+                    fneq = fin[i, row, col] - feq[i, row, col]
+                    pxx += real(cx(i) * cx(i)) * fneq
+                    pxy += real(cx(i) * cy(i)) * fneq
+                    pyy += real(cy(i) * cy(i)) * fneq
+            for i in range(9):
+                fvalue = fin[i, row, col]
+                feqi = feq[i, row, col]
+                fopp, feqo = fvalue, feqi
+                if pairs:
+                    fopp = fin[8 - i, row, col]
+                    feqo = feq[8 - i, row, col]
+                fout[i, row, col] = relax(fvalue, fopp, feqi, feqo, vomega, vodd, i, pxx, pxy, pyy)
+
+    @cuda.jit
+    def bounce_back(fout, fin, obstacle, nx, ny):
+        row, col = cuda.grid(2)
+        if fast_col:
+            row, col = col, row
+        if row < nx and col < ny:
+            if obstacle[row, col]:
+                for i in range(9):
+                    fout[i, row, col] = fin[8 - i, row, col]
+
+    @cuda.jit
+    def bounce_back_cells(fout, fin, cells, n):
+        """`bounce_back` of the n obstacle cells listed in `cells` (2, n) (rows and
+        columns, see `np_obstacle_cells`): a 1D launch over the obstacle only."""
+        c = cuda.grid(1)
+        if c < n:
+            row = cells[0, c]
+            col = cells[1, c]
             for i in range(9):
                 fout[i, row, col] = fin[8 - i, row, col]
 
+    @cuda.jit
+    def streaming_step(fin, fout, nx, ny):
+        row, col = cuda.grid(2)
+        if fast_col:
+            row, col = col, row
+        if row < nx and col < ny:
+            for k in range(9):
+                i = row + cx(k)
+                j = col + cy(k)
+                if i == nx:
+                    i = 0
+                elif i == -1:
+                    i = nx - 1
+                if j == ny:
+                    j = 0
+                elif j == -1:
+                    j = ny - 1
+                fin[k, i, j] = fout[k, row, col]
 
-@cuda.jit
-def streaming_step(fin, fout, v, nx, ny):
-    row, col = cuda.grid(2)
-    if row < nx and col < ny:
+    @cuda.jit
+    def streaming_tiled(fin, fout, rows, cols, nx, ny):
+        """`streaming_step` as a gather through shared memory: each block loads the
+        tile of `fout` it writes with a halo of one cell, and shifts it in the tile
+        (launched with `dispatch_tiled`). `rows` (nx + 2) and `cols` (ny + 2) are
+        the periodic indices of the halo (see `np_halo_indices`).
+        """
+        tile = cuda.shared.array((TR + 2) * (TC + 2), dtype=real)
+        if fast_col:
+            tr, tc = cuda.threadIdx.y, cuda.threadIdx.x
+            top, left = cuda.blockIdx.y * TR, cuda.blockIdx.x * TC
+            thread = tr * TC + tc
+        else:
+            tr, tc = cuda.threadIdx.x, cuda.threadIdx.y
+            top, left = cuda.blockIdx.x * TR, cuda.blockIdx.y * TC
+            thread = tc * TR + tr
+        row = top + tr
+        col = left + tc
         for k in range(9):
-            i = row + v[k, 0]
-            j = col + v[k, 1]
-            if i == nx:
-                i = 0
-            elif i == -1:
-                i = nx - 1
-            if j == ny:
-                j = 0
-            elif j == -1:
-                j = ny - 1
-            fin[k, i, j] = fout[k, row, col]
+            # Tile cell (i, j) is the cell (top + i - 1, left + j - 1) of the lattice
+            for index in range(thread, (TR + 2) * (TC + 2), TR * TC):
+                if fast_col:
+                    i, j = index // (TC + 2), index % (TC + 2)
+                else:
+                    i, j = index % (TR + 2), index // (TR + 2)
+                if top + i <= nx + 1 and left + j <= ny + 1:
+                    tile[i * (TC + 2) + j] = fout[k, rows[top + i], cols[left + j]]
+            cuda.syncthreads()
+            if row < nx and col < ny:
+                fin[k, row, col] = tile[(tr + 1 - cx(k)) * (TC + 2) + tc + 1 - cy(k)]
+            cuda.syncthreads()
+
+    @cuda.jit(device=True)
+    def feq_k(rho, vx, vy, usqr, k):
+        cu = real(3) * (real(cx(k)) * vx + real(cy(k)) * vy)
+        return rho * weight(k) * (real(1) + cu + real(0.5) * cu * cu - usqr)
+
+    @cuda.jit(device=True)
+    def fin_k(fin, rho, vx, vy, usqr, k, row, col, nx):
+        # Population k once `outflow` and `update_fin` are applied to the cell
+        value = fin[k, row, col]
+        if row == nx - 1 and k >= 6:
+            value = fin[k, nx - 2, col]
+        elif row == 0 and k < 3:
+            value = feq_k(rho, vx, vy, usqr, k) + fin[8 - k, 0, col]
+            value -= feq_k(rho, vx, vy, usqr, 8 - k)
+        return value
+
+    @cuda.jit
+    def collide_and_stream(fin, fout, vel, obstacle, omega, rho, u, nx, ny):
+        """`outflow`, `macroscopic`, `inflow`, `equilibrium`, `update_fin`,
+        `collision`, `bounce_back` and `streaming_step` in one pass per cell:
+        `fin` is only read and the next populations are written in `fout`.
+        """
+        row, col = cuda.grid(2)
+        if fast_col:
+            row, col = col, row
+        if row < nx and col < ny:
+            trho = acc(0.0)
+            tu0 = acc(0.0)
+            tu1 = acc(0.0)
+            for i in range(9):
+                fvalue = acc(fin[i, row, col])
+                if row == nx - 1 and i >= 6:
+                    fvalue = acc(fin[i, nx - 2, col])
+                trho += fvalue
+                tu0 += acc(cx(i)) * fvalue
+                tu1 += acc(cy(i)) * fvalue
+
+            vx = real(tu0 / trho)
+            vy = real(tu1 / trho)
+            vrho = real(trho)
+            if row == 0:
+                vx = vel[0, 0, col]
+                vy = vel[1, 0, col]
+                t2 = acc(fin[3, 0, col]) + fin[4, 0, col] + fin[5, 0, col]
+                t3 = acc(fin[6, 0, col]) + fin[7, 0, col] + fin[8, 0, col]
+                vrho = real((t2 + acc(2) * t3) / (acc(1) - vx))
+            rho[row, col] = vrho
+            u[0, row, col] = vx
+            u[1, row, col] = vy
+
+            usqr = real(1.5) * (vx * vx + vy * vy)
+            vomega = omega_at(omega, row, col)
+            vodd = rate(vomega)
+            pxx = real(0)
+            pxy = real(0)
+            pyy = real(0)
+            if stress:
+                for i in range(9):
+                    fneq = fin_k(fin, vrho, vx, vy, usqr, i, row, col, nx)
+                    fneq -= feq_k(vrho, vx, vy, usqr, i)
+                    pxx += real(cx(i) * cx(i)) * fneq
+                    pxy += real(cx(i) * cy(i)) * fneq
+                    pyy += real(cy(i) * cy(i)) * fneq
+            for k in range(9):
+                if obstacle[row, col]:
+                    value = fin_k(fin, vrho, vx, vy, usqr, 8 - k, row, col, nx)
+                else:
+                    fvalue = fin_k(fin, vrho, vx, vy, usqr, k, row, col, nx)
+                    feqk = feq_k(vrho, vx, vy, usqr, k)
+                    fopp, feqo = fvalue, feqk
+                    if pairs:
+                        fopp = fin_k(fin, vrho, vx, vy, usqr, 8 - k, row, col, nx)
+                        feqo = feq_k(vrho, vx, vy, usqr, 8 - k)
+                    value = relax(fvalue, fopp, feqk, feqo, vomega, vodd, k, pxx, pxy, pyy)
+                i = row + cx(k)
+                j = col + cy(k)
+                if i == nx:
+                    i = 0
+                elif i == -1:
+                    i = nx - 1
+                if j == ny:
+                    j = 0
+                elif j == -1:
+                    j = ny - 1
+                fout[k, i, j] = value
+
+    @cuda.jit
+    def ensemble_step(fin, fout, vel, obstacle, omega, rho, u, nx, ny):
+        """`collide_and_stream` on a batch of independent lattices of the same size:
+        every array has a leading axis of members, `vel` is the inflow profile
+        (members, 2, ny) and `omega` has one value per member. The third axis of
+        the grid is the member (see `dispatch_ensemble`).
+        """
+        row, col, m = cuda.grid(3)
+        if fast_col:
+            row, col = col, row
+        if row < nx and col < ny and m < fin.shape[0]:
+            f = fin[m]
+            trho = acc(0.0)
+            tu0 = acc(0.0)
+            tu1 = acc(0.0)
+            for i in range(9):
+                fvalue = acc(f[i, row, col])
+                if row == nx - 1 and i >= 6:
+                    fvalue = acc(f[i, nx - 2, col])
+                trho += fvalue
+                tu0 += acc(cx(i)) * fvalue
+                tu1 += acc(cy(i)) * fvalue
+
+            vx = real(tu0 / trho)
+            vy = real(tu1 / trho)
+            vrho = real(trho)
+            if row == 0:
+                vx = vel[m, 0, col]
+                vy = vel[m, 1, col]
+                t2 = acc(f[3, 0, col]) + f[4, 0, col] + f[5, 0, col]
+                t3 = acc(f[6, 0, col]) + f[7, 0, col] + f[8, 0, col]
+                vrho = real((t2 + acc(2) * t3) / (acc(1) - vx))
+            rho[m, row, col] = vrho
+            u[m, 0, row, col] = vx
+            u[m, 1, row, col] = vy
+
+            usqr = real(1.5) * (vx * vx + vy * vy)
+            vomega = omega[m]
+            vodd = rate(vomega)
+            pxx = real(0)
+            pxy = real(0)
+            pyy = real(0)
+            if stress:
+                for i in range(9):
+                    fneq = fin_k(f, vrho, vx, vy, usqr, i, row, col, nx)
+                    fneq -= feq_k(vrho, vx, vy, usqr, i)
+                    pxx += real(cx(i) * cx(i)) * fneq
+                    pxy += real(cx(i) * cy(i)) * fneq
+                    pyy += real(cy(i) * cy(i)) * fneq
+            for k in range(9):
+                if obstacle[m, row, col]:
+                    value = fin_k(f, vrho, vx, vy, usqr, 8 - k, row, col, nx)
+                else:
+                    fvalue = fin_k(f, vrho, vx, vy, usqr, k, row, col, nx)
+                    feqk = feq_k(vrho, vx, vy, usqr, k)
+                    fopp, feqo = fvalue, feqk
+                    if pairs:
+                        fopp = fin_k(f, vrho, vx, vy, usqr, 8 - k, row, col, nx)
+                        feqo = feq_k(vrho, vx, vy, usqr, 8 - k)
+                    value = relax(fvalue, fopp, feqk, feqo, vomega, vodd, k, pxx, pxy, pyy)
+                i = row + cx(k)
+                j = col + cy(k)
+                if i == nx:
+                    i = 0
+                elif i == -1:
+                    i = nx - 1
+                if j == ny:
+                    j = 0
+                elif j == -1:
+                    j = ny - 1
+                fout[m, k, i, j] = value
+
+    @cuda.jit(device=True)
+    def slab_fin_k(fin, rho, vx, vy, usqr, k, row, col, cell, nx):
+        # `fin_k` of the row `row` of a slab, row `cell` of the lattice
+        value = fin[k, row, col]
+        if cell == nx - 1 and k >= 6:
+            value = fin[k, row - 1, col]
+        elif cell == 0 and k < 3:
+            value = feq_k(rho, vx, vy, usqr, k) + fin[8 - k, row, col]
+            value -= feq_k(rho, vx, vy, usqr, 8 - k)
+        return value
+
+    @cuda.jit
+    def slab_step(fin, fout, vel, obstacle, omega, rho, u, first, last, offset, nx, ny):
+        """`collide_and_stream` of the rows `first` to `last - 1` of a slab of the
+        lattice (see `utils.decomposition`): row r of the arrays (9, m + 2, ny) is
+        the row `offset + r - 1` of the lattice, rows 0 and m + 1 are halos. The
+        populations leaving the slab are written in the halos of `fout`.
+        """
+        row, col = cuda.grid(2)
+        if fast_col:
+            row, col = col, row
+        row += first
+        if row < last and col < ny:
+            cell = offset + row - 1  # Row of the lattice
+            trho = acc(0.0)
+            tu0 = acc(0.0)
+            tu1 = acc(0.0)
+            for i in range(9):
+                fvalue = acc(fin[i, row, col])
+                if cell == nx - 1 and i >= 6:
+                    fvalue = acc(fin[i, row - 1, col])
+                trho += fvalue
+                tu0 += acc(cx(i)) * fvalue
+                tu1 += acc(cy(i)) * fvalue
+
+            vx = real(tu0 / trho)
+            vy = real(tu1 / trho)
+            vrho = real(trho)
+            if cell == 0:
+                vx = vel[0, row, col]
+                vy = vel[1, row, col]
+                t2 = acc(fin[3, row, col]) + fin[4, row, col] + fin[5, row, col]
+                t3 = acc(fin[6, row, col]) + fin[7, row, col] + fin[8, row, col]
+                vrho = real((t2 + acc(2) * t3) / (acc(1) - vx))
+            rho[row, col] = vrho
+            u[0, row, col] = vx
+            u[1, row, col] = vy
+
+            usqr = real(1.5) * (vx * vx + vy * vy)
+            vomega = omega_at(omega, row, col)
+            vodd = rate(vomega)
+            pxx = real(0)
+            pxy = real(0)
+            pyy = real(0)
+            if stress:
+                for i in range(9):
+                    fneq = slab_fin_k(fin, vrho, vx, vy, usqr, i, row, col, cell, nx)
+                    fneq -= feq_k(vrho, vx, vy, usqr, i)
+                    pxx += real(cx(i) * cx(i)) * fneq
+                    pxy += real(cx(i) * cy(i)) * fneq
+                    pyy += real(cy(i) * cy(i)) * fneq
+            for k in range(9):
+                if obstacle[row, col]:
+                    value = slab_fin_k(fin, vrho, vx, vy, usqr, 8 - k, row, col, cell, nx)
+                else:
+                    fvalue = slab_fin_k(fin, vrho, vx, vy, usqr, k, row, col, cell, nx)
+                    feqk = feq_k(vrho, vx, vy, usqr, k)
+                    fopp, feqo = fvalue, feqk
+                    if pairs:
+                        fopp = slab_fin_k(fin, vrho, vx, vy, usqr, 8 - k, row, col, cell, nx)
+                        feqo = feq_k(vrho, vx, vy, usqr, 8 - k)
+                    value = relax(fvalue, fopp, feqk, feqo, vomega, vodd, k, pxx, pxy, pyy)
+                j = col + cy(k)
+                if j == ny:
+                    j = 0
+                elif j == -1:
+                    j = ny - 1
+                fout[k, row + cx(k), j] = value
+
+    @cuda.jit
+    def pack_halos(fout, send, m, ny):
+        """Populations leaving a slab (see `slab_step`), 6 to 8 in the halo row 0 and
+        0 to 2 in the halo row m + 1 of `fout`, gathered in `send` (2, 3, ny) to be
+        copied in one transfer."""
+        col = cuda.grid(1)
+        if col < ny:
+            for k in range(3):
+                send[0, k, col] = fout[6 + k, 0, col]
+                send[1, k, col] = fout[k, m + 1, col]
+
+    @cuda.jit
+    def unpack_halos(fout, recv, m, ny):
+        """Populations entering a slab: 0 to 2 from the previous slab (`recv[0]`) in
+        the row 1 of `fout`, 6 to 8 from the next one (`recv[1]`) in the row m."""
+        col = cuda.grid(1)
+        if col < ny:
+            for k in range(3):
+                fout[k, 1, col] = recv[0, k, col]
+                fout[6 + k, m, col] = recv[1, k, col]
+
+    @cuda.jit(device=True)
+    def sparse_fin_k(fin, rho, vx, vy, usqr, k, c, west, row, nx):
+        # `fin_k` of the cell c of a compacted list
+        value = fin[k, c]
+        if row == nx - 1 and k >= 6:
+            value = fin[k, west]
+        elif row == 0 and k < 3:
+            value = feq_k(rho, vx, vy, usqr, k) + fin[8 - k, c]
+            value -= feq_k(rho, vx, vy, usqr, 8 - k)
+        return value
+
+    @cuda.jit
+    def sparse_step(fin, fout, cells, neighbours, solid, vel, omega, rho, u, n, nx):
+        """`collide_and_stream` on the compacted list of cells of `utils.sparse`:
+        `fin[k, c]` is population k of cell c, at row `cells[0, c]`, and its
+        population k streams to cell `neighbours[k, c]` (the last cell is a sink
+        for the links towards the skipped solid cells). `vel`, `omega` and `solid`
+        are given per cell.
+        """
+        c = cuda.grid(1)
+        if c < n:
+            row = cells[0, c]
+            west = neighbours[7, c]  # Cell (row - 1, col), read by the outflow
+            trho = acc(0.0)
+            tu0 = acc(0.0)
+            tu1 = acc(0.0)
+            for i in range(9):
+                fvalue = acc(fin[i, c])
+                if row == nx - 1 and i >= 6:
+                    fvalue = acc(fin[i, west])
+                trho += fvalue
+                tu0 += acc(cx(i)) * fvalue
+                tu1 += acc(cy(i)) * fvalue
+
+            vx = real(tu0 / trho)
+            vy = real(tu1 / trho)
+            vrho = real(trho)
+            if row == 0:
+                vx = vel[0, c]
+                vy = vel[1, c]
+                t2 = acc(fin[3, c]) + fin[4, c] + fin[5, c]
+                t3 = acc(fin[6, c]) + fin[7, c] + fin[8, c]
+                vrho = real((t2 + acc(2) * t3) / (acc(1) - vx))
+            rho[c] = vrho
+            u[0, c] = vx
+            u[1, c] = vy
+
+            usqr = real(1.5) * (vx * vx + vy * vy)
+            vomega = omega[c]
+            vodd = rate(vomega)
+            pxx = real(0)
+            pxy = real(0)
+            pyy = real(0)
+            if stress:
+                for i in range(9):
+                    fneq = sparse_fin_k(fin, vrho, vx, vy, usqr, i, c, west, row, nx)
+                    fneq -= feq_k(vrho, vx, vy, usqr, i)
+                    pxx += real(cx(i) * cx(i)) * fneq
+                    pxy += real(cx(i) * cy(i)) * fneq
+                    pyy += real(cy(i) * cy(i)) * fneq
+            for k in range(9):
+                if solid[c]:
+                    value = sparse_fin_k(fin, vrho, vx, vy, usqr, 8 - k, c, west, row, nx)
+                else:
+                    fvalue = sparse_fin_k(fin, vrho, vx, vy, usqr, k, c, west, row, nx)
+                    feqk = feq_k(vrho, vx, vy, usqr, k)
+                    fopp, feqo = fvalue, feqk
+                    if pairs:
+                        fopp = sparse_fin_k(fin, vrho, vx, vy, usqr, 8 - k, c, west, row, nx)
+                        feqo = feq_k(vrho, vx, vy, usqr, 8 - k)
+                    value = relax(fvalue, fopp, feqk, feqo, vomega, vodd, k, pxx, pxy, pyy)
+                fout[k, neighbours[k, c]] = value
+
+    @cuda.jit(device=True)
+    def aa_shift(x, c, parity, n):
+        # On odd steps, population with velocity c of cell x is stored in cell x - c
+        y = x
+        if parity == 1:
+            y = x - c
+            if y == n:
+                y = 0
+            elif y == -1:
+                y = n - 1
+        return y
+
+    @cuda.jit(device=True)
+    def aa_slot(k, parity):
+        return k + parity * (8 - 2 * k)
+
+    @cuda.jit
+    def aa_outflow(f, parity, nx, ny):
+        """`outflow` on the single population array of the in-place (AA) pattern."""
+        col = cuda.grid(1)
+        if col < ny:
+            for k in range(6, 9):
+                i = aa_slot(k, parity)
+                y = aa_shift(col, cy(k), parity, ny)
+                x1 = aa_shift(nx - 1, cx(k), parity, nx)
+                x2 = aa_shift(nx - 2, cx(k), parity, nx)
+                f[i, x1, y] = f[i, x2, y]
+
+    @cuda.jit
+    def aa_step(f, parity, vel, obstacle, omega, rho, u, nx, ny):
+        """Same step as `collide_and_stream` but in place on a single population
+        array with the AA access pattern: on even steps (parity 0), a cell reads its
+        populations and writes them back reversed in its own location; on odd steps
+        (parity 1), it reads the reversed populations from its neighbours and writes
+        them streamed in their natural location. `aa_outflow` is applied before.
+        """
+        row, col = cuda.grid(2)
+        if fast_col:
+            row, col = col, row
+        if row < nx and col < ny:
+            trho = acc(0.0)
+            tu0 = acc(0.0)
+            tu1 = acc(0.0)
+            for i in range(9):
+                x = aa_shift(row, cx(i), parity, nx)
+                y = aa_shift(col, cy(i), parity, ny)
+                fvalue = acc(f[aa_slot(i, parity), x, y])
+                trho += fvalue
+                tu0 += acc(cx(i)) * fvalue
+                tu1 += acc(cy(i)) * fvalue
+
+            vx = real(tu0 / trho)
+            vy = real(tu1 / trho)
+            vrho = real(trho)
+            if row == 0:
+                vx = vel[0, 0, col]
+                vy = vel[1, 0, col]
+                t2 = acc(0.0)
+                t3 = acc(0.0)
+                for i in range(3):
+                    y = aa_shift(col, cy(3 + i), parity, ny)
+                    t2 += f[aa_slot(3 + i, parity), 0, y]
+                    x = aa_shift(0, cx(6 + i), parity, nx)
+                    y = aa_shift(col, cy(6 + i), parity, ny)
+                    t3 += f[aa_slot(6 + i, parity), x, y]
+                vrho = real((t2 + acc(2) * t3) / (acc(1) - vx))
+            rho[row, col] = vrho
+            u[0, row, col] = vx
+            u[1, row, col] = vy
+
+            usqr = real(1.5) * (vx * vx + vy * vy)
+            vomega = omega_at(omega, row, col)
+            vodd = rate(vomega)
+            pxx = real(0)
+            pxy = real(0)
+            pyy = real(0)
+            if stress:
+                for i in range(9):
+                    j = i
+                    if row == 0 and i < 3:
+                        j = 8 - i  # Inflow: same flux as the opposite populations
+                    x = aa_shift(row, cx(j), parity, nx)
+                    y = aa_shift(col, cy(j), parity, ny)
+                    fneq = f[aa_slot(j, parity), x, y] - feq_k(vrho, vx, vy, usqr, j)
+                    pxx += real(cx(i) * cx(i)) * fneq
+                    pxy += real(cx(i) * cy(i)) * fneq
+                    pyy += real(cy(i) * cy(i)) * fneq
+            # Populations k and 8 - k swap their locations: they are read and written together
+            for k in range(5):
+                i1 = aa_slot(k, parity)
+                x1 = aa_shift(row, cx(k), parity, nx)
+                y1 = aa_shift(col, cy(k), parity, ny)
+                i2 = aa_slot(8 - k, parity)
+                x2 = aa_shift(row, cx(8 - k), parity, nx)
+                y2 = aa_shift(col, cy(8 - k), parity, ny)
+                a = f[i1, x1, y1]
+                b = f[i2, x2, y2]
+                feqa = feq_k(vrho, vx, vy, usqr, k)
+                feqb = feq_k(vrho, vx, vy, usqr, 8 - k)
+                if row == 0 and k < 3:
+                    a = feqa + b - feqb
+                if obstacle[row, col]:
+                    f[i2, x2, y2] = b
+                    f[i1, x1, y1] = a
+                else:
+                    f[i2, x2, y2] = relax(a, b, feqa, feqb, vomega, vodd, k, pxx, pxy, pyy)
+                    f[i1, x1, y1] = relax(b, a, feqb, feqa, vomega, vodd, 8 - k, pxx, pxy, pyy)
+
+    @cuda.jit
+    def momentum_exchange(f, parity, obstacle, cells, n, force, nx, ny):
+        """Add to `force` (2,) the force of the fluid on the obstacle in the last step
+        (see `np_momentum_exchange`), summed over the n cells of the obstacle next to
+        the fluid listed in `cells` (see `np_boundary_cells`). `parity` is the one of
+        the next step of the in-place scheme, 0 for the other schemes. Each block
+        sums its cells in shared memory (tree reduction, launched with
+        `dispatch_reduce`), then adds its sum to `force` with one atomic per axis.
+        """
+        fx = cuda.shared.array(REDUCE, dtype=numba.float64)
+        fy = cuda.shared.array(REDUCE, dtype=numba.float64)
+        c = cuda.grid(1)
+        thread = cuda.threadIdx.x
+        fx[thread] = 0.0
+        fy[thread] = 0.0
+        if c < n:
+            row = cells[0, c]
+            col = cells[1, c]
+            for k in range(9):
+                # Population k streamed from the cell (row - cx(k), col - cy(k))
+                if not obstacle[aa_shift(row, cx(k), 1, nx), aa_shift(col, cy(k), 1, ny)]:
+                    x = aa_shift(row, cx(k), parity, nx)
+                    y = aa_shift(col, cy(k), parity, ny)
+                    value = numba.float64(f[aa_slot(k, parity), x, y])
+                    fx[thread] += cx(k) * value
+                    fy[thread] += cy(k) * value
+        cuda.syncthreads()
+        half = REDUCE // 2
+        while half > 0:
+            if thread < half:
+                fx[thread] += fx[thread + half]
+                fy[thread] += fy[thread + half]
+            cuda.syncthreads()
+            half = half // 2
+        if thread == 0:
+            cuda.atomic.add(force, 0, 2 * fx[0])
+            cuda.atomic.add(force, 1, 2 * fy[0])
+
+    @cuda.jit
+    def sample_probes(rho, u, cells, weights, m, ring, count):
+        """Density and velocity of the m probes (see `np_sample_probes`, `cells` and
+        `weights` of `np_probe_tables`) in the slot `count[0]` (modulo the number
+        of slots) of `ring` (slots, 3, m), then `count[0]` is incremented. A single
+        block (launched on [1, REDUCE]) strides over the probes: every thread reads
+        the slot before the increment, and the launch needs no argument of the
+        step (it is replayed as is from a CUDA graph).
+        """
+        slot = count[0] % ring.shape[0]
+        p = cuda.threadIdx.x
+        while p < m:
+            r = 0.0
+            vx = 0.0
+            vy = 0.0
+            for c in range(4):
+                row = cells[0, c, p]
+                col = cells[1, c, p]
+                r += weights[c, p] * rho[row, col]
+                vx += weights[c, p] * u[0, row, col]
+                vy += weights[c, p] * u[1, row, col]
+            ring[slot, 0, p] = r
+            ring[slot, 1, p] = vx
+            ring[slot, 2, p] = vy
+            p += cuda.blockDim.x
+        cuda.syncthreads()
+        if cuda.threadIdx.x == 0:
+            count[0] += 1
+
+    @cuda.jit
+    def speed(u, s, nx, ny):
+        row, col = cuda.grid(2)
+        if fast_col:
+            row, col = col, row
+        if row < nx and col < ny:
+            vx = u[0, row, col]
+            vy = u[1, row, col]
+            s[col, row] = sqrt(vx * vx + vy * vy)
+
+    @cuda.jit
+    def to_frame(s, vmax, frame, nx, ny):
+        row, col = cuda.grid(2)
+        if fast_col:
+            row, col = col, row
+        if row < nx and col < ny:
+            frame[col, row] = numba.uint8(s[col, row] / vmax[0] * real(255))
+
+    return SimpleNamespace(
+        equilibrium=equilibrium,
+        macroscopic=macroscopic,
+        outflow=outflow,
+        inflow=inflow,
+        update_fin=update_fin,
+        collision=collision,
+        bounce_back=bounce_back,
+        bounce_back_cells=bounce_back_cells,
+        streaming_step=streaming_step,
+        streaming_tiled=streaming_tiled,
+        collide_and_stream=collide_and_stream,
+        ensemble_step=ensemble_step,
+        slab_step=slab_step,
+        pack_halos=pack_halos,
+        unpack_halos=unpack_halos,
+        sparse_step=sparse_step,
+        aa_outflow=aa_outflow,
+        aa_step=aa_step,
+        momentum_exchange=momentum_exchange,
+        sample_probes=sample_probes,
+        speed=speed,
+        to_frame=to_frame,
+    )
+
+
+kernels = specialize(precision, layout, operator=operator)
+equilibrium = kernels.equilibrium
+macroscopic = kernels.macroscopic
+outflow = kernels.outflow
+inflow = kernels.inflow
+update_fin = kernels.update_fin
+collision = kernels.collision
+bounce_back = kernels.bounce_back
+bounce_back_cells = kernels.bounce_back_cells
+streaming_step = kernels.streaming_step
+streaming_tiled = kernels.streaming_tiled
+collide_and_stream = kernels.collide_and_stream
+ensemble_step = kernels.ensemble_step
+slab_step = kernels.slab_step
+pack_halos = kernels.pack_halos
+unpack_halos = kernels.unpack_halos
+sparse_step = kernels.sparse_step
+aa_outflow = kernels.aa_outflow
+aa_step = kernels.aa_step
+momentum_exchange = kernels.momentum_exchange
+sample_probes = kernels.sample_probes
+speed = kernels.speed
+to_frame = kernels.to_frame
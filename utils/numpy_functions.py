@@ -1,9 +1,9 @@
 import numpy as np
-from utils.parameters import nx, ny
+
 
 def np_macroscopic(fin, v):
     rho = np.sum(fin, axis=0)
-    u = np.zeros((2, nx, ny))
+    u = np.zeros((2,) + fin.shape[1:])
     for i in range(9):
         u[0, :, :] += v[i, 0] * fin[i, :, :]
         u[1, :, :] += v[i, 1] * fin[i, :, :]
@@ -13,7 +13,7 @@ def np_macroscopic(fin, v):
 
 def np_equilibrium(rho, u, v, t):
     usqr = 3 / 2 * (u[0] ** 2 + u[1] ** 2)
-    feq = np.zeros((9, nx, ny))
+    feq = np.zeros((9,) + u.shape[1:])
     for i in range(9):
         cu = 3 * (v[i, 0] * u[0, :, :] + v[i, 1] * u[1, :, :])
         feq[i, :, :] = rho * t[i] * (1 + cu + 0.5 * cu ** 2 - usqr)
@@ -24,6 +24,68 @@ def np_obstacle_fun(x, y, cx, cy, r):
     return (x - cx) ** 2 + (y - cy) ** 2 < r ** 2
 
 
+def np_obstacle_cells(obstacle):
+    """Rows and columns (2, n) of the n cells of `obstacle`, built once for the
+    boundary kernels instead of a test at every cell."""
+    return np.stack(np.nonzero(obstacle)).astype(np.int32)
+
+
+def np_boundary_cells(obstacle, v):
+    """Rows and columns (2, n) of the n cells of `obstacle` next to a fluid cell
+    (periodic edges): the only cells of the obstacle whose populations reach the
+    fluid, those of the momentum exchange (`momentum_exchange`). Their number
+    grows with the perimeter of the obstacle, not its area."""
+    obstacle = np.asarray(obstacle, dtype=bool)
+    fluid = np.zeros(obstacle.shape, dtype=bool)
+    for c in v:
+        fluid |= np.roll(~obstacle, tuple(c), axis=(0, 1))
+    return np_obstacle_cells(obstacle & fluid)
+
+
+def np_momentum_exchange(fin, obstacle, v):
+    """Force (2,) of the fluid on `obstacle` (drag along x, lift along y) by momentum
+    exchange, `fin` being the populations after streaming: population k streamed
+    from a fluid cell into the obstacle is bounced back by the next step, which
+    transfers a momentum 2 c_k f_k to the obstacle."""
+    obstacle, force = np.asarray(obstacle, dtype=bool), np.zeros(2)
+    for k in range(9):
+        # Cells of the obstacle whose population k comes from a fluid cell
+        links = obstacle & np.roll(~obstacle, tuple(v[k]), axis=(0, 1))
+        force += 2 * v[k] * fin[k][links].sum()
+    return force
+
+
+def np_probe_tables(locations, nx, ny, interpolate=True):
+    """Cells (2, 4, m) (rows and columns) and weights (4, m) of m probes at
+    `locations` (m, 2) (lattice coordinates x, y): the four cells around each probe
+    with the weights of the bilinear interpolation, or with `interpolate=False` the
+    nearest cell (weight 1) repeated four times."""
+    locations = np.asarray(locations, dtype=np.float64).reshape(-1, 2)
+    x, y = locations.T
+    if np.any((x < 0) | (x > nx - 1) | (y < 0) | (y > ny - 1)):
+        raise ValueError("probes outside of the lattice {}x{}".format(nx, ny))
+    if not interpolate:
+        x, y = np.rint(x), np.rint(y)
+    x0, y0 = np.floor(x).astype(np.int32), np.floor(y).astype(np.int32)
+    x1, y1 = np.minimum(x0 + 1, nx - 1), np.minimum(y0 + 1, ny - 1)
+    wx, wy = x - x0, y - y0
+    cells = np.stack([np.stack([x0, x1, x0, x1]), np.stack([y0, y0, y1, y1])])
+    weights = np.stack([(1 - wx) * (1 - wy), wx * (1 - wy), (1 - wx) * wy, wx * wy])
+    return cells.astype(np.int32), weights
+
+
+def np_sample_probes(rho, u, cells, weights):
+    """Density and velocity (3, m) of the probes of `np_probe_tables`."""
+    rows, cols = cells
+    return np.stack([np.sum(weights * field[rows, cols], axis=0) for field in (rho, *u)])
+
+
+def np_halo_indices(n):
+    """Indices (n + 2) of the cells -1 to n of a periodic axis of n cells, so that a
+    kernel reads its halo without testing the edges (`streaming_tiled`)."""
+    return (np.arange(-1, n + 1) % n).astype(np.int32)
+
+
 def np_inivel(d, x, y, ly, uLB):
     return (1.0 - d) * uLB * (1.0 + 1e-4 * np.sin(y / ly * 2.0 * np.pi))
 
@@ -49,6 +111,34 @@ def np_collision(fin, feq, omega):
     return fin - omega * (fin - feq)
 
 
+def np_collision_trt(fin, feq, omega, magic):
+    """Two-relaxation-time collision: the even part of the populations (k and
+    8 - k) relaxes with `omega`, the odd part with the rate given by `magic`."""
+    odd = 1 / (magic / (1 / omega - 0.5) + 0.5)
+    neq = fin - feq
+    even = 0.5 * (neq + neq[::-1])
+    return fin - omega * even - odd * (neq - even)
+
+
+def np_collision_regularized(fin, feq, omega, v, t):
+    """Regularized collision: the non-equilibrium part of the populations is
+    rebuilt from its momentum flux before it relaxes with `omega`."""
+    cc = v[:, :, None] * v[:, None, :]
+    flux = np.einsum("kab,k...->ab...", cc, fin - feq)
+    q = cc - np.eye(2) / 3
+    neq = 4.5 * np.einsum("k,kab,ab...->k...", t, q, flux)
+    return feq + (1 - omega) * neq
+
+
+def np_operator_collision(operator, fin, feq, omega, v, t, magic):
+    """Collision of `operator`, one of `utils.parameters.OPERATORS`."""
+    if operator == "trt":
+        return np_collision_trt(fin, feq, omega, magic)
+    if operator == "regularized":
+        return np_collision_regularized(fin, feq, omega, v, t)
+    return np_collision(fin, feq, omega)
+
+
 def np_bounce_back(fout, fin, obstacle):
     for i in range(9):
         fout[i, obstacle] = fin[8 - i, obstacle]
@@ -57,3 +147,122 @@ def np_bounce_back(fout, fin, obstacle):
 def np_streaming_step(fin, fout, v):
     for i in range(9):
         fin[i, :, :] = np.roll(np.roll(fout[i, :, :], v[i, 0], axis=0), v[i, 1], axis=1)
+
+
+def np_streaming_slices(v):
+    """Precompute, for each direction, the (destination, source) slice pairs of
+    the periodic shift done by `np_streaming_step`, so that streaming can be done
+    with slice assignments instead of temporary arrays from `np.roll`.
+    """
+
+    def pieces(s):
+        if s == 1:
+            return [(slice(1, None), slice(None, -1)), (slice(0, 1), slice(-1, None))]
+        if s == -1:
+            return [(slice(None, -1), slice(1, None)), (slice(-1, None), slice(0, 1))]
+        return [(slice(None), slice(None))]
+
+    return [
+        [
+            ((dx, dy), (sx, sy))
+            for (dx, sx) in pieces(v[i, 0])
+            for (dy, sy) in pieces(v[i, 1])
+        ]
+        for i in range(9)
+    ]
+
+
+def np_allocate(nx, ny, dtype=np.float64):
+    """Allocate the buffers `fout`, `feq`, `rho`, `u` and `tmp` reused by `np_step`."""
+    fout = np.zeros((9, nx, ny), dtype=dtype)
+    feq = np.zeros((9, nx, ny), dtype=dtype)
+    rho = np.zeros((nx, ny), dtype=dtype)
+    u = np.zeros((2, nx, ny), dtype=dtype)
+    tmp = np.zeros((2, nx, ny), dtype=dtype)
+    return fout, feq, rho, u, tmp
+
+
+def np_step(fin, fout, feq, rho, u, tmp, vel, obstacle, omega, v, t, slices):
+    """One time step of the simulation done in preallocated buffers.
+
+    It gives the same results as the sequence `np_outflow`, `np_macroscopic`,
+    `np_inflow`, `np_equilibrium`, `np_update_fin`, `np_collision`,
+    `np_bounce_back` and `np_streaming_step` but does not allocate any array.
+    `slices` is given by `np_streaming_slices`.
+    """
+    nx = fin.shape[1]
+
+    # Right wall: outflow condition.
+    # we only need here to specify distrib. function for velocities
+    # that enter the domain (other that go out, are set by the streaming step)
+    fin[6:9, nx - 1, :] = fin[6:9, nx - 2, :]
+
+    # Compute macroscopic variables, density and velocity.
+    np.sum(fin, axis=0, out=rho)
+    u.fill(0.0)
+    for i in range(9):
+        np.multiply(fin[i], v[i, 0], out=tmp[0])
+        np.multiply(fin[i], v[i, 1], out=tmp[1])
+        u += tmp
+    u /= rho
+
+    # Left wall: inflow condition.
+    s1, s2 = tmp[0, 0], tmp[1, 0]
+    u[:, 0, :] = vel[:, 0, :]
+    np.sum(fin[3:6, 0, :], axis=0, out=s1)
+    np.sum(fin[6:9, 0, :], axis=0, out=s2)
+    s2 *= 2
+    s1 += s2
+    np.subtract(1, u[0, 0, :], out=s2)
+    np.divide(1, s2, out=s2)
+    np.multiply(s2, s1, out=rho[0, :])
+
+    # Compute equilibrium.
+    usqr, cu = tmp[0], tmp[1]
+    np.multiply(u[0], u[0], out=usqr)
+    np.multiply(u[1], u[1], out=cu)
+    usqr += cu
+    usqr *= 1.5
+    for i in range(9):
+        np.multiply(u[0], v[i, 0], out=cu)
+        np.multiply(u[1], v[i, 1], out=feq[i])
+        cu += feq[i]
+        cu *= 3
+        np.multiply(cu, cu, out=feq[i])
+        feq[i] *= 0.5
+        cu += 1
+        feq[i] += cu
+        feq[i] -= usqr
+        np.multiply(rho, t[i], out=cu)
+        feq[i] *= cu
+
+    # Incoming populations on the left wall.
+    for i in range(3):
+        np.add(feq[i, 0, :], fin[8 - i, 0, :], out=fin[i, 0, :])
+        fin[i, 0, :] -= feq[8 - i, 0, :]
+
+    # Collision step.
+    np.subtract(fin, feq, out=fout)
+    fout *= omega
+    np.subtract(fin, fout, out=fout)
+
+    # Bounce-back condition for obstacle.
+    for i in range(9):
+        np.copyto(fout[i], fin[8 - i], where=obstacle)
+
+    # Streaming step: periodic shift by slice assignments.
+    for i in range(9):
+        for dst, src in slices[i]:
+            fin[(i,) + dst] = fout[(i,) + src]
+
+
+def np_aa_populations(f, parity, v):
+    """Populations in the usual layout from the single array of the in-place
+    (AA) pattern, `parity` being the one of the next step.
+    """
+    if parity == 0:
+        return f.copy()
+    fin = np.empty_like(f)
+    for i in range(9):
+        fin[i, :, :] = np.roll(np.roll(f[8 - i, :, :], v[i, 0], axis=0), v[i, 1], axis=1)
+    return fin
@@ -12,6 +12,41 @@ nulb = uLB * r / Re
 omega = 1 / (3 * nulb + 0.5)
 # Relaxation parameter.
 
+###### Precision #######################################################
+precision = "float64"  # "float64", "float32" or "mixed".
+# float32: float32 storage and float32 arithmetic.
+# mixed: float32 storage, moments (density, velocity) accumulated in float64.
+PRECISIONS = {
+    "float64": ("float64", "float64"),
+    "float32": ("float32", "float32"),
+    "mixed": ("float32", "float64"),
+}
+dtype = np.dtype(PRECISIONS[precision][0])  # Type of the arrays.
+
+###### Memory layout ##################################################
+layout = "xy"  # "xy", "yx" or "aos".
+# Order in memory of the axes of the populations (9, nx, ny):
+# xy: (9, nx, ny), yx: (9, ny, nx), aos: (nx, ny, 9) (array of structures).
+# Arrays (2, nx, ny) and (nx, ny) follow the same order of nx and ny.
+LAYOUTS = {"xy": (0, 1, 2), "yx": (0, 2, 1), "aos": (1, 2, 0)}
+
+###### Collision operator #############################################
+operator = "bgk"  # "bgk", "trt" or "regularized".
+# bgk: single relaxation time omega.
+# trt: two relaxation times, omega for the even part of the populations (k and
+# 8 - k) and the rate given by the magic parameter for the odd part.
+# regularized: non-equilibrium part projected on the momentum flux before the
+# relaxation (the higher-order moments are filtered out).
+OPERATORS = ("bgk", "trt", "regularized")
+magic = 3 / 16  # Magic parameter of "trt" (1 / omega - 1 / 2) (1 / omega_odd - 1 / 2).
+
+###### Temporal blocking (numba CPU) ##################################
+tile = (64, ny)  # Rows and columns of the tiles of the fused scheme.
+depth = 4  # Steps done on a tile while it is in cache.
+# Each tile is copied with a halo of depth + 1 cells (recomputed by its
+# neighbours), so the lattice is read and written once every `depth` steps.
+# Whole rows keep the loops over the columns long (they are vectorized).
+
 ###### Lattice Constants ###############################################
 v = np.array([[1, 1], [1, 0], [1, -1], [0, 1], [0, 0], [0, -1], [-1, 1], [-1, 0], [-1, -1]])
 t = np.array([1 / 36, 1 / 9, 1 / 36, 1 / 9, 4 / 9, 1 / 9, 1 / 36, 1 / 9, 1 / 36])
@@ -0,0 +1,56 @@
+import queue
+import threading
+
+
+class Pipeline:
+    """`buffers` host buffers filled by the time loop and emptied by a background
+    thread, for the outputs which must not stall the loop (`utils.video.FrameExporter`,
+    `utils.store.FieldWriter`).
+
+    `acquire` gives the index of a free buffer, waiting only while every buffer is
+    in use, and `submit(i, *args)` queues `process(i, *args)` for the thread, which
+    frees the buffer afterwards. An error of `process` does not stop the thread:
+    it is kept, the remaining work is dropped, and it is raised again by the next
+    `acquire` and by `close` instead of leaving them waiting for ever.
+    """
+
+    def __init__(self, process, buffers):
+        self.process = process
+        self.error = None
+        # Indices of the buffers which can be filled, and work waiting for the thread
+        self.free = queue.Queue()
+        for i in range(buffers):
+            self.free.put(i)
+        self.pending = queue.Queue(maxsize=buffers)
+        self.worker = threading.Thread(target=self.work, daemon=True)
+        self.worker.start()
+
+    def acquire(self):
+        i = self.free.get()
+        if self.error is not None:
+            self.free.put(i)
+            raise self.error
+        return i
+
+    def submit(self, i, *args):
+        self.pending.put((i, *args))
+
+    def work(self):
+        while True:
+            item = self.pending.get()
+            if item is None:
+                break
+            try:
+                if self.error is None:
+                    self.process(*item)
+            except Exception as error:
+                self.error = error
+            finally:
+                self.free.put(item[0])
+
+    def close(self):
+        """Wait for the queued work to be done."""
+        self.pending.put(None)
+        self.worker.join()
+        if self.error is not None:
+            raise self.error
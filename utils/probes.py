@@ -0,0 +1,109 @@
+from pathlib import Path
+
+import numpy as np
+
+from utils.numpy_functions import np_probe_tables
+
+
+def add_arguments(parser):
+    """Options of the drivers to sample probes (`Probes`) in a `ProbeLog`."""
+    parser.add_argument(
+        "--probe",
+        nargs=2,
+        type=float,
+        action="append",
+        default=[],
+        metavar=("X", "Y"),
+        help="Sample rho and u at this point (lattice coordinates), can be repeated",
+    )
+    parser.add_argument(
+        "--probe-line",
+        nargs=5,
+        type=float,
+        action="append",
+        default=[],
+        metavar=("X0", "Y0", "X1", "Y1", "N"),
+        help="Sample rho and u at N points of this segment, can be repeated",
+    )
+    parser.add_argument(
+        "--probes-file",
+        default="probes.txt",
+        metavar="FILE",
+        help="Samples of the probes (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--probes-every",
+        type=int,
+        default=100,
+        metavar="N",
+        help="Copy the samples to the host every N iterations (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--nearest", action="store_true", help="Sample the nearest cell instead of interpolating"
+    )
+
+
+class Probes:
+    """Locations where `rho` and `u` are sampled on the device after every step of a
+    `Simulation` (`sample_probes`): `points` (x, y) and `lines` (x0, y0, x1, y1, n)
+    in lattice coordinates, a line being sampled at n evenly spaced points (ends
+    included). The probes are the points, then the points of each line.
+
+    The values are interpolated (bilinear) from the four cells around each probe,
+    or taken at the nearest cell without `interpolate`. The device keeps the
+    samples of the last `slots` steps in a ring buffer, read by `Simulation.samples`.
+    """
+
+    def __init__(self, points=(), lines=(), interpolate=True, slots=100):
+        self.interpolate, self.slots = interpolate, slots
+        locations = [np.asarray(points, dtype=np.float64).reshape(-1, 2)]
+        for x0, y0, x1, y1, n in lines:
+            locations.append(np.linspace((x0, y0), (x1, y1), int(n)))
+        self.locations = np.concatenate(locations)  # (m, 2)
+        # Probes of the points, then of each line
+        bounds = np.cumsum([0] + [len(group) for group in locations])
+        self.groups = [slice(a, b) for a, b in zip(bounds[:-1], bounds[1:])]
+
+    def __len__(self):
+        return len(self.locations)
+
+    def tables(self, nx, ny):
+        """Cells (2, 4, m) and weights (4, m) of the probes (see `np_probe_tables`)."""
+        return np_probe_tables(self.locations, nx, ny, self.interpolate)
+
+    def split(self, values):
+        """Values (..., m) of the probes as the values of the points (..., points)
+        and the list of the values of each line (..., n)."""
+        return values[..., self.groups[0]], [values[..., group] for group in self.groups[1:]]
+
+
+class ProbeLog:
+    """Text file of the samples of `probes`: a header with the location of each
+    probe, then one line per step: the iteration, then rho, ux and uy of each probe.
+    `np.loadtxt(path)` reads the lines back.
+
+    With `resume`, the lines of the iterations from `time` are dropped: a run
+    resumed at `time` writes them again.
+    """
+
+    def __init__(self, path, probes, resume=False, time=0):
+        lines = ["# iteration, then rho ux uy of each probe\n"]
+        lines += [
+            "# probe {} at {:g} {:g}\n".format(i, x, y) for i, (x, y) in enumerate(probes.locations)
+        ]
+        if resume and Path(path).exists():
+            lines = [
+                line
+                for line in Path(path).read_text().splitlines(keepends=True)
+                if line.startswith("#") or int(line.split()[0]) < time
+            ]
+        self.file = open(path, "w")
+        self.file.writelines(lines)
+
+    def write(self, times, values):
+        """Samples `values` (n, 3, m) of the iterations `times` (n,) (`Simulation.samples`)."""
+        rows = np.asarray(values).transpose(0, 2, 1).reshape(len(times), -1)
+        np.savetxt(self.file, np.column_stack([times, rows]), ["%d"] + ["%.9e"] * rows.shape[1])
+
+    def close(self):
+        self.file.close()
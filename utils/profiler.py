@@ -0,0 +1,278 @@
+import json
+from collections import deque
+from types import SimpleNamespace
+
+import numpy as np
+
+from utils.autotune import KERNELS1D
+
+
+def add_trace_arguments(parser):
+    """Option of the drivers to instrument the time loop."""
+    parser.add_argument(
+        "--trace",
+        default=None,
+        metavar="FILE",
+        help="Time every kernel launch and transfer, and write a Chrome trace (Perfetto) in FILE",
+    )
+
+
+def traffic(itemsize):
+    """Bytes read and written by each kernel per cell (per row of a wall for the 1D
+    kernels, per cell of the obstacle for `bounce_back_cells`, per cell of the
+    obstacle next to the fluid for `momentum_exchange`, per probe for
+    `sample_probes`), every value being loaded or stored once and the obstacle a
+    boolean."""
+    return {
+        "outflow": 6 * itemsize,
+        "inflow": (2 + 6 + 2 + 1) * itemsize,
+        "update_fin": (6 + 3 + 3) * itemsize,
+        "macroscopic": (9 + 3) * itemsize,
+        "equilibrium": (3 + 9) * itemsize,
+        "collision": (9 + 9 + 1 + 9) * itemsize,
+        "bounce_back": 1,
+        "bounce_back_cells": (9 + 9) * itemsize + 2 * 4,
+        "streaming_step": (9 + 9) * itemsize,
+        "streaming_tiled": (9 + 9) * itemsize,
+        "collide_and_stream": (9 + 2 + 1 + 9 + 3) * itemsize + 1,
+        "aa_outflow": 6 * itemsize,
+        "aa_step": (9 + 2 + 1 + 9 + 3) * itemsize + 1,
+        "momentum_exchange": 8 * itemsize + 8 + 2 * 4,
+        "sample_probes": 4 * 3 * itemsize + 4 * (2 * 4 + 8) + 3 * 8,
+        "speed": (2 + 1) * itemsize,
+        "to_frame": itemsize + 1,
+    }
+
+
+class Durations:
+    """Durations (ns) of the launches of a kernel, accumulated one by one: count,
+    total, maximum, histogram (log2 bins) and a uniform sample of at most `size`
+    durations for the median and the 95th percentile. The first launch
+    (compilation, autotuning) is kept apart."""
+
+    def __init__(self, size=4096):
+        self.first = None
+        self.count = 0
+        self.total = 0
+        self.max = 0
+        self.bins = {}
+        self.sample = []
+        self.size = size
+        self.rng = np.random.default_rng(0)
+
+    def add(self, ns):
+        if self.first is None:
+            self.first = ns
+            return
+        self.count += 1
+        self.total += ns
+        self.max = max(self.max, ns)
+        b = int(np.floor(np.log2(max(ns, 1))))
+        self.bins[b] = self.bins.get(b, 0) + 1
+        if len(self.sample) < self.size:
+            self.sample.append(ns)
+        else:
+            # Reservoir sampling: every duration is kept with the same probability
+            j = self.rng.integers(self.count)
+            if j < self.size:
+                self.sample[j] = ns
+
+    def summary(self, nbytes):
+        """Statistics of the launches but the first (the first alone if it is the
+        only one), `nbytes` being moved by each launch."""
+        count, total, peak, bins, sample = self.count, self.total, self.max, self.bins, self.sample
+        if not count:
+            # The first launch only
+            b = int(np.floor(np.log2(max(self.first, 1))))
+            count, total, peak, bins, sample = 1, self.first, self.first, {b: 1}, [self.first]
+        ns = np.array(sample, dtype=np.float64)
+        return {
+            "launches": count,
+            "first_us": self.first / 1e3,
+            "total_ms": total / 1e6,
+            "median_us": np.median(ns) / 1e3,
+            "p95_us": np.percentile(ns, 95) / 1e3,
+            "max_us": peak / 1e3,
+            "bytes": int(nbytes * count),
+            "GB/s": nbytes * count / total if total else None,
+            "histogram_ns": {"<2^{}".format(b + 1): n for b, n in sorted(bins.items())},
+        }
+
+
+class Profiler:
+    """Opt-in timings of the kernel launches and of the host-device transfers.
+
+    `wrap` returns the kernels of a namespace with a probe around each launch:
+    two events of `backend` (`record_event`, CUDA events on GPU, `perf_counter_ns`
+    on CPU) are recorded, so the time loop is never synchronised. A driver without
+    `--trace` does not wrap its kernels at all.
+
+    Events are resolved by batches of `batch`, the oldest ones once `batch` newer
+    ones are queued (the launches they time are done by then), into statistics
+    per kernel (`Durations`) and the events of the Chrome trace, of which only
+    the last `window` are kept: the memory does not grow with the run.
+    """
+
+    def __init__(self, backend, nx, ny, dtype, batch=1024, window=100000):
+        self.backend = backend
+        self.traffic = traffic(np.dtype(dtype).itemsize)
+        self.cells = {name: ny if name in KERNELS1D else nx * ny for name in self.traffic}
+        self.batch = batch
+        self.launches = deque()  # (kernel, start, end) not resolved yet
+        self.transfers = deque()  # (name, direction, bytes, start, end), end is None if not timed
+        self.durations = {}  # `Durations` of each kernel
+        self.copied = {}  # Count, bytes and sizes of each transfer
+        self.events = deque(maxlen=window)  # Last events of the Chrome trace
+        self.origin = backend.record_event()
+
+    def wrap(self, kernels):
+        """Copy of the namespace `kernels` whose kernels are probed."""
+        return SimpleNamespace(
+            **{
+                name: Probe(self, name, kernel) if name in self.traffic else kernel
+                for name, kernel in vars(kernels).items()
+            }
+        )
+
+    def launched(self, name, start, end):
+        """Launch of the kernel `name` between the events `start` and `end`."""
+        self.launches.append((name, start, end))
+        if len(self.launches) >= 2 * self.batch:
+            self.resolve(self.batch)
+
+    def transfer(self, name, direction, copy):
+        """`copy` (returning the copied array) timed as a transfer `direction`
+        ("HtoD" or "DtoH")."""
+
+        def timed(*args):
+            start = self.backend.record_event()
+            array = copy(*args)
+            self.copy(name, direction, array.nbytes, start, self.backend.record_event())
+            return array
+
+        return timed
+
+    def copies(self):
+        """Copies of the backend (`to_device`, `layout_array`, `to_host`) timed as transfers."""
+        return SimpleNamespace(
+            to_device=self.transfer("to_device", "HtoD", self.backend.to_device),
+            layout_array=self.transfer("layout_array", "HtoD", self.backend.layout_array),
+            to_host=self.transfer("to_host", "DtoH", self.backend.to_host),
+        )
+
+    def count(self, name, direction, nbytes):
+        """Transfer issued asynchronously: its size is counted, not its duration."""
+        self.copy(name, direction, nbytes, self.backend.record_event(), None)
+
+    def copy(self, name, direction, nbytes, start, end):
+        entry = self.copied.setdefault(
+            "{} {}".format(direction, name), {"count": 0, "bytes": 0, "sizes": {}}
+        )
+        entry["count"] += 1
+        entry["bytes"] += int(nbytes)
+        entry["sizes"][str(nbytes)] = entry["sizes"].get(str(nbytes), 0) + 1
+        self.transfers.append((name, direction, nbytes, start, end))
+        if len(self.transfers) >= 2 * self.batch:
+            self.resolve(self.batch)
+
+    def microseconds(self, start, end):
+        return self.backend.elapsed_ns(start, end) / 1e3
+
+    def resolve(self, keep=0):
+        """Resolve the events of the launches and transfers but the `keep` newest."""
+        while len(self.launches) > keep:
+            name, start, end = self.launches.popleft()
+            ns = self.backend.elapsed_ns(start, end)
+            self.durations.setdefault(name, Durations()).add(ns)
+            self.events.append(
+                {
+                    "name": name,
+                    "cat": "kernel",
+                    "ph": "X",
+                    "pid": 0,
+                    "tid": 0,
+                    "ts": self.microseconds(self.origin, start),
+                    "dur": ns / 1e3,
+                    "args": {"bytes": self.traffic[name] * self.cells[name]},
+                }
+            )
+        while len(self.transfers) > keep:
+            name, direction, nbytes, start, end = self.transfers.popleft()
+            event = {
+                "name": "{} {}".format(direction, name),
+                "cat": "transfer",
+                "pid": 0,
+                "tid": 1,
+                "ts": self.microseconds(self.origin, start),
+                "args": {"bytes": int(nbytes)},
+            }
+            if end is None:
+                event.update(ph="i", s="t")
+            else:
+                event.update(ph="X", dur=self.microseconds(start, end))
+            self.events.append(event)
+
+    def summary(self):
+        """Statistics and histogram (log2 bins of nanoseconds) of each kernel, and
+        number and sizes of the transfers, of the events resolved so far."""
+        stages = {
+            name: durations.summary(self.traffic[name] * self.cells[name])
+            for name, durations in self.durations.items()
+        }
+        return {"kernels": stages, "transfers": self.copied}
+
+    def export(self, path):
+        """Write the Chrome trace (JSON, opened by chrome://tracing or Perfetto) of
+        the last `window` events of the run in `path`, with the summary of the whole
+        run in `otherData`, and return the summary."""
+        self.backend.synchronize()
+        self.resolve()
+        events = [
+            {"name": "thread_name", "ph": "M", "pid": 0, "tid": 0, "args": {"name": "kernels"}},
+            {"name": "thread_name", "ph": "M", "pid": 0, "tid": 1, "args": {"name": "transfers"}},
+        ]
+        summary = self.summary()
+        with open(path, "w") as f:
+            json.dump({"traceEvents": events + list(self.events), "otherData": summary}, f)
+        return summary
+
+    def report(self, summary):
+        """Print the table of `summary` (see `summary`)."""
+        print(
+            "{:>18}  {:>8}  {:>10}  {:>10}  {:>10}  {:>8}".format(
+                "kernel", "launches", "median(us)", "p95(us)", "total(ms)", "GB/s"
+            )
+        )
+        for name, s in summary["kernels"].items():
+            print(
+                "{:>18}  {:>8}  {:>10.1f}  {:>10.1f}  {:>10.1f}  {:>8.2f}".format(
+                    name,
+                    s["launches"],
+                    s["median_us"],
+                    s["p95_us"],
+                    s["total_ms"],
+                    s["GB/s"] or 0,
+                )
+            )
+        for name, s in summary["transfers"].items():
+            print("{:>18}  {:>8}  {:>10} bytes".format(name, s["count"], s["bytes"]))
+
+
+class Probe:
+    """Kernel (or stage function) whose launches are recorded by a `Profiler`."""
+
+    def __init__(self, profiler, name, kernel):
+        self.profiler = profiler
+        self.name = name
+        self.kernel = kernel
+
+    def __getitem__(self, config):
+        # kernel[blockspergrid, threadsperblock] is probed as well
+        return Probe(self.profiler, self.name, self.kernel[config])
+
+    def __call__(self, *args):
+        record_event = self.profiler.backend.record_event
+        start = record_event()
+        result = self.kernel(*args)
+        self.profiler.launched(self.name, start, record_event())
+        return result
@@ -0,0 +1,394 @@
+from functools import partial
+
+import numpy as np
+
+from utils import parameters as defaults
+from utils.autotune import Autotuner, dispatched
+from utils.checkpoint import parameters
+from utils.numpy_functions import (
+    np_boundary_cells,
+    np_halo_indices,
+    np_inivel,
+    np_obstacle_fun,
+)
+
+SCHEMES = ("stages", "fused", "inplace")
+
+# One `Autotuner` per kernel module, shared by the simulations of a process
+tuners = {}
+
+
+def next_output(time, last, frames=0, every=0, intervals=()):
+    """First iteration from `time` (at most `last`) after which a driver writes a
+    frame (iterations multiple of `frames`), another output such as a snapshot or
+    the forces (multiple of one of `intervals`) or a checkpoint (before iterations
+    multiple of `every`), 0 for none: the iterations up to it are done by a single
+    `Simulation.advance`."""
+    outputs = [last]
+    for interval in (frames, *intervals):
+        if interval:
+            outputs.append(time + -time % interval)
+    if every:
+        outputs.append(time + -(time + 1) % every)
+    return min(outputs)
+
+
+class LatticeConfig:
+    """Parameters of a simulation, `utils/parameters.py` giving the defaults.
+
+    The cylinder (`cx`, `cy`, `r`) follows the size of the lattice unless it is
+    given, and `omega` follows `Re`, `uLB` and `r`.
+    """
+
+    def __init__(
+        self,
+        nx=defaults.nx,
+        ny=defaults.ny,
+        Re=defaults.Re,
+        uLB=defaults.uLB,
+        maxIter=defaults.maxIter,
+        precision=defaults.precision,
+        layout=defaults.layout,
+        operator=defaults.operator,
+        cx=None,
+        cy=None,
+        r=None,
+    ):
+        self.nx, self.ny = nx, ny
+        self.Re, self.uLB, self.maxIter = Re, uLB, maxIter
+        self.precision, self.layout, self.operator = precision, layout, operator
+        self.ly = ny - 1
+        self.cx = nx // 4 if cx is None else cx
+        self.cy = ny // 2 if cy is None else cy
+        self.r = ny // 9 if r is None else r
+        nulb = uLB * self.r / Re
+        self.omega = 1 / (3 * nulb + 0.5)
+        self.dtype = np.dtype(defaults.PRECISIONS[precision][0])
+
+    def __repr__(self):
+        return "LatticeConfig({})".format(
+            ", ".join("{}={!r}".format(name, value) for name, value in self.parameters().items())
+        )
+
+    @property
+    def specialization(self):
+        """Key of the compiled kernels (`specialize`): every size shares them, and
+        `omega` is the same scalar for every cell."""
+        return self.precision, self.layout, "scalar", self.operator
+
+    def parameters(self):
+        """Parameters saved in (and checked against) a checkpoint."""
+        return parameters(vars(self))
+
+    def obstacle(self, rows=None):
+        """Mask (nx, ny) of the cylinder, or of its rows `rows` only."""
+        if rows is None:
+            return np.fromfunction(
+                partial(np_obstacle_fun, cx=self.cx, cy=self.cy, r=self.r), (self.nx, self.ny)
+            )
+        x, y = np.ix_(np.asarray(rows, dtype=np.float64), np.arange(self.ny, dtype=np.float64))
+        return np_obstacle_fun(x, y, self.cx, self.cy, self.r)
+
+    def velocity(self, rows=None):
+        """Initial velocity (2, nx, ny), also the inflow condition, or its rows `rows` only."""
+        if rows is None:
+            return np.fromfunction(
+                partial(np_inivel, ly=self.ly, uLB=self.uLB), (2, self.nx, self.ny)
+            )
+        d, x, y = np.ix_(
+            np.arange(2.0), np.asarray(rows, dtype=np.float64), np.arange(self.ny, dtype=np.float64)
+        )
+        return np.broadcast_to(np_inivel(d, x, y, self.ly, self.uLB), (2, x.size, self.ny)).copy()
+
+
+class Simulation:
+    """A simulation of `config` which owns its device arrays, stepped with the
+    kernels of `backend` (`utils.numba_kernels`, `utils.cupy_kernels` or
+    `utils.numba_cpu_kernels`) in `scheme` ("stages", "fused" or "inplace").
+    The numpy reference is not a backend (`utils.numpy_functions.np_step`).
+    """
+
+    def __init__(
+        self,
+        config,
+        backend,
+        scheme="stages",
+        tune=True,
+        fin=None,
+        vel=None,
+        obstacle=None,
+        time=0,
+        profiler=None,
+        tiled=False,
+        blocking=None,
+        forces=False,
+        probes=None,
+        force=None,
+        forces_time=None,
+    ):
+        """With `tiled`, the stages stream through shared-memory tiles
+        (`streaming_tiled`). With `blocking` (`(rows, cols, depth)`, numba CPU kernels
+        and fused scheme), `advance` does `depth` steps per pass over tiles of
+        rows x cols cells (`blocked_step`). With `forces` and `probes`
+        (`utils.probes.Probes`), the force on the obstacle and the samples of the
+        probes are computed on the device after every step.
+
+        Kernels take the size of the lattice as arguments: simulations of any size
+        with the same `config.specialization` launch the same compiled kernels
+        (`backend.specialize` is cached), with their own launch configurations.
+        The state `fin`, `vel`, `obstacle` and `time` saved from a simulation
+        (`populations`) continues it, and with `forces`, `force` and `forces_time`
+        continue the sum of its forces (`forces_state`).
+        """
+        if scheme not in SCHEMES:
+            raise ValueError("unknown scheme {!r} (expected one of {})".format(scheme, SCHEMES))
+        self.config, self.backend, self.scheme, self.time = config, backend, scheme, time
+        self.tiled, self.blocking = tiled, blocking
+        nx, ny, dtype, layout = config.nx, config.ny, config.dtype, config.layout
+
+        self.kernels = backend.specialize(*config.specialization)
+        if blocking is not None and (
+            scheme != "fused" or not hasattr(self.kernels, "blocked_steps")
+        ):
+            raise ValueError("temporal blocking needs the fused scheme of the numba CPU kernels")
+        if blocking is not None and (forces or probes is not None):
+            raise ValueError(
+                "forces and probes are computed after every step, not with temporal blocking"
+            )
+        if tune:
+            if backend.__name__ not in tuners:
+                tuners[backend.__name__] = Autotuner(backend)
+            k = tuners[backend.__name__].tune(self.kernels, nx, ny, config.specialization)
+        else:
+            k = dispatched(backend, self.kernels, nx, ny, layout)
+        self.vel = config.velocity() if vel is None else vel
+        self.obstacle = config.obstacle() if obstacle is None else obstacle
+
+        # Bounce-back of the stages: one thread per cell of the obstacle next to the
+        # fluid, the only cells whose populations reach the fluid. The interior of
+        # the obstacle is set at rest once (see below) and left to the other stages.
+        # The inflow and outflow are already 1D launches over the rows of their wall
+        # column.
+        cells = np_boundary_cells(self.obstacle, defaults.v)
+        threadsperblock, blockspergrid = backend.dispatch1D(max(1, cells.shape[1]))
+        k.bounce_back_cells = self.kernels.bounce_back_cells[blockspergrid, threadsperblock]
+        threadsperblock, blockspergrid = backend.dispatch_tiled(nx, ny, layout)
+        k.streaming_tiled = self.kernels.streaming_tiled[blockspergrid, threadsperblock]
+        # Momentum exchange: one thread per cell of the obstacle next to the fluid, none
+        # without `forces`
+        boundary = cells if forces else np.zeros((2, 0), np.int32)
+        threadsperblock, blockspergrid = backend.dispatch_reduce(max(1, boundary.shape[1]))
+        k.momentum_exchange = self.kernels.momentum_exchange[blockspergrid, threadsperblock]
+        # Probes: cells and weights of each probe, and a ring of `probes.slots` samples
+        # (rho, ux, uy) filled by a single block of threads, none without `probes`
+        if probes is None:
+            tables = np.zeros((2, 4, 0), np.int32), np.zeros((4, 0)), np.zeros((1, 3, 0))
+        else:
+            tables = (*probes.tables(nx, ny), np.zeros((probes.slots, 3, len(probes))))
+        m = tables[0].shape[2]
+        threadsperblock, _ = backend.dispatch_reduce(max(1, m))
+        k.sample_probes = self.kernels.sample_probes[1, threadsperblock]
+        # Kernels and copies are only probed with a `utils.profiler.Profiler`
+        if profiler is not None:
+            profiler.cells["bounce_back_cells"] = cells.shape[1]
+            profiler.cells["momentum_exchange"] = boundary.shape[1]
+            profiler.cells["sample_probes"] = m
+        self.k = k if profiler is None else profiler.wrap(k)
+        self.profiler, self.graph = profiler, None
+        self.copies = backend if profiler is None else profiler.copies()
+        self.d_cells = self.copies.to_device(cells)
+        self.d_rows, self.d_cols = map(self.copies.to_device, map(np_halo_indices, (nx, ny)))
+        self.with_forces = forces
+        self.d_boundary = self.copies.to_device(boundary)
+        # Sum of the forces of the steps since iteration `forces_time` (float64 on any precision)
+        force = np.zeros(2) if force is None else np.array(force, dtype=np.float64)
+        self.d_force = self.copies.to_device(force)
+        self.forces_time = time if forces_time is None else int(np.asarray(forces_time).item())
+        # Sample of iteration `probes_time + i` in the slot i (modulo the number of
+        # slots, counted on the device), `sampled` samples read
+        self.probes, self.probes_time, self.sampled = probes, time, 0
+        self.d_probes = tuple(map(self.copies.to_device, (*tables, np.zeros(1, np.int64))))
+
+        self.d_omega = dtype.type(config.omega)
+        self.d_obstacle, self.d_rho, self.d_vel = (
+            self.copies.layout_array(array, layout)
+            for array in (
+                self.obstacle,
+                np.full((nx, ny), 1.0, dtype=dtype),
+                self.vel.astype(dtype),
+            )
+        )
+        self.d_u = backend.layout_empty((2, nx, ny), dtype, layout)
+        self.d_feq = (
+            backend.layout_empty((9, nx, ny), dtype, layout) if scheme == "stages" else None
+        )
+        self.d_fout = (
+            backend.layout_empty((9, nx, ny), dtype, layout) if scheme != "inplace" else None
+        )
+        if fin is None:
+            self.d_fin = backend.layout_empty((9, nx, ny), dtype, layout)
+            d_vel = self.d_vel
+            if scheme == "stages":
+                # Interior of the obstacle at rest: it only exchanges populations with
+                # itself and the boundary cells, which send them back
+                interior = np.array(self.obstacle, dtype=bool)
+                interior[cells[0], cells[1]] = False
+                vel = self.vel.astype(dtype)
+                vel[:, interior] = 0
+                d_vel = self.copies.layout_array(vel, layout)
+            self.k.equilibrium(self.d_rho, d_vel, self.d_fin, nx, ny)
+        else:
+            self.d_fin = self.copies.layout_array(fin, layout)
+
+    def step(self):
+        """Iteration `time` of the simulation."""
+        k, nx, ny = self.k, self.config.nx, self.config.ny
+        d_fin, d_fout, d_u, d_rho = self.d_fin, self.d_fout, self.d_u, self.d_rho
+        d_vel, d_obstacle, d_omega = self.d_vel, self.d_obstacle, self.d_omega
+        if self.scheme == "fused":
+            k.collide_and_stream(d_fin, d_fout, d_vel, d_obstacle, d_omega, d_rho, d_u, nx, ny)
+            self.d_fin, self.d_fout = d_fout, d_fin
+        elif self.scheme == "inplace":
+            k.aa_outflow(d_fin, self.time % 2, nx, ny)
+            k.aa_step(d_fin, self.time % 2, d_vel, d_obstacle, d_omega, d_rho, d_u, nx, ny)
+        else:
+            d_feq = self.d_feq
+
+            k.outflow(d_fin, nx, ny)
+
+            k.macroscopic(d_fin, d_rho, d_u, nx, ny)
+
+            k.inflow(d_u, d_vel, d_rho, d_fin, ny)
+
+            k.equilibrium(d_rho, d_u, d_feq, nx, ny)
+
+            k.update_fin(d_fin, d_feq, ny)
+
+            k.collision(d_omega, d_fin, d_feq, d_fout, nx, ny)
+
+            k.bounce_back_cells(d_fout, d_fin, self.d_cells, self.d_cells.shape[1])
+
+            if self.tiled:
+                k.streaming_tiled(d_fin, d_fout, self.d_rows, self.d_cols, nx, ny)
+            else:
+                k.streaming_step(d_fin, d_fout, nx, ny)
+        self.time += 1
+        if self.with_forces:
+            # Populations streamed into the obstacle, stored as the next step reads them
+            parity = self.time % 2 if self.scheme == "inplace" else 0
+            k.momentum_exchange(
+                self.d_fin,
+                parity,
+                d_obstacle,
+                self.d_boundary,
+                self.d_boundary.shape[1],
+                self.d_force,
+                nx,
+                ny,
+            )
+        if self.probes is not None:
+            cells, weights, ring, count = self.d_probes
+            k.sample_probes(self.d_rho, self.d_u, cells, weights, cells.shape[2], ring, count)
+
+    def run(self, n):
+        """Iterations `time` to `time + n - 1`."""
+        for _ in range(n):
+            self.step()
+
+    def advance(self, n):
+        """Iterations `time` to `time + n - 1`, as `run` but with Python touched once
+        instead of once per kernel launch: the numba CPU kernels run the n steps in
+        a compiled loop (`*_steps` kernels), and on GPU two steps are captured once
+        (`backend.capture`, a CUDA graph with cupy) and replayed n / 2 times.
+        Kernels are launched one by one with a profiler, to time each of them.
+        """
+        nx, ny = self.config.nx, self.config.ny
+        steps = getattr(self.kernels, self.scheme + "_steps", None)
+        if self.profiler is not None:
+            self.run(n)
+        elif self.blocking is not None:
+            args = self.d_vel, self.d_obstacle, self.d_omega
+            self.kernels.blocked_steps(
+                self.d_fin, self.d_fout, *args, self.d_rho, self.d_u, nx, ny, n, *self.blocking
+            )
+            # One swap of the buffers per pass of `depth` steps
+            if -(-n // self.blocking[2]) % 2:
+                self.d_fin, self.d_fout = self.d_fout, self.d_fin
+            self.time += n
+        elif steps is not None and self.scheme == "fused":
+            args = self.d_vel, self.d_obstacle, self.d_omega
+            forces = self.d_boundary, self.d_force, self.d_probes
+            steps(self.d_fin, self.d_fout, *args, self.d_rho, self.d_u, *forces, nx, ny, n)
+            if n % 2:
+                self.d_fin, self.d_fout = self.d_fout, self.d_fin
+            self.time += n
+        elif steps is not None and self.scheme == "inplace":
+            args = self.d_vel, self.d_obstacle, self.d_omega
+            forces = self.d_boundary, self.d_force, self.d_probes
+            steps(self.d_fin, self.time, *args, self.d_rho, self.d_u, *forces, nx, ny, n)
+            self.time += n
+        elif steps is not None:
+            args = self.d_vel, self.d_omega, self.d_rho, self.d_u
+            tables = self.d_cells, self.d_rows, self.d_cols, self.tiled
+            forces = self.d_obstacle, self.d_boundary, self.d_force, self.d_probes
+            steps(self.d_fin, self.d_fout, self.d_feq, *args, *tables, *forces, nx, ny, n)
+            self.time += n
+        else:
+            # The captured pair starts on an even step (parity of the in-place scheme),
+            # and the first one is launched from Python (launch configurations are
+            # tuned on the first launch of each kernel)
+            first = min(n, self.time % 2 + (2 if self.graph is None else 0))
+            self.run(first)
+            n -= first
+            if n >= 2 and self.graph is None:
+                self.graph = self.backend.capture(self.pair)
+            for _ in range(n // 2):
+                self.graph.launch()
+            self.time += n - n % 2
+            self.run(n % 2)
+
+    def pair(self):
+        # Launches of two steps, the state of `self` (buffers and time) being restored
+        self.run(2)
+        self.time -= 2
+
+    def populations(self):
+        """Populations (9, nx, ny) on the host, as stored by the scheme (the in-place
+        scheme keeps them in swapped slots after an odd number of steps)."""
+        return self.copies.to_host(self.d_fin)
+
+    def velocity(self):
+        """Velocity (2, nx, ny) of the last step on the host."""
+        return self.copies.to_host(self.d_u)
+
+    def forces(self):
+        """Mean force (2,) of the fluid on the obstacle (drag along x, lift along y,
+        in lattice units) per step since the last call. It is summed on the device
+        after every step (`momentum_exchange`): only these two sums are copied to
+        the host, then reset on the device."""
+        force = self.copies.to_host(self.d_force) / max(1, self.time - self.forces_time)
+        self.d_force[:] = 0
+        self.forces_time = self.time
+        return force
+
+    def forces_state(self):
+        """Arrays continuing the sum of the forces in a simulation resumed from a
+        checkpoint (`force` and `forces_time` of the constructor), none without
+        `forces`: a mean of `forces` read after the resume still covers every
+        step since the previous read."""
+        if not self.with_forces:
+            return {}
+        return dict(
+            force=self.copies.to_host(self.d_force), forces_time=np.array([self.forces_time])
+        )
+
+    def samples(self):
+        """Samples of the probes since the last call: iterations (n,) and values
+        (n, 3, m) (rho, ux and uy of each probe). They are sampled after every step
+        into a ring buffer on the device (`sample_probes`), copied in one transfer.
+        Only the last `probes.slots` steps are kept on the device."""
+        ring = self.copies.to_host(self.d_probes[2])
+        count = self.time - self.probes_time
+        indices = np.arange(max(self.sampled, count - len(ring)), count)
+        self.sampled = count
+        return self.probes_time + indices, ring[indices % len(ring)]
@@ -0,0 +1,119 @@
+import numpy as np
+
+from utils import parameters as defaults
+
+
+def sparse_tables(obstacle):
+    """Compacted list of the cells of `obstacle` to simulate, built once.
+
+    These cells are the fluid cells and the solid cells next to a fluid cell
+    (their populations are the ones bounced back to the fluid): the other solid
+    cells never send anything to the fluid. Returns `cells` (2, n) (row and column
+    of each cell, in the order of the lattice), `neighbours` (9, n) (cell reached
+    by each population in the streaming, `n` for a skipped cell), `solid` (n,) and
+    `index` (nx, ny) (cell of each node, `n` when it is skipped).
+    """
+    nx, ny = obstacle.shape
+    if obstacle[0].any() or obstacle[nx - 1].any():
+        raise ValueError("the obstacle must not touch the inflow and outflow walls")
+    fluid = ~obstacle
+    active = np.zeros_like(fluid)
+    for c in defaults.v:
+        active |= np.roll(fluid, c, axis=(0, 1))
+    rows, cols = np.nonzero(active)
+    n = rows.size
+    index = np.full((nx, ny), n, dtype=np.int32)
+    index[rows, cols] = np.arange(n, dtype=np.int32)
+    neighbours = np.stack([index[(rows + cx) % nx, (cols + cy) % ny] for cx, cy in defaults.v])
+    cells = np.stack([rows, cols]).astype(np.int32)
+    return cells, neighbours, obstacle[rows, cols], index
+
+
+class SparseSimulation:
+    """Fused scheme of a `utils.simulation.Simulation` of `config` on the fluid
+    cells only (indirect addressing): `sparse_step` iterates over the compacted
+    list of `sparse_tables`, so that a step costs the fluid volume instead of the
+    whole lattice. The populations of the fluid cells are exactly the ones of
+    the fused scheme; the cells inside the obstacle are not simulated.
+
+    Arrays are stored per cell (9, n + 1), the last cell receiving the
+    populations streamed into the skipped cells.
+    """
+
+    def __init__(self, config, backend, obstacle=None):
+        self.config, self.backend, self.time = config, backend, 0
+        nx, ny, dtype = config.nx, config.ny, config.dtype
+        self.kernels = backend.specialize(config.precision, "xy", operator=config.operator)
+        self.obstacle = config.obstacle() if obstacle is None else obstacle
+        cells, neighbours, solid, self.index = sparse_tables(self.obstacle)
+        self.n = n = cells.shape[1]
+        self.threadsperblock, self.blockspergrid = backend.dispatch1D(n)
+        rows, cols = cells
+
+        # Populations at equilibrium with the initial velocity, as a `Simulation`
+        vel = config.velocity().astype(dtype)
+        threadsperblock, blockspergrid = backend.dispatch2D(nx, ny)
+        d_feq = backend.device_array((9, nx, ny), dtype)
+        self.kernels.equilibrium[blockspergrid, threadsperblock](
+            backend.to_device(np.ones((nx, ny), dtype=dtype)),
+            backend.to_device(vel),
+            d_feq,
+            nx,
+            ny,
+        )
+        fin = np.zeros((9, n + 1), dtype=dtype)
+        fin[:, :n] = backend.to_host(d_feq)[:, rows, cols]
+
+        self.d_cells, self.d_neighbours, self.d_solid = map(
+            backend.to_device, (cells, neighbours, solid)
+        )
+        self.d_vel = backend.to_device(np.ascontiguousarray(vel[:, rows, cols]))
+        self.d_omega = backend.to_device(np.full(n, config.omega, dtype=dtype))
+        self.d_rho = backend.to_device(np.ones(n, dtype=dtype))
+        self.d_u = backend.device_array((2, n), dtype)
+        self.d_fin = backend.to_device(fin)
+        self.d_fout = backend.to_device(fin)
+
+    @property
+    def fraction(self):
+        """Fraction of the lattice simulated."""
+        return self.n / self.obstacle.size
+
+    def step(self):
+        """Iteration `time` of the simulation."""
+        self.kernels.sparse_step[self.blockspergrid, self.threadsperblock](
+            self.d_fin,
+            self.d_fout,
+            self.d_cells,
+            self.d_neighbours,
+            self.d_solid,
+            self.d_vel,
+            self.d_omega,
+            self.d_rho,
+            self.d_u,
+            self.n,
+            self.config.nx,
+        )
+        self.d_fin, self.d_fout = self.d_fout, self.d_fin
+        self.time += 1
+
+    def run(self, n):
+        """Iterations `time` to `time + n - 1`."""
+        for _ in range(n):
+            self.step()
+
+    def scatter(self, array):
+        """`array` (..., n) of the cells on the lattice (..., nx, ny), zero on the
+        skipped cells."""
+        array = self.backend.to_host(array)[..., : self.n]
+        lattice = np.zeros(array.shape[:-1] + self.index.shape, dtype=array.dtype)
+        lattice[..., self.index < self.n] = array
+        return lattice
+
+    def populations(self):
+        """Populations (9, nx, ny) on the host."""
+        return self.scatter(self.d_fin)
+
+    def velocity(self):
+        """Velocity (2, nx, ny) of the last step on the host."""
+        return self.scatter(self.d_u)
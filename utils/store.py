@@ -0,0 +1,329 @@
+import json
+import os
+import zlib
+from pathlib import Path
+
+import numpy as np
+
+from utils import parameters as defaults
+from utils.numpy_functions import np_aa_populations
+from utils.pipeline import Pipeline
+
+# Fields of a snapshot: axes before (nx, ny)
+FIELDS = {"rho": (), "u": (2,), "fin": (9,)}
+STORE_DTYPES = ("float16", "float32", "float64")
+COMPRESSIONS = ("zlib", "none")
+LEVEL = 1  # Level of zlib: the fields are smooth, higher levels gain little
+
+
+def add_arguments(parser):
+    """Options of the drivers to write snapshots of the fields in a `FieldStore`."""
+    parser.add_argument(
+        "--store", default=None, metavar="PATH", help="Write snapshots of rho and u in this store"
+    )
+    parser.add_argument(
+        "--store-every",
+        type=int,
+        default=100,
+        metavar="N",
+        help="Snapshot of rho and u every N iterations (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--store-fin-every",
+        type=int,
+        default=0,
+        metavar="N",
+        help="Snapshot of the populations every N iterations (0: never)",
+    )
+    parser.add_argument(
+        "--store-dtype",
+        choices=STORE_DTYPES,
+        default="float32",
+        help="Type of the stored values (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--store-chunks",
+        type=lambda text: tuple(int(n) for n in text.lower().split("x")),
+        default=None,
+        metavar="ROWSxCOLS",
+        help="Tiles of the stored fields (default: whole fields)",
+    )
+    parser.add_argument(
+        "--store-compression",
+        choices=COMPRESSIONS,
+        default="zlib",
+        help="Compression of the tiles (default: %(default)s)",
+    )
+
+
+def open_store(args, nx, ny, params, resume=False, time=0):
+    """`FieldStore` of the options of `add_arguments` (None without `--store`): a
+    new one, or with `resume` the existing one without its snapshots from
+    iteration `time`."""
+    if args.store is None:
+        return None
+    if resume and (Path(args.store) / ".zgroup").exists():
+        store = FieldStore(args.store)
+        store.truncate(time)
+        return store
+    fields = ("rho", "u") + (("fin",) if args.store_fin_every else ())
+    return FieldStore.create(
+        args.store,
+        nx,
+        ny,
+        fields,
+        args.store_dtype,
+        args.store_chunks,
+        args.store_compression,
+        attrs=params,
+    )
+
+
+def snapshot(args, sim, time):
+    """Arrays of `sim` to store after iteration `time` (see `add_arguments`), with
+    the `parity` of the storage of `fin` (see `FieldWriter.push`)."""
+    arrays = {}
+    if args.store_every and time % args.store_every == 0:
+        arrays.update(rho=sim.d_rho, u=sim.d_u)
+    if args.store_fin_every and time % args.store_fin_every == 0:
+        parity = sim.time % 2 if sim.scheme == "inplace" else 0
+        arrays.update(fin=sim.d_fin, parity=parity)
+    return arrays
+
+
+def write_json(path, value):
+    """Write `value` in `path` atomically: readers see the old or the new file."""
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_text(json.dumps(value, indent=1))
+    os.replace(tmp, path)
+
+
+class FieldStore:
+    """Time series of fields (`rho`, `u` and `fin`, see `FIELDS`) in a directory,
+    one array `(snapshots, ..., nx, ny)` per field.
+
+    The directory is a Zarr group (format 2): `.zarray` describes each array and
+    every chunk (one snapshot, a tile of `chunks` cells and all the components) is
+    a file compressed with zlib or not compressed, so `zarr.open(path)` reads it.
+    `.zattrs` of each array lists the iteration of each snapshot (`times`), the
+    one of the group the parameters of the simulation. Chunks are written before
+    the metadata (replaced atomically), so a snapshot is seen once it is complete.
+    Snapshots stored whole (`chunks=None`) without compression are memory-mapped
+    by `read`.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+
+    @classmethod
+    def create(
+        cls,
+        path,
+        nx,
+        ny,
+        fields=("rho", "u"),
+        dtype="float32",
+        chunks=None,
+        compression="zlib",
+        attrs=None,
+    ):
+        """Empty store of `fields` (nx, ny) stored in `dtype` (values are cast) by
+        tiles of `chunks` (rows, cols) cells (whole fields by default)."""
+        store = cls(path)
+        store.path.mkdir(parents=True, exist_ok=True)
+        write_json(store.path / ".zgroup", {"zarr_format": 2})
+        write_json(store.path / ".zattrs", attrs or {})
+        rows, cols = (nx, ny) if chunks is None else chunks
+        for name in fields:
+            components = FIELDS[name]
+            (store.path / name).mkdir(exist_ok=True)
+            meta = {
+                "zarr_format": 2,
+                "shape": [0, *components, nx, ny],
+                "chunks": [1, *components, min(rows, nx), min(cols, ny)],
+                "dtype": np.dtype(dtype).str,
+                "compressor": {"id": "zlib", "level": LEVEL} if compression == "zlib" else None,
+                "fill_value": 0.0,
+                "order": "C",
+                "filters": None,
+                "dimension_separator": ".",
+            }
+            write_json(store.path / name / ".zarray", meta)
+            dimensions = ["time"] + ["component"] * len(components) + ["x", "y"]
+            write_json(
+                store.path / name / ".zattrs", {"times": [], "_ARRAY_DIMENSIONS": dimensions}
+            )
+        return store
+
+    @property
+    def fields(self):
+        return sorted(p.parent.name for p in self.path.glob("*/.zarray"))
+
+    @property
+    def attrs(self):
+        return json.loads((self.path / ".zattrs").read_text())
+
+    def meta(self, name):
+        return json.loads((self.path / name / ".zarray").read_text())
+
+    def times(self, name):
+        """Iteration of each snapshot of `name`."""
+        return json.loads((self.path / name / ".zattrs").read_text())["times"]
+
+    def key(self, meta, index, i, j):
+        # File of the chunk (i, j) of the snapshot `index`
+        return ".".join(map(str, [index] + [0] * (len(meta["shape"]) - 3) + [i, j]))
+
+    def append(self, name, time, array):
+        """Add `array` (..., nx, ny) as the snapshot of `name` at iteration `time`."""
+        meta = self.meta(name)
+        index = meta["shape"][0]
+        rows, cols = meta["chunks"][-2:]
+        nx, ny = meta["shape"][-2:]
+        array = np.asarray(array).astype(meta["dtype"], copy=False)
+        for i in range(-(-nx // rows)):
+            for j in range(-(-ny // cols)):
+                # Chunks on the edges are padded to the whole chunk shape
+                chunk = np.zeros(meta["chunks"][1:], dtype=meta["dtype"])
+                tile = array[..., i * rows : (i + 1) * rows, j * cols : (j + 1) * cols]
+                chunk[..., : tile.shape[-2], : tile.shape[-1]] = tile
+                data = chunk.tobytes()
+                if meta["compressor"] is not None:
+                    data = zlib.compress(data, meta["compressor"]["level"])
+                (self.path / name / self.key(meta, index, i, j)).write_bytes(data)
+        attrs = json.loads((self.path / name / ".zattrs").read_text())
+        attrs["times"] = attrs["times"][:index] + [time]
+        write_json(self.path / name / ".zattrs", attrs)
+        meta["shape"][0] = index + 1
+        write_json(self.path / name / ".zarray", meta)
+
+    def truncate(self, time):
+        """Keep the snapshots before iteration `time` only (a run resumed at `time`
+        writes the next ones)."""
+        for name in self.fields:
+            meta = self.meta(name)
+            attrs = json.loads((self.path / name / ".zattrs").read_text())
+            attrs["times"] = [t for t in attrs["times"][: meta["shape"][0]] if t < time]
+            meta["shape"][0] = len(attrs["times"])
+            write_json(self.path / name / ".zarray", meta)
+            write_json(self.path / name / ".zattrs", attrs)
+
+    def chunk(self, name, index, i, j, meta=None):
+        """Chunk (i, j) (..., rows, cols) of the snapshot `index` of `name`."""
+        meta = self.meta(name) if meta is None else meta
+        path = self.path / name / self.key(meta, index, i, j)
+        if meta["compressor"] is None:
+            return np.memmap(path, dtype=meta["dtype"], mode="r", shape=tuple(meta["chunks"][1:]))
+        data = zlib.decompress(path.read_bytes())
+        return np.frombuffer(data, dtype=meta["dtype"]).reshape(meta["chunks"][1:])
+
+    def read(self, name, index, rows=slice(None), cols=slice(None)):
+        """Snapshot `index` of `name` (..., nx, ny), or its cells `rows` x `cols`
+        (slices of step 1): only the chunks of these cells are read. A snapshot in a
+        single chunk without compression is a read-only memory map of the file.
+        """
+        meta = self.meta(name)
+        if index < 0:
+            index += meta["shape"][0]
+        if not 0 <= index < meta["shape"][0]:
+            raise IndexError("snapshot {} out of {} of {!r}".format(index, meta["shape"][0], name))
+        nx, ny = meta["shape"][-2:]
+        height, width = meta["chunks"][-2:]
+        r0, r1, _ = rows.indices(nx)
+        c0, c1, _ = cols.indices(ny)
+        if (height, width) == (nx, ny):
+            return self.chunk(name, index, 0, 0, meta)[..., r0:r1, c0:c1]
+        out = np.empty(meta["shape"][1:-2] + [r1 - r0, c1 - c0], dtype=meta["dtype"])
+        for i in range(r0 // height, -(-r1 // height)):
+            for j in range(c0 // width, -(-c1 // width)):
+                chunk = self.chunk(name, index, i, j, meta)
+                # Cells of the chunk in the window, in the chunk and in `out`
+                a0, a1 = max(r0, i * height), min(r1, (i + 1) * height)
+                b0, b1 = max(c0, j * width), min(c1, (j + 1) * width)
+                out[..., a0 - r0 : a1 - r0, b0 - c0 : b1 - c0] = chunk[
+                    ..., a0 - i * height : a1 - i * height, b0 - j * width : b1 - j * width
+                ]
+        return out
+
+
+class FieldWriter:
+    """Appends snapshots of device arrays to a `FieldStore` without stalling the
+    time loop (as `utils.video.FrameExporter` for the frames).
+
+    The arrays are first copied on the device into one of `buffers` sets of device
+    buffers, then on a separate stream into the pinned host buffers of that set, in
+    the order they are stored (`layout`), then cast, tiled, compressed and written by
+    a background thread (`utils.pipeline.Pipeline`). The steps launched after `push`
+    only wait for the copy on the device: the simulation overwrites its arrays while
+    the copy to the host is in flight. `push` only waits when every set of buffers
+    is still in use. With `backend=None`, the arrays are numpy arrays of the host
+    (layout "xy"), copied before `push` returns.
+    """
+
+    def __init__(self, store, backend, nx, ny, dtype, layout="xy", buffers=2, profiler=None):
+        self.store = store
+        self.backend = backend
+        self.layout = layout
+        empty = np.empty if backend is None else backend.pinned_empty
+        self.shapes = {name: FIELDS[name] + (nx, ny) for name in store.fields}
+        self.axes = {
+            name: (
+                tuple(range(len(shape)))
+                if backend is None
+                else backend.layout_axes(len(shape), layout)
+            )
+            for name, shape in self.shapes.items()
+        }
+        self.pinned = [
+            {
+                name: empty(tuple(shape[a] for a in self.axes[name]), dtype)
+                for name, shape in self.shapes.items()
+            }
+            for _ in range(buffers)
+        ]
+        self.stream = None if backend is None else backend.new_stream()
+        # Copies on the device of the arrays being copied to the host (none without a
+        # stream: the copies to the host are done before `push` returns)
+        self.staging = [
+            None
+            if self.stream is None
+            else {name: backend.device_array(array.shape, dtype) for name, array in pinned.items()}
+            for pinned in self.pinned
+        ]
+        self.profiler = profiler  # `utils.profiler.Profiler` counting the copies, if any
+        self.pipeline = Pipeline(self.work, buffers)
+
+    def push(self, time, parity=0, **arrays):
+        """Queue the snapshot at iteration `time` of `arrays` (device arrays with
+        their usual axes, e.g. `rho=sim.d_rho, u=sim.d_u`). `fin` given as the
+        single array of the in-place scheme, with the `parity` of its next step, is
+        stored as the usual populations (`np_aa_populations`). An error of the store
+        on a previous snapshot is raised here."""
+        i = self.pipeline.acquire()
+        done = []
+        for name, array in arrays.items():
+            out = self.pinned[i][name]
+            if self.backend is None:
+                np.copyto(out, array)
+                continue
+            view = self.backend.stored_view(array, self.layout)
+            if self.staging[i] is not None:
+                view = self.backend.copy_on_device(view, self.staging[i][name])
+            done.append(self.backend.copy_to_host_async(view, out, self.stream))
+            if self.profiler is not None:
+                self.profiler.count("snapshot", "DtoH", out.nbytes)
+        self.pipeline.submit(i, time, parity, list(arrays), done)
+
+    def work(self, i, time, parity, names, done):
+        for event in done:
+            if event is not None:
+                event.synchronize()
+        for name in names:
+            array = np.transpose(self.pinned[i][name], np.argsort(self.axes[name]))
+            if name == "fin" and parity:
+                array = np_aa_populations(array, parity, defaults.v)
+            self.store.append(name, time, array)
+
+    def close(self):
+        """Wait for the queued snapshots to be written (raises an error of the store)."""
+        self.pipeline.close()
@@ -0,0 +1,53 @@
+import numpy as np
+
+from utils.pipeline import Pipeline
+
+
+class FrameExporter:
+    """Exports the velocity magnitude as video frames without stalling the time loop.
+
+    The magnitude is reduced on the device to a uint8 frame `(ny, nx)` normalised
+    by its maximum. The frame is copied on a separate stream (which does not
+    synchronize with the kernels of the default stream) into one of `buffers`
+    pinned host buffers, then `write(frame)` (colormap and encoding) runs in a
+    background thread (`utils.pipeline.Pipeline`). `push` only waits when every
+    buffer is still in use.
+    """
+
+    def __init__(
+        self, backend, kernels, write, nx, ny, dtype, layout="xy", buffers=2, profiler=None
+    ):
+        self.backend = backend
+        self.kernels = kernels
+        self.write = write
+        self.nx, self.ny = nx, ny
+        self.threadsperblock, self.blockspergrid = backend.dispatch2D(nx, ny, layout)
+        self.speed = backend.device_array((ny, nx), dtype)
+        self.vmax = backend.device_array(1, dtype)
+        self.frames = [backend.device_array((ny, nx), np.uint8) for _ in range(buffers)]
+        self.pinned = [backend.pinned_empty((ny, nx), np.uint8) for _ in range(buffers)]
+        self.stream = backend.new_stream()
+        self.profiler = profiler  # `utils.profiler.Profiler` counting the copies, if any
+        self.pipeline = Pipeline(self.work, buffers)
+
+    def push(self, u):
+        """Queue the frame of the velocity `u` (device array `(2, nx, ny)`). An
+        error of `write` on a previous frame is raised here."""
+        i = self.pipeline.acquire()
+        bpg, tpb = self.blockspergrid, self.threadsperblock
+        self.kernels.speed[bpg, tpb](u, self.speed, self.nx, self.ny)
+        self.backend.amax(self.speed, self.vmax)
+        self.kernels.to_frame[bpg, tpb](self.speed, self.vmax, self.frames[i], self.nx, self.ny)
+        done = self.backend.copy_to_host_async(self.frames[i], self.pinned[i], self.stream)
+        if self.profiler is not None:
+            self.profiler.count("frame", "DtoH", self.pinned[i].nbytes)
+        self.pipeline.submit(i, done)
+
+    def work(self, i, done):
+        if done is not None:
+            done.synchronize()
+        self.write(self.pinned[i])
+
+    def close(self):
+        """Wait for the queued frames to be written (raises an error of `write`)."""
+        self.pipeline.close()